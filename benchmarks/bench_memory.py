@@ -0,0 +1,75 @@
+# 内存占用：StyleStore 加载样式库后常驻内存 (RSS) 的增量与加载过程的峰值。
+# 每个规模、每种表示在独立进程中测量：
+#   dict   —— 每个样式保存为 json.load 得到的 dict（改用紧凑记录之前的形式）
+#   record —— __slots__ 记录，分类和提示词通过字符串池共享
+import gc
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import load_extension, make_library, write_library
+
+SIZES = [int(arg) for arg in sys.argv[1:] if arg.isdigit()] or [10000, 100000, 1000000]
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PlainStyle(dict):
+    def __init__(self, style, pool=None):
+        super().__init__(style)
+
+    # 存储内部按属性访问字段（record.id、record.image），这里转到 dict 的键上
+    def __getattr__(self, name):
+        return self.get(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+def measure(mode, path):
+    module = load_extension(os.path.dirname(path))
+    # 只比较解析后的常驻内存，两种表示都不写快照
+    module.StyleStore._save_snapshot = lambda self, *args, **kwargs: None
+    if mode == "dict":
+        module.StyleRecord = PlainStyle
+    gc.collect()
+    before = rss_bytes()
+    started = time.perf_counter()
+    store = module.StyleStore(module.stylespath, module.categoriespath, module.style_writer)
+    store.refresh()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    resident = rss_bytes() - before
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - before
+    print(f"{resident} {peak} {elapsed}")
+
+
+def run_child(mode, path):
+    output = subprocess.run([sys.executable, __file__, "--child", mode, path],
+                            check=True, capture_output=True, text=True).stdout
+    resident, peak, elapsed = output.split()[-3:]
+    return int(resident), int(peak), float(elapsed)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        measure(sys.argv[2], sys.argv[3])
+        return
+    print(f"{'styles':>8} {'dict (MB)':>10} {'record (MB)':>12} {'saved':>7} {'dict peak':>10} {'record peak':>12} "
+          f"{'dict load (s)':>14} {'record load (s)':>16}")
+    for size in SIZES:
+        path = write_library(tempfile.mkdtemp(), make_library(size))
+        (dict_rss, dict_peak, dict_load), (record_rss, record_peak, record_load) = run_child("dict", path), run_child("record", path)
+        mb = 1024 * 1024
+        print(f"{size:>8} {dict_rss / mb:>10.1f} {record_rss / mb:>12.1f} {1 - record_rss / dict_rss:>7.0%} "
+              f"{dict_peak / mb:>10.1f} {record_peak / mb:>12.1f} {dict_load:>14.2f} {record_load:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
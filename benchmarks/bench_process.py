@@ -0,0 +1,55 @@
+# StyleSelectorXL.process 对大批量提示词的耗时：逐条 createPositive/createNegative vs 预编译批量套用
+import json
+import sys
+import tempfile
+import types
+
+from common import load_extension, make_library, timeit, write_library
+
+PROMPTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+LIBRARY = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+
+def make_job(count):
+    return types.SimpleNamespace(
+        all_prompts=[f"a photo of subject {i % 50}" for i in range(count)],
+        all_negative_prompts=["lowres, bad anatomy"] * count,
+        extra_generation_params={},
+    )
+
+
+def legacy_apply(path, style, prompt):
+    # 原实现：每条提示词都重新解析 JSON 并线性查找样式
+    with open(path, "rt", encoding="utf-8") as file:
+        data = json.load(file)
+    for template in data:
+        if template.get("name") == style:
+            base_prompt = template.get("prompt", "")
+            return f"{prompt}, {base_prompt}" if prompt and base_prompt else base_prompt or prompt
+    return prompt
+
+
+def main():
+    with tempfile.TemporaryDirectory() as basedir:
+        styles = make_library(LIBRARY)
+        path = write_library(basedir, styles)
+        ext = load_extension(basedir)
+        script = ext.StyleSelectorXL()
+        style = styles[LIBRARY // 2]["name"]
+
+        legacy_sample = 20
+        legacy = timeit(lambda: legacy_apply(path, style, "a photo"), repeat=legacy_sample) * PROMPTS * 2
+
+        def run_process():
+            script.process(make_job(PROMPTS), True, style)
+        compiled = timeit(run_process, repeat=50)
+
+        print(f"library={LIBRARY} prompts={PROMPTS}")
+        print(f"legacy per-prompt (estimated): {legacy * 1e3:10.2f} ms")
+        print(f"compiled batch process:        {compiled * 1e3:10.2f} ms")
+        # 临时目录删除之前把使用统计等排队中的写入落盘，否则退出时 atexit 写入已删除的目录会报错
+        ext.flush_style_store()
+
+
+if __name__ == "__main__":
+    main()
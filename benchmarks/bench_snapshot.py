@@ -0,0 +1,47 @@
+# 加载耗时：解析 sdxl_styles.json（冷启动）与读取二进制快照的对比。
+# 每次加载在独立进程中进行；冷启动前删除快照，冷启动结束时会写出快照供第二次加载使用
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import load_extension, make_library, write_library
+
+SIZES = [int(arg) for arg in sys.argv[1:] if arg.isdigit()] or [10000, 100000, 1000000]
+
+
+def measure(mode, basedir):
+    module = load_extension(basedir)
+    store = module.StyleStore(module.stylespath, module.categoriespath, module.style_writer)
+    if mode == "cold" and os.path.exists(store.snapshot_path):
+        os.remove(store.snapshot_path)
+    started = time.perf_counter()
+    store.refresh()
+    print(time.perf_counter() - started)
+
+
+def run_child(mode, basedir):
+    output = subprocess.run([sys.executable, __file__, "--child", mode, basedir],
+                            check=True, capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        measure(sys.argv[2], sys.argv[3])
+        return
+    print(f"{'styles':>8} {'cold parse (s)':>15} {'snapshot (s)':>13} {'speedup':>8} {'json (MB)':>10} {'snapshot (MB)':>14}")
+    for size in SIZES:
+        basedir = tempfile.mkdtemp()
+        path = write_library(basedir, make_library(size))
+        cold = run_child("cold", basedir)
+        warm = run_child("snapshot", basedir)
+        mb = 1024 * 1024
+        snapshot_size = os.path.getsize(os.path.splitext(path)[0] + ".snapshot")
+        print(f"{size:>8} {cold:>15.2f} {warm:>13.2f} {cold / warm:>7.1f}x "
+              f"{os.path.getsize(path) / mb:>10.1f} {snapshot_size / mb:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
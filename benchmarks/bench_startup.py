@@ -0,0 +1,81 @@
+# 启动耗时：分别构建不含插件和含插件的 txt2img、img2img 标签页，added 为插件导入和界面构建
+# 给 WebUI 启动增加的阻塞耗时；ready 为后台加载样式库完成的时间，eager load 为旧做法同步解析的耗时。
+# 每个规模在独立进程中测量，避免导入缓存影响结果
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+from common import load_extension, make_library, write_library
+
+SIZES = [int(arg) for arg in sys.argv[1:] if arg.isdigit()] or [1000, 20000, 100000]
+
+
+def build_tabs(module=None):
+    # 构建 txt2img、img2img 两个标签页中 WebUI 自带的提示词输入框；传入 module 时同时构建插件界面，
+    # 两次结果之差就是插件给界面构建增加的耗时
+    import gradio as gr
+
+    started = time.perf_counter()
+    with gr.Blocks():
+        for is_img2img in (False, True):
+            with gr.Tab("img2img" if is_img2img else "txt2img"):
+                prompt, negative_prompt = gr.Textbox(), gr.Textbox()
+                if module is None:
+                    continue
+                # WebUI 通过 after_component 传入的提示词输入框
+                script = module.StyleSelectorXL()
+                script.boxx, script.neg_prompt_boxTXT = prompt, negative_prompt
+                script.boxxIMG, script.neg_prompt_boxIMG = prompt, negative_prompt
+                script.ui(is_img2img)
+    return time.perf_counter() - started
+
+
+def measure(size):
+    import gradio as gr
+
+    warnings.filterwarnings("ignore")
+    basedir = tempfile.mkdtemp()
+    write_library(basedir, make_library(size))
+
+    # Gradio 第一次构建界面时的一次性初始化不计入任何一项
+    with gr.Blocks():
+        gr.HTML("")
+    # 不加载插件时构建同样的两个标签页
+    host_time = build_tabs()
+
+    started = time.perf_counter()
+    module = load_extension(basedir)
+    import_time = time.perf_counter() - started
+    ui_time = build_tabs(module)
+    startup = time.perf_counter() - started
+    added = startup - host_time
+    module.style_store.ready.wait()
+    ready = time.perf_counter() - started
+
+    # 旧做法：构建界面前同步解析样式库
+    store = module.StyleStore(module.stylespath, module.categoriespath, module.style_writer)
+    started = time.perf_counter()
+    store.refresh()
+    categories = store.category_names()
+    store.names(categories[0])
+    eager = time.perf_counter() - started
+
+    print(f"{size:>8} {host_time * 1000:>12.1f} {import_time * 1000:>11.1f} {ui_time * 1000:>14.1f} "
+          f"{added * 1000:>10.1f} {ready * 1000:>12.1f} {eager * 1000:>15.1f}")
+    module.flush_style_store()
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        measure(int(sys.argv[2]))
+        return
+    print(f"{'styles':>8} {'tabs (ms)':>12} {'import (ms)':>11} {'tabs+ext (ms)':>14} "
+          f"{'added (ms)':>10} {'ready (ms)':>12} {'eager load (ms)':>15}")
+    for size in SIZES:
+        subprocess.run([sys.executable, __file__, "--child", str(size)], check=True)
+
+
+if __name__ == "__main__":
+    main()
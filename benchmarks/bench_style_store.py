@@ -0,0 +1,46 @@
+# 样式查找延迟与样式库规模的关系：逐次重新解析 JSON vs StyleStore 内存索引
+import json
+import sys
+import tempfile
+
+from common import load_extension, make_library, timeit, write_library
+
+SIZES = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000, 100000]
+
+
+def reparse_lookup(path, name):
+    with open(path, "rt", encoding="utf-8") as file:
+        data = json.load(file)
+    for item in data:
+        if item.get("name") == name:
+            return item
+    return None
+
+
+def main():
+    print(f"{'styles':>8} {'reparse (ms)':>14} {'store.get (us)':>15} {'names (us)':>11} {'reload (ms)':>12}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as basedir:
+            styles = make_library(size)
+            path = write_library(basedir, styles)
+            ext = load_extension(basedir)
+            store = ext.style_store
+            store.refresh()
+            target = styles[-1]["name"]
+            category = styles[-1]["category"]
+
+            reparse = timeit(lambda: reparse_lookup(path, target), repeat=3)
+            lookup = timeit(lambda: store.get(target), repeat=2000)
+            names = timeit(lambda: store.names(category), repeat=200)
+
+            def reload():
+                store.signature = None
+                store.refresh()
+            reload_time = timeit(reload, repeat=3)
+
+            print(f"{size:>8} {reparse * 1e3:>14.2f} {lookup * 1e6:>15.2f} {names * 1e6:>11.2f} {reload_time * 1e3:>12.2f}")
+            ext.flush_style_store()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# 基准测试公共工具：在没有完整 WebUI 的环境中加载样式选择器脚本
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_PATH = os.path.join(REPO_ROOT, "scripts", "Defining style.py")
+STUBS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+
+
+def install_webui_stubs(basedir):
+    # 用 stubs/modules 中的替身代替 WebUI 的 modules 包；插件目录在导入脚本前设置
+    if STUBS_PATH not in sys.path:
+        sys.path.insert(0, STUBS_PATH)
+    import modules.scripts
+
+    modules.scripts._basedir = basedir
+
+
+def load_extension(basedir):
+    install_webui_stubs(basedir)
+    spec = importlib.util.spec_from_file_location("defining_style", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["defining_style"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_library(count, categories=20, seed=0):
+    rng = random.Random(seed)
+    words = ["cinematic", "lighting", "portrait", "bokeh", "film grain", "neon", "watercolor",
+             "octane render", "35mm", "soft focus", "golden hour", "studio", "anime", "ultra detailed"]
+    styles = []
+    for i in range(count):
+        styles.append({
+            "name": f"style-{i:07d}",
+            "prompt": "{prompt}, " + ", ".join(rng.sample(words, 4)),
+            "negative_prompt": ", ".join(rng.sample(words, 3)),
+            "category": f"category-{i % categories:03d}",
+        })
+    return styles
+
+
+def write_library(basedir, styles):
+    path = os.path.join(basedir, "sdxl_styles.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(styles, file, ensure_ascii=False, indent=2)
+    return path
+
+
+def timeit(fn, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
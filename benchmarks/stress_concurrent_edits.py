@@ -0,0 +1,102 @@
+# 并发修改压力测试：多个线程、多个进程同时增删改样式，并对同一个样式做"读取-加一-写回"计数，
+# 最后在新进程中重新加载样式库，检查没有丢失任何修改
+import multiprocessing
+import sys
+import tempfile
+
+from common import load_extension, write_library
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+PROCESSES = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+OPS = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+
+def increment(module, name):
+    # 乐观并发：带着读取时的版本提交，冲突时重新读取再试
+    while True:
+        version = module.style_store.version
+        count = int(module.style_store.get(name)["prompt"])
+        ok, message = module.modify_style(name, str(count + 1), "", "shared", expected_version=version)
+        if ok:
+            return
+        if message != module.STYLE_CONFLICT_MESSAGE:
+            raise RuntimeError(message)
+
+
+def edit(module, prefix, errors):
+    for i in range(OPS):
+        name = f"{prefix}-{i}"
+        steps = [
+            module.add_style(name, "{prompt}, v1", "", "stress"),
+            module.modify_style(name, f"{{prompt}}, v{i}", "", "stress"),
+        ]
+        if i % 3 == 0:
+            steps.append(module.delete_style(name))
+        errors.extend(message for ok, message in steps if not ok)
+        increment(module, "shared")
+
+
+def worker(basedir, process_index, queue):
+    import threading
+
+    module = load_extension(basedir)
+    module.style_store.COMPACT_EVERY = 40
+    errors = []
+    threads = [threading.Thread(target=edit, args=(module, f"p{process_index}-t{k}", errors)) for k in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    module.flush_style_store()
+    queue.put(errors)
+
+
+def verify(basedir, queue):
+    module = load_extension(basedir)
+    lost = []
+    for process_index in range(PROCESSES):
+        for k in range(THREADS):
+            for i in range(OPS):
+                name = f"p{process_index}-t{k}-{i}"
+                style = module.style_store.get(name)
+                if i % 3 == 0:
+                    if style is not None:
+                        lost.append(f"{name} 应已删除")
+                elif style is None or style["prompt"] != f"{{prompt}}, v{i}":
+                    lost.append(f"{name} 丢失或内容错误")
+    count = int(module.style_store.get("shared")["prompt"])
+    expected = PROCESSES * THREADS * OPS
+    if count != expected:
+        lost.append(f"计数为 {count}，应为 {expected}")
+    queue.put(lost)
+
+
+def run(target, *args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(*args, queue))
+    process.start()
+    return process, queue
+
+
+def main():
+    basedir = tempfile.mkdtemp()
+    write_library(basedir, [{"name": "shared", "prompt": "0", "negative_prompt": "", "category": "shared"}])
+    workers = [run(worker, basedir, index) for index in range(PROCESSES)]
+    errors = []
+    for process, queue in workers:
+        errors.extend(queue.get())
+        process.join()
+    checker, queue = run(verify, basedir)
+    lost = queue.get()
+    checker.join()
+    total = PROCESSES * THREADS * OPS
+    print(f"进程 {PROCESSES} x 线程 {THREADS} x {OPS} 轮: 增删改 {total * 2 + total // 3} 次, 计数 {total} 次")
+    print(f"失败的调用: {len(errors)}  丢失的修改: {len(lost)}")
+    for message in (errors + lost)[:20]:
+        print("  " + message)
+    sys.exit(1 if errors or lost else 0)
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    main()
@@ -0,0 +1 @@
+# 基准测试用的 WebUI modules 包替身：只实现样式选择器脚本用到的接口，不依赖完整的 WebUI
@@ -0,0 +1,15 @@
+# modules.script_callbacks 替身：只记录注册的回调，基准测试按需手动调用
+callbacks = {}
+
+
+def _register(kind):
+    def register(callback, *args, **kwargs):
+        callbacks.setdefault(kind, []).append(callback)
+    return register
+
+
+on_app_started = _register("app_started")
+on_script_unloaded = _register("script_unloaded")
+on_infotext_pasted = _register("infotext_pasted")
+on_ui_settings = _register("ui_settings")
+on_model_loaded = _register("model_loaded")
@@ -0,0 +1,14 @@
+# modules.scripts 替身：basedir() 返回的插件目录由 common.load_extension 设置
+import os
+
+AlwaysVisible = object()
+
+_basedir = os.environ.get("STYLE_SELECTOR_BASEDIR", os.getcwd())
+
+
+def basedir():
+    return _basedir
+
+
+class Script:
+    pass
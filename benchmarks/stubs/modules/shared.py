@@ -0,0 +1,40 @@
+# modules.shared 替身：设置项保存在内存中，set() 时与 WebUI 一样调用 onchange
+import types
+
+
+class OptionInfo:
+    def __init__(self, default=None, label="", component=None, component_args=None, onchange=None, section=None, **kwargs):
+        self.default = default
+        self.label = label
+        self.component = component
+        self.component_args = component_args
+        self.onchange = onchange
+        self.section = section
+
+
+class Options:
+    def __init__(self):
+        self.__dict__["data"] = {}
+        self.__dict__["data_labels"] = {}
+
+    def add_option(self, key, info):
+        self.data_labels[key] = info
+        self.data.setdefault(key, info.default)
+
+    def set(self, key, value):
+        self.data[key] = value
+        info = self.data_labels.get(key)
+        if info is not None and info.onchange is not None:
+            info.onchange()
+
+    def __getattr__(self, key):
+        if key in self.data:
+            return self.data[key]
+        raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self.set(key, value)
+
+
+opts = Options()
+cmd_opts = types.SimpleNamespace(api=False, api_auth=None, nowebui=False)
@@ -0,0 +1,197 @@
+# 性能基准套件：在 stubs/modules 替身下加载样式选择器脚本，用合成样式库（1k～1M）测量
+# 加载、分类列表、查找、搜索、按提示词查找、按使用次数排序、process 批量套用、增删改和预览图服务的耗时，并与保存的基线比较。
+#
+#   python suite.py                                  # 默认规模 1k / 10k / 100k
+#   python suite.py --sizes 1000,1000000 --save-baseline node-a
+#   python suite.py --compare node-a --threshold 1.3  # 任一项慢于基线 30% 以上时退出码为 1
+#
+# 每个规模在独立进程中运行；结果为每次操作耗时的中位数（秒），基线保存在 baselines/<名称>.json。
+# 仓库不附带基线，--compare 指定的基线不存在时本次结果会保存为该基线。
+# 替身只代替 WebUI 的 modules 包，运行前需要安装 gradio、fastapi 和 Pillow（见 README.md）
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from common import load_extension, make_library, write_library
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+DEFAULT_SIZES = [1000, 10000, 100000]
+PROMPT_BATCH = 1000
+PREVIEW_IMAGES = 8
+
+
+def measure(fn, number=1, repeat=5):
+    # 每轮调用 number 次，返回各轮单次耗时的中位数
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - started) / number)
+    return statistics.median(rounds)
+
+
+def add_preview_images(basedir, styles):
+    from PIL import Image
+
+    folder = os.path.join(basedir, "MGTV")
+    os.makedirs(folder, exist_ok=True)
+    for index in range(PREVIEW_IMAGES):
+        file_name = f"preview-{index}.png"
+        Image.new("RGB", (768, 768), (index * 30 % 256, 120, 200)).save(os.path.join(folder, file_name))
+        styles[index]["image"] = f"MGTV/{file_name}"
+
+
+def make_job(count):
+    return types.SimpleNamespace(
+        all_prompts=[f"a photo of subject {i % 50}" for i in range(count)],
+        all_negative_prompts=["lowres, bad anatomy"] * count,
+        extra_generation_params={},
+    )
+
+
+def run_cases(size):
+    basedir = tempfile.mkdtemp()
+    styles = make_library(size)
+    add_preview_images(basedir, styles)
+    write_library(basedir, styles)
+    module = load_extension(basedir)
+    heavy = 1 if size >= 100000 else 3
+    results = {}
+
+    def load(cold):
+        store = module.StyleStore(module.stylespath, module.categoriespath, module.style_writer)
+        if cold and os.path.exists(store.snapshot_path):
+            os.remove(store.snapshot_path)
+        store.refresh()
+
+    results["load_cold"] = measure(lambda: load(True), repeat=heavy)
+    results["load_snapshot"] = measure(lambda: load(False), repeat=heavy)
+
+    store = module.style_store
+    store.refresh()
+    names = [style["name"] for style in styles]
+    categories = module.get_categories()
+    results["list_categories"] = measure(module.get_categories, number=100)
+    results["list_styles"] = measure(lambda: module.getStyles(categories[0]), number=100)
+
+    probes = names[::max(1, size // 1000)]
+    results["lookup"] = measure(lambda: [store.get(name) for name in probes]) / len(probes)
+    results["search_prefix"] = measure(lambda: module.search_styles("style-00001", None, "前缀"), number=20)
+    results["search_substring"] = measure(lambda: module.search_styles("0042", None, "包含"), number=5)
+    module.style_usage.record(store.id_of(name) for name in probes[:200])
+    results["list_popular"] = measure(lambda: module.search_styles("", categories[0], sort="最常用"), number=20)
+    module.find_styles_by_prompt("cinematic")
+    results["search_prompt"] = measure(lambda: module.find_styles_by_prompt("cinematic"), number=20)
+    results["search_prompt_or"] = measure(lambda: module.find_styles_by_prompt("cinematic, neon, anime", "or"), number=5)
+
+    script = module.StyleSelectorXL()
+    results["process"] = measure(lambda: script.process(make_job(PROMPT_BATCH), True, names[size // 2]), number=5)
+    stacked = names[1:4]
+    results["process_stacked"] = measure(lambda: script.process(make_job(PROMPT_BATCH), True, None, stacked), number=5)
+
+    counter = iter(range(10 ** 9))
+
+    def crud_cycle():
+        name = f"bench-{next(counter)}"
+        module.add_style(name, "{prompt}, bench", "", categories[0])
+        module.modify_style(name, "{prompt}, bench, modified", "", categories[0])
+        module.rename_style(name, name + "-renamed")
+        module.delete_style(name + "-renamed")
+    results["crud_cycle"] = measure(crud_cycle, number=20)
+
+    preview_names = names[:PREVIEW_IMAGES]
+    thumbnail_dir = module.thumbnail_cache.cache_dir
+
+    def preview_cold():
+        module.thumbnail_cache = module.ThumbnailCache(tempfile.mkdtemp(dir=basedir))
+        for name in preview_names:
+            module.get_style_image(name)
+    results["preview_render"] = measure(preview_cold, repeat=3) / len(preview_names)
+    module.thumbnail_cache = module.ThumbnailCache(thumbnail_dir)
+    for name in preview_names:
+        module.get_style_image(name)
+    results["preview_cached"] = measure(lambda: [module.get_style_image(name) for name in preview_names], number=20) / len(preview_names)
+
+    module.flush_style_store()
+    return results
+
+
+def run_size(size):
+    output = subprocess.run([sys.executable, __file__, "--child", str(size)], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="样式选择器性能基准套件")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="样式库规模，逗号分隔")
+    parser.add_argument("--save-baseline", metavar="NAME", help="把本次结果保存为基线")
+    parser.add_argument("--compare", metavar="NAME", help="与保存的基线比较")
+    parser.add_argument("--threshold", type=float, default=1.3, help="耗时超过基线的倍数视为退化")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_cases(args.child)))
+        return
+
+    baseline = None
+    if args.compare:
+        if os.path.exists(baseline_path(args.compare)):
+            with open(baseline_path(args.compare), encoding="utf-8") as file:
+                baseline = json.load(file)["results"]
+        else:
+            # 仓库中不提交基线（结果与机器相关）；第一次比较时把本次结果保存为基线，不做比较
+            print(f"基线 {args.compare} 不存在，本次只测量并创建基线: {baseline_path(args.compare)}")
+            args.save_baseline = args.save_baseline or args.compare
+
+    results = {}
+    regressions = []
+    print(f"{'case':<18} {'styles':>8} {'time':>11} {'baseline':>11} {'ratio':>7}")
+    for size in (int(value) for value in args.sizes.split(",") if value.strip()):
+        for case, seconds in run_size(size).items():
+            key = f"{case}@{size}"
+            results[key] = seconds
+            line = f"{case:<18} {size:>8} {format_seconds(seconds):>11}"
+            if baseline is not None and key in baseline:
+                ratio = seconds / baseline[key]
+                flag = ""
+                if ratio > args.threshold:
+                    regressions.append(key)
+                    flag = "  退化"
+                line += f" {format_seconds(baseline[key]):>11} {ratio:>6.2f}x{flag}"
+            print(line, flush=True)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(args.save_baseline), "w", encoding="utf-8") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, file, indent=2)
+        print(f"基线已保存: {baseline_path(args.save_baseline)}")
+
+    if regressions:
+        print(f"{len(regressions)} 项耗时超过基线的 {args.threshold:g} 倍: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
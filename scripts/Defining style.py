@@ -2,20 +2,60 @@ import gradio as gr
 from modules import scripts, shared, script_callbacks
 import json
 import os
+import sys
 import time
-from functools import lru_cache
+import copy
+import bisect
+import tempfile
+import threading
+import queue
+import atexit
+import contextlib
+import hashlib
+import difflib
+import heapq
+import math
+import re
+import shutil
+import secrets
+import csv
+import io
+import zipfile
+import gc
+import collections
+import functools
+import mmap
+import pickle
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import List, Optional
+from PIL import Image
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from pydantic import BaseModel, Field
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+_import_started = time.perf_counter()
 
 # 全局变量
-stylespath = ""
 categoriespath = os.path.join(scripts.basedir(), "categories.json")
 image_folder = os.path.join(scripts.basedir(), "MGTV")
-if not os.path.exists(image_folder):
-    os.makedirs(image_folder)
-
-# 初始化分类文件
-if not os.path.exists(categoriespath):
-    with open(categoriespath, 'w', encoding="utf-8") as f:
-        json.dump({}, f, ensure_ascii=False, indent=2)
+thumbnail_folder = os.path.join(scripts.basedir(), "thumbnail_cache")
+style_pack_folder = os.path.join(scripts.basedir(), "style_packs")
+pack_manifest_path = os.path.join(scripts.basedir(), "style_pack_manifest.json")
+usage_path = os.path.join(scripts.basedir(), "style_usage.json")
+# MGTV 和 categories.json 在第一次写入时才创建，导入脚本时不访问磁盘
 
 # 自定义CSS样式
 custom_css = """
@@ -44,336 +84,3567 @@ custom_css = """
     border-color: #1874CD !important;
 }
 
-.style-category-buttons input:checked + label {
-    background: #104E8B !important;
-    color: white !important;
-    border-color: #104E8B !important;
-}
+.style-category-buttons input:checked + label {
+    background: #104E8B !important;
+    color: white !important;
+    border-color: #104E8B !important;
+}
+
+/* 小按钮样式 */
+.small-button {
+    font-size: 14px !important;
+    padding: 6px 12px !important;
+    border-radius: 4px !important;
+    background: var(--button-secondary-background-fill) !important;
+    border: 1px solid var(--button-secondary-border-color) !important;
+}
+
+.small-button:hover {
+    background: var(--button-secondary-background-fill-hover) !important;
+}
+
+/* 刷新按钮样式 */
+.refresh-button {
+    font-size: 16px !important;
+    padding: 8px !important;
+    border-radius: 4px !important;
+    background: var(--button-secondary-background-fill) !important;
+    position: absolute !important;
+    top: 10px !important;
+    right: 10px !important;
+    width: 40px !important;
+    height: 40px !important;
+    display: flex !important;
+    align-items: center !important;
+    justify-content: center !important;
+}
+
+/* 反馈消息样式 */
+.feedback-message {
+    font-size: 14px !important;
+    padding: 8px !important;
+    border-radius: 4px !important;
+    margin-top: 5px !important;
+}
+
+.feedback-message.success {
+    background: var(--background-flash-success) !important;
+    color: var(--text-color) !important;
+}
+
+.feedback-message.error {
+    background: var(--background-flash-error) !important;
+    color: var(--text-color) !important;
+}
+
+/* 主布局样式 */
+#style_selector_main {
+    background: var(--block-background-fill) !important;
+    padding: 15px !important;
+    border-radius: 8px !important;
+    border: 1px solid var(--block-border-color) !important;
+    margin-bottom: 15px !important;
+    position: relative !important;
+}
+
+/* 折叠面板标题样式 */
+.accordion > h3 {
+    font-size: 16px !important;
+    color: var(--block-label-text-color) !important;
+    background: var(--block-background-fill) !important;
+    padding: 10px !important;
+    border-radius: 6px !important;
+    border: 1px solid var(--block-border-color) !important;
+    margin-bottom: 10px !important;
+}
+
+/* 输入框样式 */
+#style_selector_main textarea, 
+#style_selector_main input[type="text"] {
+    background: var(--input-background-fill) !important;
+    color: var(--input-text-color) !important;
+    border-color: var(--input-border-color) !important;
+}
+
+/* 下拉菜单样式 */
+#style_selector_main .gr-dropdown {
+    background: var(--input-background-fill) !important;
+    color: var(--input-text-color) !important;
+    border-color: var(--input-border-color) !important;
+}
+
+/* 表情选择菜单样式 */
+.emoji-dropdown {
+    min-width: 150px !important;
+    max-height: 200px !important;
+    overflow-y: auto !important;
+}
+
+.emoji-button {
+    font-size: 16px !important;
+    padding: 4px 8px !important;
+    min-width: 30px !important;
+    margin: 2px !important;
+}
+
+.emoji-button:hover {
+    background: var(--button-secondary-background-fill-hover) !important;
+}
+"""
+
+# 表情符号列表
+EMOJI_LIST = [
+    "🧡", "💛", "💚", "💙", "💜", "🤎", "😀", "😁", "😊", "😇", 
+    "🥰", "😍", "🤩", "😘", "😗", "☺️", "😚", "😙", "😋", "😛", 
+    "😜", "🤪", "😝", "🤑", "🤗", "☕", "🍸", "🍹", "🍺", "🥂", 
+    "🥤", "🧃", "🧉", "🧊", "👓", "🕶️", "🎸", "🎹", "📟", "🔋", 
+    "🖥️", "💿", "📀", "🎞️", "📽️", "🎬", "📺", "📸", "🌟", "🌀", 
+    "🌈", "🌂", "☂️", "☔", "⛱️", "⚡", "❄️", "⛄", "🔥", "💧", "🌊"
+]
+
+# 运行时指标：函数耗时直方图、缓存命中、重新加载次数和读写字节数，在诊断面板和 /metrics 接口中查看。
+# 默认关闭（设置中开启），关闭时每次调用只多一次 enabled 判断；错误计数不受开关影响
+class StyleMetrics:
+    PREFIX = "style_selector"
+    LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    HELP = {
+        "call_duration_seconds": ("histogram", "函数调用耗时"),
+        "cache_requests_total": ("counter", "缓存查询次数"),
+        "reloads_total": ("counter", "样式文件重新加载次数"),
+        "bytes_read_total": ("counter", "读取的字节数"),
+        "bytes_written_total": ("counter", "写入的字节数"),
+        "errors_total": ("counter", "错误次数"),
+        "token_budget_crossed_total": ("counter", "套用样式使提示词跨过 token 分段边界的次数"),
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.recent_errors = collections.deque(maxlen=20)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def cache(self, cache, hit):
+        if self.enabled:
+            self.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def observe(self, function, seconds):
+        key = ("call_duration_seconds", (("function", function),))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.LATENCY_BUCKETS), 0.0, 0]
+            index = bisect.bisect_left(self.LATENCY_BUCKETS, seconds)
+            if index < len(self.LATENCY_BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def timed(self, function):
+        # 装饰器：开启时记录每次调用的耗时（包括抛出异常的调用）
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(function, time.perf_counter() - started)
+            return wrapper
+        return decorate
+
+    def error(self, source, message):
+        # 代替直接 print：始终计数并保留最近的错误，同时仍输出到控制台
+        key = ("errors_total", (("source", source),))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            self.recent_errors.append((time.strftime("%H:%M:%S"), source, message))
+        print(message)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.recent_errors.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: ([*value[0]], value[1], value[2]) for key, value in self.histograms.items()}
+            return counters, histograms, list(self.recent_errors)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = [*labels, *extra]
+        if not items:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+    def prometheus(self, gauges=()):
+        # Prometheus 文本格式（version 0.0.4）
+        counters, histograms, _ = self.snapshot()
+        lines = []
+        for name, (kind, help_text) in self.HELP.items():
+            full_name = f"{self.PREFIX}_{name}"
+            series = histograms if kind == "histogram" else counters
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} {kind}"]
+            for key in keys:
+                labels = key[1]
+                if kind == "histogram":
+                    buckets, total, count = series[key]
+                    cumulative = 0
+                    for bound, bucket in zip(self.LATENCY_BUCKETS, buckets):
+                        cumulative += bucket
+                        lines.append(f"{full_name}_bucket{self._labels(labels, (('le', repr(bound)),))} {cumulative}")
+                    lines.append(f"{full_name}_bucket{self._labels(labels, (('le', '+Inf'),))} {count}")
+                    lines.append(f"{full_name}_sum{self._labels(labels)} {total!r}")
+                    lines.append(f"{full_name}_count{self._labels(labels)} {count}")
+                else:
+                    lines.append(f"{full_name}{self._labels(labels)} {series[key]}")
+        for name, help_text, value in gauges:
+            full_name = f"{self.PREFIX}_{name}"
+            lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} gauge", f"{full_name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def as_json(self, gauges=()):
+        counters, histograms, errors = self.snapshot()
+        return {
+            "enabled": self.enabled,
+            "counters": [{"name": f"{self.PREFIX}_{name}", "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "histograms": [{"name": f"{self.PREFIX}_{name}", "labels": dict(labels), "buckets": dict(zip(map(repr, self.LATENCY_BUCKETS), buckets)),
+                            "sum": total, "count": count}
+                           for (name, labels), (buckets, total, count) in sorted(histograms.items())],
+            "gauges": {f"{self.PREFIX}_{name}": value for name, _, value in gauges},
+            "recent_errors": [{"time": at, "source": source, "message": message} for at, source, message in errors],
+        }
+
+    def quantile(self, buckets, count, q):
+        # 按桶上界估计分位数，超出最大桶时返回 None
+        rank = q * count
+        cumulative = 0
+        for bound, bucket in zip(self.LATENCY_BUCKETS, buckets):
+            cumulative += bucket
+            if cumulative >= rank:
+                return bound
+        return None
+
+metrics = StyleMetrics()
+
+# 工具函数
+def get_file_signature(file_path):
+    # 以 (mtime, size, inode) 判断文件是否真正发生变化
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+_json_cache = {}
+
+@metrics.timed("get_json_content")
+def get_json_content(file_path):
+    signature = get_file_signature(file_path)
+    cached = _json_cache.get(file_path)
+    hit = cached is not None and cached[0] == signature
+    metrics.cache("json", hit)
+    if not hit:
+        if signature is not None:
+            metrics.inc("bytes_read_total", signature[1], file=file_kind(file_path))
+        try:
+            with open(file_path, 'rt', encoding="utf-8") as file:
+                data = json.load(file)
+        except Exception as e:
+            metrics.error("json", f"读取JSON文件错误: {str(e)}")
+            data = {}
+        cached = (signature, data)
+        _json_cache[file_path] = cached
+    # 调用方会修改返回值，因此返回副本，避免污染缓存
+    return copy.deepcopy(cached[1])
+
+def file_kind(file_path):
+    # 指标中按扩展名区分文件，避免以内容哈希命名的图片产生大量标签
+    return os.path.splitext(file_path)[1].lstrip(".").lower() or "file"
+
+def fsync_directory(directory):
+    # 替换后同步目录项，断电后新文件名一定指向新内容；Windows 不能打开目录，跳过
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_file_atomic(file_path, write):
+    # 先写临时文件并 fsync，再用 os.replace 原子替换，崩溃时不会留下半截文件
+    directory = os.path.dirname(file_path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=os.path.basename(file_path), dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding="utf-8") as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+            if metrics.enabled:
+                metrics.inc("bytes_written_total", os.fstat(file.fileno()).st_size, file=file_kind(file_path))
+        os.replace(tmp_path, file_path)
+        fsync_directory(directory)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def remove_file(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+def write_file_atomic_bytes(file_path, write):
+    # 与 write_file_atomic 相同：临时文件 fsync 后再替换，并同步目录
+    directory = os.path.dirname(file_path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=os.path.basename(file_path), dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+            if metrics.enabled:
+                metrics.inc("bytes_written_total", file.tell(), file=file_kind(file_path))
+        os.replace(tmp_path, file_path)
+        fsync_directory(directory)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+
+def copy_file_atomic(source, target):
+    def write(file):
+        with open(source, 'rb') as source_file:
+            shutil.copyfileobj(source_file, file)
+    write_file_atomic_bytes(target, write)
+
+@metrics.timed("save_json_content")
+def save_json_content(file_path, data):
+    write_file_atomic(file_path, lambda file: json.dump(data, file, ensure_ascii=False, indent=2, default=json_default))
+    _json_cache.pop(file_path, None)
+
+# 预览图按内容寻址存储：文件名为像素内容哈希，样式中保存相对插件目录的引用
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+def resolve_image_path(ref):
+    if os.path.isabs(ref):
+        return os.path.normpath(ref)
+    return os.path.normpath(os.path.join(scripts.basedir(), ref))
+
+def image_ref(file_name):
+    return f"{os.path.basename(image_folder)}/{file_name}"
+
+def is_managed_image(path):
+    return os.path.dirname(os.path.normpath(path)) == os.path.normpath(image_folder)
+
+def image_content_hash(image):
+    # 对解码后的像素计算哈希，同一张图无论以何种编码保存都得到相同文件名
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()[:32]
+
+def ensure_image_file(path, image):
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file_atomic_bytes(path, lambda file: image.save(file, format="PNG"))
+
+@metrics.timed("store_style_image")
+def store_style_image(image):
+    # 返回图片引用；已存在相同内容的文件时直接复用，编码写盘交给后台线程
+    file_name = f"{image_content_hash(image)}.png"
+    style_writer.submit(ensure_image_file, os.path.join(image_folder, file_name), image)
+    return image_ref(file_name)
+
+class StyleJournal:
+    # 追加式预写日志：每次修改只追加一行事务记录，fsync 不在提交路径上执行：
+    # 积累 fsync_every 条时由调用方交给后台写入线程，之后没有新的修改时由定时器交给后台写入线程补一次，
+    # 未落盘的记录最多停留 fsync_interval 秒。没有 writer 时定时器线程直接 fsync。
+    # 新日志的第一行记录它所基于的样式文件摘要，文件被外部替换后据此判断不能直接回放
+    def __init__(self, file_path, fsync_every=16, fsync_interval=1.0, writer=None):
+        self.file_path = file_path
+        self.writer = writer
+        self.base = None
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.entries = 0
+        self._file = None
+        self._unsynced = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def read(self):
+        transactions = []
+        self.base = None
+        if not os.path.exists(self.file_path):
+            return transactions
+        with open(self.file_path, 'rt', encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    # 早期日志没有摘要行
+                    if isinstance(record, dict):
+                        self.base = record.get("base")
+                    else:
+                        transactions.append(record)
+                except ValueError:
+                    # 崩溃时最后一行可能只写了一半，丢弃即可
+                    metrics.error("journal", f"忽略损坏的日志记录: {self.file_path}")
+                    break
+        self.entries = len(transactions)
+        return transactions
+
+    def append(self, ops):
+        # 返回 True 表示未落盘的记录已达到 fsync_every 条，调用方应在释放锁之后调用 schedule_sync()
+        line = json.dumps(ops, ensure_ascii=False, default=json_default) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.file_path, 'a', encoding="utf-8")
+                if self._file.tell() == 0 and self.base is not None:
+                    self._file.write(json.dumps({"base": self.base}) + "\n")
+            self._file.write(line)
+            self._file.flush()
+            self.entries += 1
+            self._unsynced += 1
+            due = self._unsynced >= self.fsync_every
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.fsync_interval, self._timed_sync)
+                self._timer.daemon = True
+                self._timer.start()
+        if metrics.enabled:
+            metrics.inc("bytes_written_total", len(line.encode("utf-8")), file="journal")
+        return due
+
+    def schedule_sync(self):
+        # 入队可能因队列已满而阻塞，调用方不能持有样式库的锁
+        if self.writer is not None:
+            self.writer.submit(self.sync)
+        else:
+            self.sync()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._timer = None
+        self.schedule_sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def truncate(self):
+        self.close()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        self.entries = 0
+
+    def close(self):
+        with self._lock:
+            timer, self._timer = self._timer, None
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+        if timer is not None:
+            timer.cancel()
+
+# 提示词倒排索引：按正向/反向提示词中的词、逗号分隔的短语和 LoRA/超网络标签建立，随样式增删改增量维护
+PROMPT_FIELD_WEIGHTS = (("prompt", 1.0), ("negative_prompt", 0.5))
+_word_pattern = re.compile(r"[\w\-.']+")
+_network_tag_pattern = re.compile(r"<\s*(\w+)\s*:\s*([^:>]+)[^>]*>")
+_weight_pattern = re.compile(r"^[\(\[\{\s]*(.*?)(?::\s*[\d.]+)?[\)\]\}\s]*$")
+
+def normalize_prompt_phrase(phrase):
+    # 去掉权重括号，例如 "(cinematic lighting:1.2)" -> "cinematic lighting"
+    phrase = phrase.lower()
+    if not any(ch in phrase for ch in "()[]{}:"):
+        return " ".join(phrase.split())
+    match = _weight_pattern.match(phrase.strip())
+    return " ".join((match.group(1) if match else phrase).split())
+
+def prompt_terms(text):
+    terms = []
+    if "<" in text:
+        for tag, value in _network_tag_pattern.findall(text):
+            terms.append(f"<{tag.lower()}:{value.strip().lower()}>")
+        text = _network_tag_pattern.sub(" ", text)
+    for token in split_prompt_tokens(text):
+        phrase = normalize_prompt_phrase(token)
+        words = _word_pattern.findall(phrase)
+        terms.extend(words)
+        if len(words) > 1:
+            terms.append(phrase)
+    return terms
+
+class PromptTokenIndex:
+    MAX_PHRASES = 64
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_terms = {}
+        # 查询过的词的倒排表按 (权重降序, 名称) 排好的副本，倒排表变化时丢弃，下次查询再排序
+        self.ranked = {}
+        # 多词短语退化得到的倒排表，任何样式变化都会整体丢弃
+        self.phrases = {}
+
+    def add(self, name, style):
+        self.remove(name)
+        weights = {}
+        for field, field_weight in PROMPT_FIELD_WEIGHTS:
+            for term in prompt_terms(style.get(field) or ""):
+                weights[term] = weights.get(term, 0.0) + field_weight
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[name] = weight
+        self._invalidate(weights)
+        self.doc_terms[name] = tuple(weights)
+
+    def remove(self, name):
+        terms = self.doc_terms.pop(name, ())
+        self._invalidate(terms)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(name, None)
+                if not posting:
+                    del self.postings[term]
+
+    def _invalidate(self, terms):
+        for term in terms:
+            self.ranked.pop(term, None)
+        if self.phrases:
+            for term in self.phrases:
+                self.ranked.pop(term, None)
+            self.phrases.clear()
+
+    def _match(self, term):
+        # 多词短语没有完全一致的记录时，退化为所有词都出现
+        posting = self.postings.get(term)
+        if posting is not None or " " not in term:
+            return posting or {}
+        posting = self.phrases.get(term)
+        if posting is not None:
+            return posting
+        postings = [self.postings.get(word, {}) for word in term.split()]
+        if not all(postings):
+            return {}
+        postings.sort(key=len)
+        posting = {name: min(p[name] for p in postings) for name in postings[0] if all(name in p for p in postings[1:])}
+        if len(self.phrases) < self.MAX_PHRASES:
+            self.phrases[term] = posting
+        return posting
+
+    def _ranked(self, term, posting):
+        ranked = self.ranked.get(term)
+        if ranked is None:
+            ranked = self.ranked[term] = sorted(posting.items(), key=lambda item: (-item[1], item[0]))
+        return ranked
+
+    def search(self, terms, mode="and", limit=50):
+        # 得分为 tf-idf 之和。各词的倒排表按权重从高到低同步向下扫描（阈值算法），每个新出现的样式
+        # 直接查其余倒排表算出完整得分，只保留前 limit 名；尚未出现的样式得分不会超过各表当前位置的
+        # 权重之和，第 limit 名已不低于这个上界时提前结束，常见词不必扫描整个倒排表
+        matches = [(term, self._match(term)) for term in terms]
+        if not matches or limit <= 0:
+            return []
+        if mode == "and" and not all(posting for _, posting in matches):
+            return []
+        total = max(1, len(self.doc_terms))
+        lists = [(posting, math.log(1 + total / (1 + len(posting))), self._ranked(term, posting))
+                 for term, posting in matches if posting]
+        if not lists:
+            return []
+        top = []
+        seen = set()
+        for depth in range(max(len(ranked) for _, _, ranked in lists)):
+            bound = 0.0
+            last_name = ""
+            for _, idf, ranked in lists:
+                if depth >= len(ranked):
+                    continue
+                name, weight = ranked[depth]
+                bound += weight * idf
+                last_name = max(last_name, name)
+                if name in seen:
+                    continue
+                seen.add(name)
+                # 按查询中词的顺序累加，与上界的求和顺序一致，得分相同的样式按名称排序
+                score = 0.0
+                for posting, idf_, _ in lists:
+                    weight = posting.get(name)
+                    if weight:
+                        score += weight * idf_
+                    elif mode == "and":
+                        break
+                else:
+                    bisect.insort(top, (-score, name))
+                    del top[limit:]
+            if mode == "and" and any(depth + 1 >= len(ranked) for _, _, ranked in lists):
+                break
+            if len(top) == limit and top[-1] <= (-bound, last_name):
+                break
+        return [(name, -score) for score, name in top]
+
+def parse_prompt_query(query):
+    # 查询写法与提示词相同：逗号分隔多个词或短语，如 "cinematic lighting, <lora:film:0.8>"
+    terms = []
+    for term in prompt_terms(query or ""):
+        if term not in terms:
+            terms.append(term)
+    # 多词短语已覆盖其中的单词，只保留短语本身
+    phrases = [term for term in terms if " " in term]
+    covered = {word for phrase in phrases for word in phrase.split()}
+    return [term for term in terms if term not in covered]
+
+def new_style_id(existing):
+    # 紧凑且不可变的样式 ID，改名不影响
+    while True:
+        style_id = secrets.token_hex(4)
+        if style_id not in existing:
+            return style_id
+
+def legacy_style_id(name, existing):
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    length = 8
+    while digest[:length] in existing and length < len(digest):
+        length += 1
+    return digest[:length]
+
+def find_category_issues(categories_data, by_name):
+    # 对比 categories.json 中列出的成员与样式自身的 category 字段
+    issues = []
+    for category, names in categories_data.items():
+        for name in names if isinstance(names, list) else []:
+            style = by_name.get(name)
+            if style is None:
+                issues.append(f"分类 {category} 中列出的样式 {name} 不存在")
+            elif style.get('category') != category:
+                issues.append(f"样式 {name} 列在分类 {category} 中，但其分类字段为 {style.get('category') or '(空)'}")
+    listed = {name for names in categories_data.values() if isinstance(names, list) for name in names}
+    for name, style in by_name.items():
+        category = style.get('category')
+        if category and category not in categories_data:
+            issues.append(f"样式 {name} 所属的分类 {category} 未在 categories.json 中声明")
+        elif category and name not in listed:
+            issues.append(f"样式 {name} 未列在分类 {category} 中")
+    return issues
+
+class StyleConflictError(Exception):
+    # 要修改的样式在调用方读取之后已被其他人修改
+    pass
+
+class StyleLibraryError(Exception):
+    # 样式文件或分类文件无法解析（手工编辑出错、同步程序写到一半等），不能用它替换内存中的样式库
+    pass
+
+STYLE_CONFLICT_MESSAGE = "❌ 样式已被其他人修改，请重新提取后再试!"
+CATEGORY_CONFLICT_MESSAGE = "❌ 分类已被其他人修改，请刷新后再试!"
+
+def lock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        return
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)
+
+def unlock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return
+    file.seek(0)
+    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class FileLock:
+    # 跨进程文件锁：多个 WebUI 工作进程共用同一个插件目录时串行化修改和压缩；进程内可重入
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.file_path, 'a+b')
+                lock_file(self._file)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                unlock_file(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+        self._lock.release()
+
+class ReadWriteLock:
+    # 读写锁：读取可以并发，写入独占。持有写锁的线程可以重入写锁或再获取读锁；
+    # 有写入在等待时新的读取让路，避免修改被持续的读取饿死，已持有读锁的线程重入不受影响
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                if self._readers[me] > 1:
+                    self._readers[me] -= 1
+                else:
+                    del self._readers[me]
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+            else:
+                # 读锁不能升级为写锁，两个读取方同时升级会互相等待
+                if me in self._readers:
+                    raise RuntimeError("持有读锁时不能获取写锁")
+                self._writers_waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self._writer = me
+                self._writer_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+class BackgroundWriter:
+    # 后台写入线程：日志追加、文件压缩和预览图编码都在这里串行执行，
+    # Gradio 工作线程只修改内存数据后立即返回；队列有界，写入跟不上时对调用方施加背压
+    def __init__(self, maxsize=256):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="style-selector-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                fn, args = task
+                fn(*args)
+            except Exception as e:
+                metrics.error("writer", f"后台写入错误: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def in_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn, *args):
+        if self.in_writer_thread():
+            fn(*args)
+            return
+        self._ensure_started()
+        self._queue.put((fn, args))
+
+    def flush(self):
+        # 等待队列中已提交的任务全部完成
+        if self._thread is None or self.in_writer_thread():
+            return
+        self._queue.join()
+
+    def shutdown(self):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+def read_style_file(file_path):
+    if not os.path.exists(file_path):
+        return []
+    try:
+        with open(file_path, 'rt', encoding="utf-8") as file:
+            data = json.load(file)
+        if metrics.enabled:
+            metrics.inc("bytes_read_total", os.path.getsize(file_path), file=file_kind(file_path))
+    except Exception as e:
+        metrics.error("library", f"读取样式文件错误: {str(e)}")
+        return []
+    if not isinstance(data, list):
+        metrics.error("library", f"样式文件格式错误: {file_path}")
+        return []
+    return [item for item in data if isinstance(item, dict) and 'name' in item]
+
+class StringPool:
+    # 相同内容的字符串只保留一个对象：分类名、通用的反向提示词和重复的提示词在样式间共享
+    def __init__(self, strings=()):
+        self.strings = {text: text for text in strings}
+
+    def intern(self, text):
+        return self.strings.setdefault(text, text) if isinstance(text, str) else text
+
+    @classmethod
+    def of(cls, records):
+        # 只保留仍被样式引用的字符串，丢弃修改后不再使用的旧内容
+        return cls(value for record in records for value in record.strings())
+
+def str_identity(text):
+    return text
+
+class StyleRecord(Mapping):
+    # 内存中的一条样式：固定字段存放在 __slots__ 中，不再为每个样式保存带重复键名的 dict；
+    # 以只读映射的方式使用（style['name']、style.get(...)、dict(style)），修改时复制为 dict 再提交
+    FIELDS = ("id", "name", "prompt", "negative_prompt", "category", "image")
+    POOLED = ("prompt", "negative_prompt", "category", "image")
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, style, pool=None):
+        get = style.get
+        intern = pool.intern if pool is not None else str_identity
+        self.id = get('id')
+        self.name = get('name')
+        self.prompt = intern(get('prompt'))
+        self.negative_prompt = intern(get('negative_prompt'))
+        self.category = intern(get('category'))
+        self.image = intern(get('image'))
+        # 未知字段原样保留，写回文件时不丢失；解析时被误转为记录的嵌套对象还原为 dict
+        if len(style) <= len(self.FIELDS) and FIELD_SET.issuperset(style):
+            self.extra = None
+        else:
+            self.extra = {key: dict(value) if isinstance(value, StyleRecord) else value
+                          for key, value in style.items() if key not in FIELD_SET} or None
+
+    def replace(self, **fields):
+        # 复制 __slots__ 后只替换给定的固定字段，不经过 dict 和逐字段驻留
+        record = StyleRecord.__new__(StyleRecord)
+        for field in self.__slots__:
+            setattr(record, field, fields.get(field, getattr(self, field)))
+        return record
+
+    def strings(self):
+        for field in self.POOLED:
+            value = getattr(self, field)
+            if isinstance(value, str):
+                yield value
+
+    # 值为 None 的字段视为不存在，与原来 dict 中缺少该键时的 get() 结果一致
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.extra.get(key, default) if self.extra is not None else default
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if getattr(self, field) is not None:
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, StyleRecord):
+            return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"StyleRecord({dict(self)!r})"
+
+    # 快照按字段分列保存记录，恢复时直接填充 __slots__，不经过 __init__ 的逐字段处理
+    @classmethod
+    def to_columns(cls, records):
+        return tuple([getattr(record, field) for record in records] for field in cls.__slots__)
+
+    @classmethod
+    def from_columns(cls, columns):
+        records = []
+        for style_id, name, prompt, negative_prompt, category, image, extra in zip(*columns):
+            record = cls.__new__(cls)
+            record.id, record.name, record.prompt, record.negative_prompt = style_id, name, prompt, negative_prompt
+            record.category, record.image, record.extra = category, image, extra
+            records.append(record)
+        return records
+
+FIELD_SET = frozenset(StyleRecord.FIELDS)
+
+def read_file_bytes(file_path):
+    try:
+        with open(file_path, 'rb') as file:
+            content = file.read()
+    except OSError:
+        return None
+    metrics.inc("bytes_read_total", len(content), file=file_kind(file_path))
+    return content
+
+def parse_style_records(content, pool=None, file_path=""):
+    # 解析器每产生一个带名称的对象就立即转为紧凑记录，加载时不会同时保留整个 dict 列表；
+    # 文件不存在时返回空列表，文件损坏时抛出 StyleLibraryError，不能当作空样式库
+    def to_record(item):
+        return StyleRecord(item, pool) if 'name' in item else item
+
+    if content is None:
+        return []
+    try:
+        data = json.loads(content, object_hook=to_record)
+    except Exception as e:
+        raise StyleLibraryError(f"读取样式文件错误: {str(e)}")
+    if not isinstance(data, list):
+        raise StyleLibraryError(f"样式文件格式错误: {file_path}")
+    return [item for item in data if isinstance(item, StyleRecord)]
+
+def count_image_refs(records):
+    counts = {}
+    for record in records:
+        if record.image:
+            path = resolve_image_path(record.image)
+            counts[path] = counts.get(path, 0) + 1
+    return counts
+
+@contextlib.contextmanager
+def gc_paused():
+    # 一次创建几十万个记录时暂停循环垃圾回收，否则每轮分代回收都要遍历已经创建的全部记录
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# 二进制快照：解析后的样式记录（按字段分列）、分类索引和字符串池，以两个源文件内容的哈希为键。
+# 哈希一致时直接映射快照文件，不再解析 JSON；快照缺失、损坏或格式不同时透明地回退到解析 JSON。
+# 快照结构变化时提升 SNAPSHOT_FORMAT，旧快照会被忽略并重写
+SNAPSHOT_FORMAT = 1
+
+def source_digest(*contents):
+    digest = hashlib.sha256()
+    for content in contents:
+        content = content or b""
+        digest.update(len(content).to_bytes(8, "little"))
+        digest.update(content)
+    return digest.hexdigest()
+
+def read_snapshot(file_path, key):
+    try:
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if pickle.load(view) != (SNAPSHOT_FORMAT, key):
+                return None
+            metrics.inc("bytes_read_total", len(view), file="snapshot")
+            return pickle.load(view)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        metrics.error("snapshot", f"读取样式快照错误: {str(e)}")
+        return None
+
+def write_snapshot(file_path, key, payload):
+    def write(file):
+        # 先写头部，键不符时读取方无需反序列化整个快照
+        pickle.dump((SNAPSHOT_FORMAT, key), file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        write_file_atomic_bytes(file_path, write)
+    except Exception as e:
+        metrics.error("snapshot", f"保存样式快照错误: {str(e)}")
+
+def json_default(value):
+    # json.dump 遇到样式记录时按普通 dict 输出，文件格式不变
+    if isinstance(value, StyleRecord):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def style_digest(style):
+    # 日志中记录样式修改前的内容摘要，基准文件变化后用来判断这项修改是否与外部更新冲突
+    if style is None:
+        return None
+    content = json.dumps(dict(style), ensure_ascii=False, sort_keys=True, default=json_default)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+# 样式包：style_packs 文件夹或设置中配置的其他路径下的 JSON 文件，格式与 sdxl_styles.json 相同。
+# 样式包只读，在第一次打开其中的分类或查找其中的样式时才解析；清单缓存记录每个包的分类和样式名，
+# 包文件未变化时启动无需解析
+PACK_CHECK_INTERVAL = 1.0
+
+def get_style_pack_paths():
+    configured = getattr(shared.opts, "style_selector_pack_paths", "") or ""
+    roots = [style_pack_folder] + [path.strip() for path in re.split(r"[,;\n]", configured) if path.strip()]
+    paths = []
+    for root in roots:
+        if os.path.isdir(root):
+            paths.extend(os.path.join(root, entry) for entry in sorted(os.listdir(root))
+                         if entry.lower().endswith(".json") and not entry.startswith("."))
+        elif os.path.isfile(root):
+            paths.append(root)
+    excluded = {os.path.normpath(stylespath), os.path.normpath(categoriespath)}
+    return [path for path in dict.fromkeys(os.path.normpath(path) for path in paths) if path not in excluded]
+
+class StylePack:
+    def __init__(self, path, manifest=None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.manifest = manifest
+        self.signature = None
+        self.styles = []
+        self.ids = set()
+        self.loaded = False
+
+    def manifest_valid(self, signature):
+        return self.manifest is not None and tuple(self.manifest.get("signature") or ()) == signature
+
+    def read(self, pool=None):
+        signature = get_file_signature(self.path)
+        styles = []
+        seen_names = set()
+        seen_ids = set()
+        for item in read_style_file(self.path):
+            if item['name'] in seen_names:
+                continue
+            style_id = item.get('id')
+            if not isinstance(style_id, str) or not style_id or style_id in seen_ids:
+                style_id = legacy_style_id(f"{self.name}/{item['name']}", seen_ids)
+                item = {"id": style_id, **{key: value for key, value in item.items() if key != 'id'}}
+            seen_names.add(item['name'])
+            seen_ids.add(style_id)
+            styles.append(StyleRecord(item, pool))
+        self.styles = styles
+        self.signature = signature
+        self.manifest = {
+            "signature": list(signature) if signature else None,
+            "categories": list(dict.fromkeys(style.get('category') for style in styles if style.get('category'))),
+            "names": {style['name']: style['id'] for style in styles},
+            "images": sorted({resolve_image_path(style['image']) for style in styles if style.get('image')}),
+        }
+        return styles
+
+class StyleStore:
+    # 样式库的内存索引：只在文件 (mtime, size, inode) 变化时重新解析；
+    # 修改先写入追加日志，积累到一定数量后再原子地压缩回 JSON 文件
+    COMPACT_EVERY = 500
+
+    def __init__(self, file_path, categories_path, writer):
+        self.file_path = file_path
+        self.categories_path = categories_path
+        self.writer = writer
+        self.journal = StyleJournal(os.path.splitext(file_path)[0] + ".journal", writer=writer)
+        self.snapshot_path = os.path.splitext(file_path)[0] + ".snapshot"
+        # 基准文件被外部替换、回放日志时与之冲突而没有合并的修改，压缩时另存到这里
+        self.rejected_path = os.path.splitext(file_path)[0] + ".rejected.journal"
+        self.journal_rejected = None
+        self._uncompacted = 0
+        self.signature = None
+        self.version = 0
+        self.styles_by_id = {}
+        self.ids_by_name = {}
+        self.by_category = {}
+        self.categories = {}
+        self.category_issues = []
+        self.packs = {}
+        self.origins = {}
+        self._packs_checked = 0.0
+        self._manifests = None
+        self.image_refs = {}
+        # 样式记录共享的字符串池，重新加载和压缩时重建，只保留仍在使用的内容
+        self.strings = StringPool()
+        self._released = set()
+        self._compiled = {}
+        self._search_index = None
+        self.token_index = None
+        self._warm_thread = None
+        self.ready = threading.Event()
+        # 最近一次加载失败的原因；失败期间保留上次成功加载的样式库，并禁止压缩写回源文件
+        self.load_error = None
+        self.load_seconds = None
+        self._loaded = False
+        # _lock 保护内存中的样式库：查询和生成任务并发读取，修改和重新加载独占；
+        # _commit_lock 串行化所有修改，保证日志顺序与内存中的修改顺序一致
+        self._lock = ReadWriteLock()
+        self._commit_lock = threading.RLock()
+        # 锁顺序固定为 _commit_lock -> file_lock -> _lock
+        self.file_lock = FileLock(os.path.splitext(file_path)[0] + ".lock")
+        # 每个样式最后一次被修改时的库版本，删除的样式也保留记录，用于检测并发修改；
+        # 首次加载后没有改动过的样式不单独记录，版本为 _base_revision
+        self.revisions = {}
+        # 分类的修改版本：分类被增删改名或成员变化时记录，用于分类操作的并发检测
+        self.category_revisions = {}
+        self._base_revision = 0
+
+    def _signatures(self):
+        # 日志也在签名中，其他进程追加的修改同样会触发重新加载
+        return (get_file_signature(self.file_path), get_file_signature(self.categories_path),
+                get_file_signature(self.journal.file_path))
+
+    def ensure_loaded(self):
+        # 读取路径只使用当前已加载的样式库，只有首次加载时阻塞等待；
+        # 文件变化后的重新加载由监视线程在文件稳定后完成，修改和压缩在文件锁内调用 refresh
+        if not self._loaded:
+            self.refresh()
+
+    def refresh(self, check_packs=False):
+        reloaded = False
+        if not self._loaded or self._signatures() != self.signature:
+            # 持有 _commit_lock 期间不会有新的修改；日志在提交时同步追加，无需等待后台队列
+            with self._commit_lock:
+                signature = self._signatures()
+                if not self._loaded or signature != self.signature:
+                    self._load(signature)
+                    reloaded = True
+                    if self.journal_rejected is not None:
+                        # 日志已按新的基准文件重新合并，立即压缩，之后的日志以新文件为基准
+                        try:
+                            self.compact()
+                        except Exception as e:
+                            metrics.error("journal", f"合并日志后压缩错误: {str(e)}")
+        if check_packs or time.monotonic() - self._packs_checked >= PACK_CHECK_INTERVAL:
+            self._check_packs()
+        return reloaded
+
+    # 重新加载时在副本上解析文件和回放日志，完成后在锁内一次性替换，读取方只会看到旧库或新库
+    STATE_FIELDS = ("styles_by_id", "ids_by_name", "by_category", "categories", "category_issues",
+                    "image_refs", "origins", "token_index", "revisions", "category_revisions",
+                    "_base_revision", "_uncompacted", "strings", "journal_rejected")
+
+    @metrics.timed("StyleStore.load")
+    def _load(self, signature):
+        metrics.inc("reloads_total", source="library")
+        staged = copy.copy(self)
+        try:
+            pack_ids = staged._build()
+        except StyleLibraryError as e:
+            # 记下签名，文件再次变化之前不重复解析；首次加载失败时以空库启动
+            metrics.error("library", f"{str(e)}，继续使用上次成功加载的样式库")
+            with self._lock.write():
+                self.load_error = str(e)
+                self.signature = signature
+                if not self._loaded:
+                    self.version += 1
+                    self._loaded = True
+            return
+        # 内容没有变化的样式保留原来的修改版本，其余（包括被删除的）记为新版本
+        version = self.version + 1
+        if self._loaded:
+            revisions = dict(self.revisions)
+            for style_id, style in staged.styles_by_id.items():
+                if self.styles_by_id.get(style_id) != style:
+                    revisions[style_id] = version
+            for style_id in self.styles_by_id.keys() - staged.styles_by_id.keys():
+                revisions[style_id] = version
+            category_revisions = dict(self.category_revisions)
+            for name in self.categories.keys() ^ staged.categories.keys():
+                category_revisions[name] = version
+            for name in self.by_category.keys() | staged.by_category.keys():
+                if self.by_category.get(name) != staged.by_category.get(name):
+                    category_revisions[name] = version
+        else:
+            # 首次加载时所有样式的版本相同，不逐个记录
+            revisions = {}
+            category_revisions = {}
+            staged._base_revision = version
+        staged.revisions = revisions
+        staged.category_revisions = category_revisions
+        with self._lock.write():
+            for field in self.STATE_FIELDS:
+                setattr(self, field, getattr(staged, field))
+            for path, pack in self.packs.items():
+                pack.ids = pack_ids.get(path, set())
+            self._released = set()
+            self.signature = signature
+            self.load_error = None
+            self._compiled = {}
+            self.version += 1
+            self._loaded = True
+
+    def _build(self):
+        self.revisions = {}
+        self.category_revisions = {}
+        # 哈希与解析使用同一份内容，文件在两者之间被修改也不会让快照对应错误的内容
+        styles_content = read_file_bytes(self.file_path)
+        categories_content = read_file_bytes(self.categories_path)
+        key = source_digest(styles_content, categories_content)
+        with gc_paused():
+            restored = self._restore_snapshot(key)
+            metrics.cache("snapshot", restored)
+            if not restored:
+                self._parse_sources(styles_content, categories_content)
+                self._save_snapshot(key)
+        # 副本与正在使用的库共享这些容器，回放日志之前先换成新的，避免在锁外修改旧库
+        self._released = set()
+        self.token_index = None
+        self.origins = {}
+        self.journal.close()
+        transactions = self.journal.read()
+        if self.journal.base is not None and self.journal.base != key:
+            self._rebase(transactions)
+        else:
+            for ops in transactions:
+                for op in ops:
+                    self._apply_op(op)
+            self.journal_rejected = None
+        if self.journal.base is None:
+            self.journal.base = key
+        self._uncompacted = len(transactions)
+        # 默认样式库重新加载后，把已经解析过的样式包重新合并进来，不重新解析；
+        # 样式包对象是共享的，合并结果返回给调用方，替换时再写回
+        return {path: self._merge_pack(pack) for path, pack in self.packs.items() if pack.loaded}
+
+    def _rebase(self, transactions):
+        # 日志之后样式文件被同步程序等整体替换：不能直接回放，否则会覆盖新文件中的修改。
+        # 逐项比较修改前的样式摘要，目标样式在新文件中仍与修改前相同时才合并，其余记为冲突；
+        # 分类操作按名称生效，照常回放
+        rejected = []
+        for ops in transactions:
+            for op in ops:
+                if "before" in op and self._rebase_conflicts(op):
+                    rejected.append(op)
+                else:
+                    self._apply_op(op)
+        self.journal_rejected = rejected
+        if rejected:
+            names = sorted({op["style"]['name'] if op.get("op") == "put" else op.get("name") or op.get("id") for op in rejected})
+            metrics.error("journal", f"样式文件已被外部更新，{len(rejected)} 项本地修改与之冲突，"
+                                     f"已另存到 {self.rejected_path}: {', '.join(names)}")
+
+    def _rebase_conflicts(self, op):
+        current = style_digest(self.styles_by_id.get(self._op_target(op)))
+        if current == op["before"]:
+            return False
+        # 新文件中已经是修改后的结果（例如同步程序带回了这项修改）时不算冲突
+        if op["op"] == "put":
+            return current != style_digest(self._with_id(op["style"]))
+        if op["op"] == "delete":
+            return current is not None
+        return True
+
+    def _parse_sources(self, styles_content, categories_content):
+        self.strings = StringPool()
+        styles_by_id = {}
+        ids_by_name = {}
+        by_category = {}
+        for item in parse_style_records(styles_content, self.strings, self.file_path):
+            # 重名时保留第一条，与原先线性查找的结果一致
+            if item['name'] in ids_by_name:
+                continue
+            style_id = item.get('id')
+            if not isinstance(style_id, str) or not style_id or style_id in styles_by_id:
+                # 旧数据没有 ID 时由名称确定性地生成，压缩写回之前每次加载结果都相同
+                style_id = legacy_style_id(item['name'], styles_by_id)
+                # 记录尚未发布，可以直接补上 ID
+                item.id = style_id
+            styles_by_id[style_id] = item
+            ids_by_name[item['name']] = style_id
+            by_category.setdefault(item.get('category'), []).append(item['name'])
+        for names in by_category.values():
+            names.sort()
+        by_name = {name: styles_by_id[style_id] for name, style_id in ids_by_name.items()}
+        try:
+            categories = json.loads(categories_content) if categories_content is not None else {}
+        except Exception as e:
+            raise StyleLibraryError(f"读取分类文件错误: {str(e)}")
+        if not isinstance(categories, dict):
+            raise StyleLibraryError(f"分类文件格式错误: {self.categories_path}")
+        self.styles_by_id = styles_by_id
+        self.ids_by_name = ids_by_name
+        self.by_category = by_category
+        # 分类成员关系只由样式的 category 字段决定；categories.json 只提供分类顺序和空分类
+        self.categories = dict.fromkeys(categories)
+        self.category_issues = find_category_issues(categories, by_name)
+        for category in by_category:
+            if category and category not in self.categories:
+                self.categories[category] = None
+        self.image_refs = count_image_refs(styles_by_id.values())
+
+    def _restore_snapshot(self, key):
+        snapshot = read_snapshot(self.snapshot_path, key)
+        if snapshot is None:
+            return False
+        records = StyleRecord.from_columns(snapshot["columns"])
+        self.styles_by_id = dict(zip(snapshot["columns"][0], records))
+        self.ids_by_name = dict(zip(snapshot["columns"][1], snapshot["columns"][0]))
+        self.by_category = snapshot["by_category"]
+        self.categories = dict.fromkeys(snapshot["categories"])
+        self.category_issues = snapshot["category_issues"]
+        # 引用计数按绝对路径统计，插件目录移动后快照中的路径会失效，每次按当前目录重新计算
+        self.image_refs = count_image_refs(records)
+        self.strings = StringPool(snapshot["strings"])
+        return True
+
+    def _save_snapshot(self, key, compacted=False):
+        # 快照只描述两个源文件的内容：压缩后保存时排除合并进来的样式包，写出的分类文件与样式一致，没有问题项
+        records = list(self.styles_by_id.values())
+        by_category = self.by_category
+        if compacted and self.origins:
+            records = [style for style_id, style in self.styles_by_id.items() if style_id not in self.origins]
+            by_category = {}
+            for category, names in self.by_category.items():
+                kept = [name for name in names if self.ids_by_name[name] not in self.origins]
+                if kept:
+                    by_category[category] = kept
+        write_snapshot(self.snapshot_path, key, {
+            "columns": StyleRecord.to_columns(records),
+            "by_category": by_category,
+            "categories": list(self.categories),
+            "category_issues": [] if compacted else self.category_issues,
+            "strings": list(self.strings.strings),
+        })
+
+    def _check_packs(self):
+        # 每个样式包单独检查签名，只重新加载发生变化的包；解析在锁外进行
+        self._packs_checked = time.monotonic()
+        if self._manifests is None:
+            self._manifests = get_json_content(pack_manifest_path) if os.path.exists(pack_manifest_path) else {}
+        paths = get_style_pack_paths()
+        reparsed = {}
+        for path in paths:
+            pack = self.packs.get(path)
+            if pack is not None and pack.loaded and get_file_signature(path) != pack.signature:
+                reparsed[path] = StylePack(path)
+                reparsed[path].read(self.strings)
+                metrics.inc("reloads_total", source="pack")
+        if not reparsed and set(paths) == set(self.packs):
+            return
+        with self._commit_lock, self._lock.write():
+            for path in list(self.packs):
+                if path not in paths:
+                    self._unload_pack(self.packs.pop(path))
+            for path in paths:
+                if path in reparsed:
+                    self._unload_pack(self.packs[path])
+                    self.packs[path] = pack = reparsed[path]
+                    pack.loaded = True
+                    pack.ids = self._merge_pack(pack)
+                elif path not in self.packs:
+                    self.packs[path] = StylePack(path, self._manifests.get(path))
+            if reparsed:
+                self._save_manifests()
+            self._bump()
+
+    def _bump(self):
+        self._compiled = {}
+        self.version += 1
+
+    def _load_pack(self, pack):
+        metrics.inc("reloads_total", source="pack")
+        pack.read(self.strings)
+        pack.loaded = True
+        pack.ids = self._merge_pack(pack)
+        self._save_manifests()
+
+    def _merge_pack(self, pack):
+        ids = set()
+        for style in pack.styles:
+            # 默认样式库和先加载的包中已有同名样式时，以已有的为准
+            if style['name'] in self.ids_by_name:
+                continue
+            if style['id'] in self.styles_by_id:
+                style = dict(style, id=legacy_style_id(f"{pack.path}/{style['name']}", self.styles_by_id))
+            self._put(style, declare=False)
+            self.origins[style['id']] = pack.path
+            ids.add(style['id'])
+        return ids
+
+    def _restore_pack_styles(self):
+        # 删除或改名空出的名称如果原本遮住了样式包中的同名样式（例如修改过的包样式），
+        # 包中的版本重新出现，与重新加载后的结果一致
+        for pack in self.packs.values():
+            if pack.loaded:
+                pack.ids |= self._merge_pack(pack)
+
+    def _unload_pack(self, pack):
+        for style_id in pack.ids:
+            if self.origins.get(style_id) == pack.path:
+                del self.origins[style_id]
+                self._delete(style_id)
+        pack.ids = set()
+        pack.styles = []
+        pack.loaded = False
+
+    def _save_manifests(self):
+        # 清单只是缓存，直接在锁内写出，不经过后台写入队列
+        manifests = {path: pack.manifest for path, pack in self.packs.items() if pack.manifest is not None}
+        try:
+            save_json_content(pack_manifest_path, manifests)
+        except Exception as e:
+            metrics.error("pack", f"保存样式包清单错误: {str(e)}")
+
+    def _ensure_packs(self, packs):
+        packs = [pack for pack in packs if not pack.loaded]
+        if not packs:
+            return
+        with self._commit_lock, self._lock.write():
+            for pack in packs:
+                if not pack.loaded:
+                    self._load_pack(pack)
+            self._bump()
+
+    def _pack_manifest(self, pack):
+        # 清单失效（包文件变化或首次发现）时只能解析该包
+        if not pack.loaded and not pack.manifest_valid(get_file_signature(pack.path)):
+            self._ensure_packs([pack])
+        return pack.manifest or {}
+
+    def _ensure_all_packs(self):
+        self._ensure_packs(list(self.packs.values()))
+
+    def _ensure_packs_for_category(self, category):
+        self._ensure_packs([pack for pack in list(self.packs.values()) if category in self._pack_manifest(pack).get("categories", ())])
+
+    def _ensure_pack_for_name(self, name):
+        for pack in list(self.packs.values()):
+            if name in self._pack_manifest(pack).get("names", {}):
+                self._ensure_packs([pack])
+                return
+
+    def _ensure_pack_for_id(self, style_id):
+        for pack in list(self.packs.values()):
+            if style_id in self._pack_manifest(pack).get("names", {}).values():
+                self._ensure_packs([pack])
+                return
+
+    def _pack_may_use(self, path):
+        for pack in self.packs.values():
+            if pack.loaded:
+                continue
+            if not pack.manifest_valid(get_file_signature(pack.path)) or path in pack.manifest.get("images", ()):
+                return True
+        return False
+
+    def pack_of(self, name):
+        # 样式来自只读样式包时返回包名，否则返回 None
+        style_id = self.id_of(name)
+        path = self.origins.get(style_id)
+        return self.packs[path].name if path in self.packs else None
+
+    def _ref_image(self, ref, delta):
+        # 预览图引用计数，按解析后的绝对路径统计；计数归零的图片等待回收
+        if not ref:
+            return
+        path = resolve_image_path(ref)
+        count = self.image_refs.get(path, 0) + delta
+        if count > 0:
+            self.image_refs[path] = count
+        else:
+            self.image_refs.pop(path, None)
+            self._released.add(path)
+
+    # 增量更新索引，同时用于实时修改和日志回放，所有操作都是幂等的
+    def _index_remove(self, name, category):
+        names = self.by_category.get(category)
+        if names is not None:
+            index = bisect.bisect_left(names, name)
+            if index < len(names) and names[index] == name:
+                del names[index]
+            if not names:
+                del self.by_category[category]
+
+    def _apply_op(self, op):
+        kind = op.get("op")
+        if kind == "put":
+            # 修改来自样式包的样式时，修改后的版本保存在默认样式库中并覆盖包中的版本
+            style = self._with_id(op["style"])
+            self.origins.pop(style['id'], None)
+            self._put(style)
+        elif kind == "rename":
+            old = self.styles_by_id.get(op["id"])
+            if old is not None:
+                self._put(dict(old, name=op["name"]))
+        elif kind == "delete":
+            # 早期日志按名称删除
+            style_id = op["id"] if "id" in op else self.ids_by_name.get(op.get("name"))
+            self._delete(style_id)
+        elif kind == "add_category":
+            if op["name"] not in self.categories:
+                self.categories[op["name"]] = None
+                self._touch_category(op["name"])
+        elif kind == "rename_category":
+            old_name, new_name = op["old"], op["new"]
+            if old_name in self.categories:
+                # 保持分类原有的顺序
+                self.categories = {new_name if name == old_name else name: None for name in self.categories}
+            self._touch_category(old_name)
+            self._touch_category(new_name)
+            self._move_category_styles(old_name, new_name)
+        elif kind == "delete_category":
+            self.categories.pop(op["name"], None)
+            self._touch_category(op["name"])
+            self._move_category_styles(op["name"], "")
+
+    def _op_target(self, op):
+        # 样式操作作用的样式 ID；与 _apply_op 中的查找方式一致
+        kind = op.get("op")
+        if kind == "put":
+            return op["style"].get('id') or self.ids_by_name.get(op["style"]['name'])
+        if kind in ("rename", "delete"):
+            return op["id"] if "id" in op else self.ids_by_name.get(op.get("name"))
+        return None
+
+    def _journal_op(self, op):
+        # 样式操作附带目标样式修改前的摘要；样式包中的样式不在样式文件里，按不存在记录
+        if op.get("op") not in ("put", "rename", "delete"):
+            return op
+        style_id = self._op_target(op)
+        before = None if style_id in self.origins else style_digest(self.styles_by_id.get(style_id))
+        return dict(op, before=before)
+
+    def _with_id(self, style):
+        # 早期日志和导入的数据可能没有 ID：同名样式沿用已有 ID，否则按名称生成
+        if style.get('id'):
+            return style
+        style_id = self.ids_by_name.get(style['name']) or legacy_style_id(style['name'], self.styles_by_id)
+        return {"id": style_id, **style}
+
+    def _put(self, style, declare=True):
+        if not isinstance(style, StyleRecord):
+            style = StyleRecord(style, self.strings)
+        style_id = style['id']
+        other_id = self.ids_by_name.get(style['name'])
+        if other_id is not None and other_id != style_id:
+            # 名称必须唯一，被同名记录覆盖的旧记录直接移除
+            self._delete(other_id)
+        old = self.styles_by_id.get(style_id)
+        self._ref_image(style.get('image'), 1)
+        if old is not None:
+            self._ref_image(old.get('image'), -1)
+            self._index_remove(old['name'], old.get('category'))
+            if self.ids_by_name.get(old['name']) == style_id:
+                del self.ids_by_name[old['name']]
+        self.styles_by_id[style_id] = style
+        self.ids_by_name[style['name']] = style_id
+        self.revisions[style_id] = self.version
+        # 只有分类成员变化（新增、改名或换分类）才算修改了分类
+        if old is None or old['name'] != style['name'] or old.get('category') != style.get('category'):
+            if old is not None:
+                self._touch_category(old.get('category'))
+            self._touch_category(style.get('category'))
+        if self.token_index is not None:
+            self.token_index.add(style_id, style)
+        bisect.insort(self.by_category.setdefault(style.get('category'), []), style['name'])
+        if declare and style.get('category') and style.get('category') not in self.categories:
+            self.categories[style.get('category')] = None
+
+    def _delete(self, style_id):
+        old = self.styles_by_id.pop(style_id, None)
+        if old is None:
+            return
+        self.revisions[style_id] = self.version
+        self._touch_category(old.get('category'))
+        self._ref_image(old.get('image'), -1)
+        if self.token_index is not None:
+            self.token_index.remove(style_id)
+        self._index_remove(old['name'], old.get('category'))
+        if self.ids_by_name.get(old['name']) == style_id:
+            del self.ids_by_name[old['name']]
+
+    def _move_category_styles(self, old_name, new_name):
+        # 只处理该分类下的样式，不扫描整个样式库，但耗时仍与分类的样式数成正比（每个约数微秒）：
+        # 分类名直接保存在样式记录中，记录对读取方不可变，每个成员都要换成新记录并更新修改版本，
+        # 样式文件也按名称保存分类。改为保存分类 ID 虽能做到常数时间，但所有读取分类的地方都要多一次映射
+        # 样式包中的样式只读，保留在原分类下
+        members = self.by_category.pop(old_name, [])
+        names = [name for name in members if self.ids_by_name[name] not in self.origins]
+        kept = [name for name in members if self.ids_by_name[name] in self.origins]
+        if kept:
+            self.by_category[old_name] = kept
+        category = self.strings.intern(new_name)
+        for name in names:
+            style_id = self.ids_by_name[name]
+            self.styles_by_id[style_id] = self.styles_by_id[style_id].replace(category=category)
+            self.revisions[style_id] = self.version
+        if names:
+            self.by_category[new_name] = sorted(self.by_category.get(new_name, []) + names)
+            self._touch_category(new_name)
+
+    def _touch_category(self, name):
+        self.category_revisions[name] = self.version
+
+    @metrics.timed("StyleStore.commit")
+    def commit(self, ops, expected_version=None):
+        # 一次修改作为一条日志记录写入，保证样式与分类同时生效。
+        # 在文件锁内先载入其他进程的修改，再按 expected_version 做比较并交换：
+        # 涉及的样式在该版本之后被改动过时抛出 StyleConflictError，不覆盖别人的修改。
+        # 日志行在文件锁内同步追加（其他进程在文件锁内读取日志，必须先看到这一行），
+        # fsync、压缩和预览图清理交给后台写入线程
+        with self._commit_lock:
+            with self.file_lock:
+                self.refresh()
+                with self._lock.write():
+                    conflict = self._conflicts(ops, expected_version) if expected_version is not None else None
+                    if conflict:
+                        raise StyleConflictError(conflict)
+                    self.version += 1
+                    journal_ops = []
+                    for op in ops:
+                        journal_ops.append(self._journal_op(op))
+                        self._apply_op(op)
+                    if any(op.get("op") in ("delete", "rename") for op in ops):
+                        self._restore_pack_styles()
+                    self._compiled = {}
+                    self._uncompacted += 1
+                    # 批量导入等大事务提交后立即压缩，避免日志中留下很长的记录
+                    compact = self._uncompacted >= self.COMPACT_EVERY or len(ops) >= self.COMPACT_EVERY
+                    if compact:
+                        self._uncompacted = 0
+                    released, self._released = self._released, set()
+                sync = self.journal.append(journal_ops)
+                self.signature = self._signatures()
+        # 入队可能因队列已满而阻塞，此时不能持有任何锁，否则后台压缩无法进行
+        if sync:
+            self.journal.schedule_sync()
+        if released:
+            self.writer.submit(self.collect_images, released)
+        if compact:
+            self.writer.submit(self.compact)
+        return self.version
+
+    def _conflicts(self, ops, expected_version):
+        # 返回冲突时的提示信息，没有冲突时返回 None
+        for op in ops:
+            kind = op.get("op")
+            if kind == "put":
+                targets = (op["style"].get('id'), self.ids_by_name.get(op["style"]['name']))
+            elif kind == "rename":
+                targets = (op["id"], self.ids_by_name.get(op["name"]))
+            elif kind == "delete":
+                targets = (op.get("id"), self.ids_by_name.get(op.get("name")))
+            elif kind in ("add_category", "delete_category"):
+                if self._category_revision(op["name"]) > expected_version:
+                    return CATEGORY_CONFLICT_MESSAGE
+                continue
+            elif kind == "rename_category":
+                if self._category_revision(op["old"]) > expected_version or self._category_revision(op["new"]) > expected_version:
+                    return CATEGORY_CONFLICT_MESSAGE
+                continue
+            else:
+                continue
+            if any(self._revision(style_id) > expected_version for style_id in targets if style_id):
+                return STYLE_CONFLICT_MESSAGE
+        return None
+
+    def _category_revision(self, name):
+        revision = self.category_revisions.get(name)
+        if revision is None:
+            return self._base_revision if name in self.categories or name in self.by_category else 0
+        return revision
+
+    def _revision(self, style_id):
+        revision = self.revisions.get(style_id)
+        if revision is None:
+            return self._base_revision if style_id in self.styles_by_id else 0
+        return revision
+
+    def current_version(self):
+        # 作为 expected_version 记录的版本必须在加载之后读取：冷启动时版本为 0，
+        # 加载后所有样式的修改版本都大于它，第一次修改会被误判为冲突
+        self.ensure_loaded()
+        return self.version
+
+    def revision_of(self, style_id):
+        with self._lock.read():
+            return self._revision(style_id)
+
+    def collect_images(self, paths):
+        # 回收不再被任何样式引用的预览图；执行时再次检查计数，防止期间又被引用。
+        # 未加载的样式包按清单判断是否引用；清单已失效时保守地保留图片
+        for path in paths:
+            with self._lock.read():
+                if self.image_refs.get(path) or self._pack_may_use(path):
+                    continue
+            if is_managed_image(path):
+                remove_file(path)
+
+    @metrics.timed("StyleStore.compact")
+    def compact(self):
+        # 压缩前在文件锁内载入其他进程追加的日志，否则截断日志会丢失它们的修改
+        with self._commit_lock, self.file_lock:
+            self.refresh()
+            with self._lock.read():
+                self._write_library(self.file_path, self.categories_path)
+                if self.journal_rejected:
+                    # 冲突的修改追加保存为日志格式，需要时可以手工找回
+                    with open(self.rejected_path, 'a', encoding="utf-8") as file:
+                        file.write(json.dumps(self.journal_rejected, ensure_ascii=False, default=json_default) + "\n")
+                self.journal_rejected = None
+                self.journal.truncate()
+                key = source_digest(read_file_bytes(self.file_path), read_file_bytes(self.categories_path))
+                self.journal.base = key
+                self.signature = self._signatures()
+                # 持有 _commit_lock 期间没有新的修改，可以安全地丢弃被覆盖的旧字符串
+                self.strings = StringPool.of(self.styles_by_id.values())
+                # 压缩后的文件与内存中的默认样式库一致，直接生成快照，下次启动无需解析
+                self._save_snapshot(key, compacted=True)
+
+    def _check_loaded(self):
+        # 源文件无法解析时内存中只有旧内容（首次加载失败时为空），写回会覆盖用户的文件
+        if self.load_error is not None:
+            raise StyleLibraryError(f"样式文件无法解析，已停止写回: {self.load_error}")
+
+    def _write_library(self, file_path, categories_path=None):
+        if file_path == self.file_path:
+            self._check_loaded()
+        # 样式包中的样式不写回默认样式库
+        save_json_content(file_path, [style for style_id, style in self.styles_by_id.items() if style_id not in self.origins])
+        if categories_path:
+            # 为兼容旧版本仍写出 {分类: [样式名]} 格式，内容完全由样式记录推导
+            save_json_content(categories_path, {
+                name: [member for member in self.by_category.get(name, []) if self.ids_by_name[member] not in self.origins]
+                for name in self.categories
+            })
+
+    def check_categories(self):
+        # 返回加载时发现的文件不一致问题，以及内存索引的自检结果
+        self.ensure_loaded()
+        with self._lock.read():
+            issues = list(self.category_issues)
+            if self.load_error is not None:
+                issues.insert(0, f"样式文件无法解析，正在使用上次成功加载的内容: {self.load_error}")
+            for category, names in self.by_category.items():
+                for name in names:
+                    style = self.styles_by_id.get(self.ids_by_name.get(name))
+                    if style is None or style.get('category') != category:
+                        issues.append(f"索引中的样式 {name} 不属于分类 {category}")
+            indexed = sum(len(names) for names in self.by_category.values())
+            if indexed != len(self.styles_by_id):
+                issues.append(f"分类索引包含 {indexed} 个样式，样式库中有 {len(self.styles_by_id)} 个")
+            if len(self.ids_by_name) != len(self.styles_by_id):
+                issues.append(f"名称索引包含 {len(self.ids_by_name)} 个样式，样式库中有 {len(self.styles_by_id)} 个")
+            return issues
+
+    def repair_categories(self, expected_version=None):
+        # 按样式记录重建分类索引并重写 categories.json；
+        # expected_version 之后有分类被修改过时抛出 StyleConflictError，需要重新检查后再修复
+        self.writer.flush()
+        with self._commit_lock, self.file_lock:
+            self.refresh()
+            self._check_loaded()
+            with self._lock.write():
+                if expected_version is not None and any(
+                        revision > expected_version for revision in self.category_revisions.values()):
+                    raise StyleConflictError(CATEGORY_CONFLICT_MESSAGE)
+                by_category = {}
+                for style in self.styles_by_id.values():
+                    by_category.setdefault(style.get('category'), []).append(style['name'])
+                    if style.get('category') and style.get('category') not in self.categories:
+                        self.categories[style.get('category')] = None
+                for names in by_category.values():
+                    names.sort()
+                self.version += 1
+                for name in self.by_category.keys() | by_category.keys():
+                    if self.by_category.get(name) != by_category.get(name):
+                        self._touch_category(name)
+                self.by_category = by_category
+                self._compiled = {}
+                self._search_index = None
+                self.compact()
+                self.category_issues = []
+
+    def export_library(self, file_path, categories_path=None):
+        # 导出为原有的 sdxl_styles.json / categories.json 格式
+        self.ensure_loaded()
+        self.writer.flush()
+        with self._lock.read():
+            self._write_library(file_path, categories_path)
+
+    def import_library(self, file_path, categories_path=None):
+        if categories_path:
+            self.commit([{"op": "add_category", "name": name} for name in get_json_content(categories_path)])
+        imported, _, _ = self.import_styles(iter_import_styles(file_path), overwrite=True)
+        return imported
+
+    @metrics.timed("StyleStore.import_styles")
+    def import_styles(self, styles, overwrite=False, progress=None):
+        # 批量导入：校验并按名称去重（文件内重复的保留第一条），全部样式作为一条日志记录提交。
+        # 返回 (导入数, 跳过的重名数, 无效记录数)；progress(已处理条数) 每千条调用一次
+        self.refresh()
+        self._ensure_all_packs()
+        version = self.version
+        ops = []
+        seen = set()
+        new_ids = set()
+        skipped = invalid = 0
+        for count, style in enumerate(styles, 1):
+            if progress is not None and count % 1000 == 0:
+                progress(count)
+            if style is None:
+                invalid += 1
+                continue
+            if style['name'] in seen:
+                skipped += 1
+                continue
+            seen.add(style['name'])
+            style_id = self.ids_by_name.get(style['name'])
+            if style_id is not None:
+                if not overwrite or style_id in self.origins:
+                    skipped += 1
+                    continue
+                # 覆盖时保留原有 ID，导入数据中没有的字段（如预览图）沿用原值
+                style = {**self.styles_by_id[style_id], **style}
+            else:
+                style_id = new_style_id(new_ids)
+                while style_id in self.styles_by_id:
+                    style_id = new_style_id(new_ids)
+                new_ids.add(style_id)
+            ops.append({"op": "put", "style": {"id": style_id, **style}})
+        if ops:
+            self.commit(ops, version)
+        return len(ops), skipped, invalid
+
+    def export_snapshot(self, category=None):
+        # 导出用的快照：只复制样式记录的引用，按分类分组；category 为 None 时导出全部分类
+        self.ensure_loaded()
+        self._ensure_all_packs()
+        with self._lock.read():
+            categories = [category] if category is not None else list(dict.fromkeys(list(self.categories) + list(self.by_category)))
+            return [(name, [self.styles_by_id[self.ids_by_name[member]] for member in self.by_category.get(name, [])])
+                    for name in categories]
+
+    def close(self):
+        self.writer.flush()
+        with self._commit_lock:
+            self.journal.close()
+
+    def get(self, name):
+        self.ensure_loaded()
+        style_id = self.ids_by_name.get(name)
+        if style_id is None and self.packs:
+            self._ensure_pack_for_name(name)
+            style_id = self.ids_by_name.get(name)
+        return self.styles_by_id.get(style_id)
+
+    def get_by_id(self, style_id):
+        self.ensure_loaded()
+        if style_id not in self.styles_by_id and self.packs:
+            self._ensure_pack_for_id(style_id)
+        return self.styles_by_id.get(style_id)
+
+    def id_of(self, name):
+        style = self.get(name)
+        return style['id'] if style is not None else None
+
+    def compiled(self, name):
+        return self.compiled_many([name])[1][0]
+
+    def compiled_many(self, names):
+        # 在同一个读锁内取出多个样式，一次生成任务看到的始终是同一版本的样式库；
+        # 编译结果按库版本缓存，样式库变化时整体失效
+        for name in names:
+            self.get(name)
+        with self._lock.read():
+            return self.version, [self._compile(name) for name in names]
+
+    def _compile(self, name):
+        compiled = self._compiled.get(name)
+        metrics.cache("compiled_style", compiled is not None)
+        if compiled is None:
+            template = self.styles_by_id.get(self.ids_by_name.get(name))
+            if template is None:
+                return None
+            compiled = CompiledStyle(name, template.get('prompt', ''), template.get('negative_prompt', ''), template['id'])
+            self._compiled[name] = compiled
+        return compiled
+
+    @contextlib.contextmanager
+    def read_lock(self):
+        # 持有读锁期间样式库不会变化；读锁内不能再触发重新加载或加载样式包
+        self.ensure_loaded()
+        with self._lock.read():
+            yield
+
+    def prompt_index(self):
+        # 倒排索引在第一次查询时构建，之后随每次修改增量更新
+        # 构建在锁外基于快照进行，期间样式库若有变化则重新构建
+        while True:
+            self.ensure_loaded()
+            self._ensure_all_packs()
+            with self._lock.read():
+                if self.token_index is not None:
+                    return self.token_index
+                version = self.version
+                styles = list(self.styles_by_id.items())
+            token_index = PromptTokenIndex()
+            for style_id, style in styles:
+                token_index.add(style_id, style)
+            with self._lock.write():
+                if self.version == version:
+                    self.token_index = token_index
+                    return token_index
+
+    def warm_up(self):
+        # 启动时在后台线程中加载样式库并预先构建倒排索引，界面构建和首次查询都无需等待；
+        # txt2img 和 img2img 两个标签页共用同一个任务
+        if self._warm_thread is None:
+            self._warm_thread = threading.Thread(target=self._warm, name="style-selector-load", daemon=True)
+            self._warm_thread.start()
+
+    def _warm(self):
+        started = time.perf_counter()
+        try:
+            self.ensure_loaded()
+            self.category_names()
+        except Exception as e:
+            metrics.error("library", f"加载样式库错误: {str(e)}")
+        finally:
+            self.load_seconds = time.perf_counter() - started
+            self.ready.set()
+        self.prompt_index()
+
+    def search_index(self):
+        self.ensure_loaded()
+        self._ensure_all_packs()
+        with self._lock.read():
+            # 并发的读取方可能各自构建一次，结果相同，替换引用本身是原子的
+            hit = self._search_index is not None and self._search_index[0] == self.version
+            metrics.cache("search_index", hit)
+            if not hit:
+                self._search_index = (self.version, StyleSearchIndex(list(self.styles_by_id.values())))
+            return self._search_index[1]
+
+    def names(self, category):
+        self.ensure_loaded()
+        if self.packs:
+            self._ensure_packs_for_category(category)
+        return list(self.by_category.get(category, []))
+
+    def all_styles(self):
+        self.ensure_loaded()
+        self._ensure_all_packs()
+        return list(self.styles_by_id.values())
+
+    def category_members(self, category):
+        return self.names(category)
+
+    def category_names(self):
+        self.ensure_loaded()
+        names = dict.fromkeys(self.categories)
+        for pack in list(self.packs.values()):
+            names.update(dict.fromkeys(self._pack_manifest(pack).get("categories", ())))
+        return list(names)
+
+    def is_pack_category(self, category):
+        # 样式包中有样式属于该分类时不能在界面中改名或删除：包中的样式只读，会留在原分类下。
+        # 修改过的包样式会在默认样式库中声明同名分类，因此按包清单判断，而不是看默认样式库中有没有该分类
+        self.ensure_loaded()
+        return any(category in self._pack_manifest(pack).get("categories", ()) for pack in list(self.packs.values()))
+
+    def put_style(self, style, expected_version=None):
+        return self.commit([{"op": "put", "style": style}], expected_version)
+
+    def delete_style(self, name, expected_version=None):
+        return self.commit([{"op": "delete", "id": self.id_of(name)}], expected_version)
+
+    def rename_style(self, style_id, new_name, expected_version=None):
+        return self.commit([{"op": "rename", "id": style_id, "name": new_name}], expected_version)
+
+    def add_category(self, name, expected_version=None):
+        return self.commit([{"op": "add_category", "name": name}], expected_version)
+
+    def rename_category(self, old_name, new_name, expected_version=None):
+        return self.commit([{"op": "rename_category", "old": old_name, "new": new_name}], expected_version)
+
+    def delete_category(self, name, expected_version=None):
+        return self.commit([{"op": "delete_category", "name": name}], expected_version)
+
+class StyleLibraryWatcher:
+    # 在后台监视样式文件：安装了 inotify_simple 时等待文件事件，否则定期比较文件签名。
+    # 连续写入在安静 DEBOUNCE 秒后才重新加载，解析不占用请求线程；
+    # 请求线程只读取当前已加载的样式库（见 StyleStore.ensure_loaded），首次加载之后的重新加载都在这里完成
+    POLL_INTERVAL = 1.0
+    INOTIFY_TIMEOUT = 5.0
+    DEBOUNCE = 0.5
+
+    def __init__(self, store):
+        self.store = store
+        self.backend = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._watched = {}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="style-selector-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.INOTIFY_TIMEOUT + 1)
+
+    def _paths(self):
+        # 日志也要监视：其他 WebUI 进程追加的修改同样需要重新加载
+        paths = [self.store.file_path, self.store.categories_path, self.store.journal.file_path,
+                 style_pack_folder] + get_style_pack_paths()
+        return list(dict.fromkeys(paths))
+
+    def _snapshot(self):
+        # 目录的签名也包含在内，新增或删除样式包文件同样会被发现
+        return tuple(get_file_signature(path) for path in self._paths())
+
+    def _watch_dirs(self, inotify):
+        # 日志一直保持打开，追加时只有 MODIFY 事件
+        mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MODIFY | inotify_flags.MOVED_TO | inotify_flags.CREATE
+                | inotify_flags.DELETE | inotify_flags.MOVED_FROM)
+        for path in self._paths():
+            folder = path if os.path.isdir(path) else os.path.dirname(path)
+            if folder in self._watched or not os.path.isdir(folder):
+                continue
+            try:
+                self._watched[folder] = inotify.add_watch(folder, mask)
+            except OSError:
+                pass
+
+    def _reload(self):
+        try:
+            self.store.refresh(check_packs=True)
+        except Exception as e:
+            metrics.error("watcher", f"重新加载样式库错误: {str(e)}")
+
+    def _run(self):
+        inotify = None
+        if INotify is not None:
+            try:
+                inotify = INotify()
+            except OSError:
+                inotify = None
+        self.backend = "inotify" if inotify is not None else "poll"
+        try:
+            if inotify is not None:
+                self._run_inotify(inotify)
+            else:
+                self._run_poll()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _run_inotify(self, inotify):
+        while not self._stop.is_set():
+            self._watch_dirs(inotify)
+            events = inotify.read(timeout=int(self.INOTIFY_TIMEOUT * 1000))
+            if self._stop.is_set():
+                return
+            if not events:
+                # 超时时也检查一次，覆盖未被监视的目录
+                self._reload()
+                continue
+            while inotify.read(timeout=int(self.DEBOUNCE * 1000)):
+                pass
+            self._reload()
+
+    def _run_poll(self):
+        last = self._snapshot()
+        while not self._stop.wait(self.POLL_INTERVAL):
+            current = self._snapshot()
+            if current == last:
+                continue
+            # 等待文件不再变化，避免读到写了一半的文件
+            while not self._stop.wait(self.DEBOUNCE):
+                settled = self._snapshot()
+                if settled == current:
+                    break
+                current = settled
+            last = current
+            self._reload()
+
+class StyleUsage:
+    # 样式使用统计：按样式 ID 记录套用次数、最近使用时间和收藏列表（改名后仍有效）。
+    # 生成时只修改内存中的计数；有改动时在 FLUSH_INTERVAL 秒后由后台写入线程保存，不阻塞生成
+    FLUSH_INTERVAL = 30.0
+
+    def __init__(self, file_path, writer):
+        self.file_path = file_path
+        self.writer = writer
+        self.counts = {}
+        self.last_used = {}
+        self.favorites = []
+        self._loaded = False
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        # 第一次使用时才读取文件，导入脚本时不访问磁盘
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                if os.path.exists(self.file_path):
+                    with open(self.file_path, "r", encoding="utf-8") as file:
+                        data = json.load(file)
+                    for style_id, (count, last_used) in data.get("styles", {}).items():
+                        self.counts[style_id] = int(count)
+                        self.last_used[style_id] = float(last_used)
+                    self.favorites = [style_id for style_id in data.get("favorites", []) if isinstance(style_id, str)]
+            except Exception as e:
+                metrics.error("usage", f"读取使用统计错误: {str(e)}")
+            self._loaded = True
+
+    def record(self, style_ids):
+        self._ensure_loaded()
+        now = time.time()
+        with self._lock:
+            for style_id in style_ids:
+                self.counts[style_id] = self.counts.get(style_id, 0) + 1
+                self.last_used[style_id] = now
+        self._schedule_flush()
+
+    def favorite_ids(self):
+        self._ensure_loaded()
+        return set(self.favorites)
+
+    def toggle_favorite(self, style_id):
+        self._ensure_loaded()
+        with self._lock:
+            pinned = style_id not in self.favorites
+            self.favorites = self.favorites + [style_id] if pinned else [item for item in self.favorites if item != style_id]
+        self._schedule_flush()
+        return pinned
+
+    def snapshot(self):
+        self._ensure_loaded()
+        with self._lock:
+            return dict(self.counts), dict(self.last_used), list(self.favorites)
+
+    def _schedule_flush(self):
+        with self._lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.FLUSH_INTERVAL, self._submit_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _submit_flush(self):
+        with self._lock:
+            self._timer = None
+        self.writer.submit(self.flush)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = {
+                    "styles": {style_id: [count, round(self.last_used.get(style_id, 0.0), 3)]
+                               for style_id, count in self.counts.items()},
+                    "favorites": list(self.favorites),
+                }
+            try:
+                save_json_content(self.file_path, data)
+            except Exception as e:
+                self._dirty = True
+                metrics.error("usage", f"保存使用统计错误: {str(e)}")
+
+    def close(self):
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+stylespath = os.path.join(scripts.basedir(), 'sdxl_styles.json')
+style_writer = BackgroundWriter()
+style_store = StyleStore(stylespath, categoriespath, style_writer)
+style_watcher = StyleLibraryWatcher(style_store)
+style_usage = StyleUsage(usage_path, style_writer)
+
+def start_style_watcher(_, app):
+    if getattr(shared.opts, "style_selector_watch_library", True):
+        style_watcher.start()
+
+def flush_style_store():
+    # WebUI 关闭或重载脚本时，把排队中的写入全部落盘
+    style_watcher.stop()
+    style_store.close()
+    style_usage.close()
+    style_writer.shutdown()
+
+script_callbacks.on_script_unloaded(flush_style_store)
+atexit.register(flush_style_store)
+
+def get_categories():
+    return [cat for cat in style_store.category_names() if cat != "全部"]
+
+@metrics.timed("getStyles")
+def getStyles(category):
+    return style_store.names(category)
+
+# 样式搜索：名称、正向提示词和分类上的预建索引，结果分页返回，避免一次渲染数千个单选按钮
+STYLE_PAGE_SIZE = 50
+STYLE_PAGE_SIZE_LIMIT = 500
+STYLE_VERSION_POLL_INTERVAL = 2
+SEARCH_MODES = ["前缀", "包含", "模糊"]
+STYLE_SORTS = ["名称", "最常用", "最近使用"]
+
+class StyleSearchIndex:
+    def __init__(self, styles):
+        entries = sorted((style['name'].lower(), style['name']) for style in styles)
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+        self.categories = {style['name']: style.get('category') for style in styles}
+        self.haystacks = [
+            (style['name'], "\n".join((style['name'], style.get('prompt') or '', style.get('category') or '')).lower())
+            for style in styles
+        ]
+        self._bigrams = None
+
+    def prefix(self, query):
+        query = query.lower()
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + "\U0010ffff")
+        return self.names[start:end]
+
+    def substring(self, query):
+        query = query.lower()
+        return sorted(name for name, haystack in self.haystacks if query in haystack)
+
+    @staticmethod
+    def _grams(text):
+        return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+    def fuzzy(self, query, limit=200):
+        # 先用名称的二元字符索引挑出候选，再对候选计算相似度排序
+        query = query.lower()
+        if self._bigrams is None:
+            bigrams = {}
+            for position, key in enumerate(self.keys):
+                for gram in self._grams(key):
+                    bigrams.setdefault(gram, []).append(position)
+            self._bigrams = bigrams
+        query_grams = self._grams(query)
+        hits = {}
+        for gram in query_grams:
+            for position in self._bigrams.get(gram, ()):
+                hits[position] = hits.get(position, 0) + 1
+        threshold = max(1, len(query_grams) // 2)
+        candidates = heapq.nlargest(limit * 10, (item for item in hits.items() if item[1] >= threshold),
+                                    key=lambda item: item[1])
+        matcher = difflib.SequenceMatcher(b=query, autojunk=False)
+        scored = []
+        for position, _ in candidates:
+            matcher.set_seq1(self.keys[position])
+            ratio = matcher.ratio()
+            if ratio >= 0.5:
+                scored.append((-ratio, self.names[position]))
+        scored.sort()
+        return [name for _, name in scored[:limit]]
+
+def get_search_index():
+    return style_store.search_index()
+
+def match_styles(query, category=None, mode="前缀"):
+    if not query:
+        return style_store.names(category) if category is not None else [name for name in get_search_index().names]
+    index = get_search_index()
+    if mode == "模糊":
+        names = index.fuzzy(query)
+    elif mode == "包含":
+        names = index.substring(query)
+    else:
+        names = index.prefix(query)
+    if category is not None:
+        names = [name for name in names if index.categories.get(name) == category]
+    return names
+
+def rank_styles_by_usage(query, category, mode, sort, limit):
+    # 收藏的样式排在最前，其余只从有使用记录的样式中按次数或最近使用时间取前 limit 个，
+    # 耗时与分类大小无关；有搜索词时只在匹配的样式中排序
+    counts, last_used, favorites = style_usage.snapshot()
+    allowed = set(match_styles(query, category, mode)) if query else None
+    if category is not None and style_store.packs:
+        style_store.names(category)
+    if sort == STYLE_SORTS[1]:
+        key = lambda style_id: (counts[style_id], last_used.get(style_id, 0.0))
+    else:
+        key = lambda style_id: last_used.get(style_id, 0.0)
+    favorite_ids = set(favorites)
+    candidates = favorites + sorted((style_id for style_id in counts if style_id not in favorite_ids), key=key, reverse=True)
+    names = []
+    with style_store.read_lock():
+        for style_id in candidates:
+            style = style_store.styles_by_id.get(style_id)
+            if style is None or (category is not None and style.get('category', '') != category):
+                continue
+            if allowed is None or style['name'] in allowed:
+                names.append(style['name'])
+                if len(names) >= limit:
+                    break
+    return names
+
+@metrics.timed("search_styles")
+def search_styles(query, category=None, mode="前缀", page=1, page_size=STYLE_PAGE_SIZE, sort=STYLE_SORTS[0]):
+    query = (query or "").strip()
+    page_size = min(max(1, int(page_size or STYLE_PAGE_SIZE)), STYLE_PAGE_SIZE_LIMIT)
+    if sort in STYLE_SORTS[1:]:
+        names = rank_styles_by_usage(query, category, mode, sort, page_size)
+        return {"names": names, "total": len(names), "page": 1, "pages": 1}
+    names = match_styles(query, category, mode)
+    total = len(names)
+    pages = max(1, (total + page_size - 1) // page_size)
+    page = min(max(1, int(page or 1)), pages)
+    start = (page - 1) * page_size
+    return {"names": names[start:start + page_size], "total": total, "page": page, "pages": pages}
+
+def style_choices(category):
+    return style_choice_items(search_styles("", category)["names"])
+
+PROMPT_SEARCH_MODES = ["and", "or"]
+
+@metrics.timed("find_styles_by_prompt")
+def find_styles_by_prompt(query, mode="and", limit=STYLE_PAGE_SIZE):
+    # 查找正向/反向提示词中包含指定词、短语或 LoRA 标签的样式，按相关度排序
+    terms = parse_prompt_query(query)
+    index = style_store.prompt_index()
+    with style_store.read_lock():
+        results = index.search(terms, mode, limit)
+        styles = [(style_store.styles_by_id[style_id], score) for style_id, score in results]
+        return [{"id": style['id'], "name": style['name'], "category": style.get('category', ''), "score": round(score, 3)}
+                for style, score in styles]
+
+def find_styles_with_feedback(query, mode):
+    if not parse_prompt_query(query):
+        return gr.update(), "请输入要查找的提示词"
+    results = find_styles_by_prompt(query, "or" if mode == "任一包含" else "and")
+    return gr.update(choices=style_choice_items([item["name"] for item in results])), f"找到 {len(results)} 个样式（按相关度排序）"
+
+@metrics.timed("get_style_gallery")
+def get_style_gallery(names):
+    # 图库视图只包含有预览图的样式，使用缩略图保持响应体积很小
+    items = []
+    for name in names:
+        template = style_store.get(name)
+        if template is not None and template.get('image'):
+            thumbnail = thumbnail_cache.get(resolve_image_path(template['image']))
+            if thumbnail:
+                items.append((thumbnail, name))
+    return items
+
+@metrics.timed("browse_styles")
+def browse_styles(query, mode, only_category, category, page, show_gallery, sort=STYLE_SORTS[0]):
+    result = search_styles(query, category if only_category else None, mode, page, sort=sort)
+    gallery_items = get_style_gallery(result["names"]) if show_gallery else []
+    if sort in STYLE_SORTS[1:]:
+        info = f"收藏和{sort}的 {result['total']} 个样式"
+    else:
+        info = f"第 {result['page']}/{result['pages']} 页，共 {result['total']} 个样式"
+    return (
+        gr.update(choices=style_choice_items(result["names"])),
+        result["page"],
+        info,
+        gr.update(value=gallery_items, visible=show_gallery),
+        [name for _, name in gallery_items],
+    )
+
+class CompiledStyle:
+    # 预编译的样式模板：每次生成任务只解析一次，再批量套用到所有提示词
+    PLACEHOLDER = "{prompt}"
+
+    def __init__(self, name, prompt, negative_prompt, style_id=None):
+        self.name = name
+        self.style_id = style_id
+        self.prompt = prompt or ""
+        self.negative_prompt = negative_prompt or ""
+        self._positive_parts = self.prompt.split(self.PLACEHOLDER) if self.PLACEHOLDER in self.prompt else None
+        self._negative_parts = self.negative_prompt.split(self.PLACEHOLDER) if self.PLACEHOLDER in self.negative_prompt else None
+
+    @staticmethod
+    def _fill(parts, text):
+        result = text.join(parts)
+        # 用户输入为空时去掉占位符两侧残留的逗号
+        return result if text else result.strip(" ,")
+
+    def positive(self, text):
+        text = text or ""
+        if self._positive_parts is not None:
+            return self._fill(self._positive_parts, text)
+        if text and self.prompt:
+            return f"{text}, {self.prompt}"
+        return self.prompt or text
+
+    def negative(self, text):
+        text = text or ""
+        if self._negative_parts is not None:
+            return self._fill(self._negative_parts, text)
+        if text and self.negative_prompt:
+            return f"{self.negative_prompt}, {text}"
+        return self.negative_prompt or text
+
+    @staticmethod
+    def _apply_batch(fn, prompts):
+        # 批量任务里的提示词大多重复，相同输入只计算一次
+        results = {}
+        output = []
+        for text in prompts:
+            result = results.get(text)
+            if result is None:
+                result = results[text] = fn(text)
+            output.append(result)
+        return output
+
+    def apply_positive(self, prompts):
+        return self._apply_batch(self.positive, prompts)
+
+    def apply_negative(self, prompts):
+        return self._apply_batch(self.negative, prompts)
+
+    # 模板本身（去掉占位符）的 token 数，按文本缓存在 token_counter 中
+    @property
+    def prompt_tokens(self):
+        return token_counter.count(self.prompt.replace(self.PLACEHOLDER, ""))
+
+    @property
+    def negative_tokens(self):
+        return token_counter.count(self.negative_prompt.replace(self.PLACEHOLDER, ""))
+
+MAX_STACKED_STYLES = 5
+
+def split_prompt_tokens(text):
+    # 按逗号拆分提示词，括号内的逗号（如 "(red, blue:1.2)"）不拆分
+    if not any(ch in text for ch in "([{<"):
+        return [token for token in (part.strip() for part in text.split(",")) if token]
+    tokens = []
+    depth = 0
+    start = 0
+    for i, ch in enumerate(text):
+        if ch in "([{<":
+            depth += 1
+        elif ch in ")]}>" and depth > 0:
+            depth -= 1
+        elif ch == "," and depth == 0:
+            tokens.append(text[start:i].strip())
+            start = i + 1
+    tokens.append(text[start:].strip())
+    return [token for token in tokens if token]
+
+def dedupe_prompt_tokens(text):
+    seen = set()
+    tokens = []
+    for token in split_prompt_tokens(text):
+        key = token.lower()
+        if key not in seen:
+            seen.add(key)
+            tokens.append(token)
+    return ", ".join(tokens)
+
+class LRUCache:
+    # 线程安全的有界 LRU 缓存；name 用于命中率统计
+    def __init__(self, maxsize, name="lru"):
+        self.maxsize = maxsize
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+        metrics.cache(self.name, value is not None)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+composed_prompt_cache = LRUCache(4096, "composed_prompt")
+
+CLIP_CHUNK_TOKENS = 75
+TOKEN_BUDGET_MODES = ["不处理", "警告", "自动裁剪"]
+
+class PromptTokenCounter:
+    # 统计提示词的 CLIP token 数：模型已加载时使用 WEBUI 的分词器（与提示词框右上角的计数一致），
+    # 否则按 CLIP 的预切分规则估算。结果按文本缓存，样式模板只在第一次编译或编辑时计算
+    _pretokens = re.compile(r"'s|'t|'re|'ve|'m|'ll|'d|[^\W\d_]+|\d|[^\s\w]", re.IGNORECASE)
+    _weights = re.compile(r":\s*-?[\d.]+\s*(?=[)\]])")
+    _brackets = re.compile(r"(?<!\\)[()\[\]]")
+
+    def __init__(self, maxsize=65536):
+        self._cache = LRUCache(maxsize, "token_count")
+
+    @staticmethod
+    def _model_hijack():
+        try:
+            from modules import sd_hijack
+        except Exception:
+            return None
+        hijack = sd_hijack.model_hijack
+        return hijack if getattr(hijack, "clip", None) is not None else None
+
+    @property
+    def exact(self):
+        return self._model_hijack() is not None
+
+    def _estimate(self, text):
+        # 权重和强调括号不占 token；常见单词是一个 token，长词按长度拆成多个，标点和数字逐个计
+        text = self._brackets.sub(" ", self._weights.sub("", text))
+        count = 0
+        for piece in self._pretokens.findall(text):
+            count += 1 + max(0, len(piece) - 8) // 6 if piece[0].isalpha() else 1
+        return count
+
+    def count(self, text):
+        text = text or ""
+        count = self._cache.get(text)
+        if count is None:
+            # LoRA 等额外网络标签在编码前会被移除，不计入
+            stripped = _network_tag_pattern.sub("", text)
+            hijack = self._model_hijack()
+            if hijack is not None:
+                try:
+                    count, _ = hijack.get_prompt_lengths(stripped)
+                except Exception:
+                    count = None
+            if not isinstance(count, int):
+                count = self._estimate(stripped)
+            self._cache.put(text, count)
+        return count
+
+    def reset(self, *_):
+        # 模型切换后分词器可能不同，之前的计数（包括估算值）全部作废
+        self._cache.clear()
+
+def token_chunks(count):
+    return max(1, math.ceil(count / CLIP_CHUNK_TOKENS))
+
+token_counter = PromptTokenCounter()
+
+class StyleStack(CompiledStyle):
+    # 按顺序叠加多个样式，并去除重复的提示词片段
+    def __init__(self, styles, version):
+        self.styles = styles
+        self.names = tuple(style.name for style in styles)
+        self.version = version
+        self.name = " + ".join(self.names)
+
+    def _compose(self, kind, text):
+        text = text or ""
+        key = (self.names, self.version, kind, text)
+        result = composed_prompt_cache.get(key)
+        if result is None:
+            result = text
+            for style in self.styles:
+                result = getattr(style, kind)(result)
+            result = dedupe_prompt_tokens(result)
+            composed_prompt_cache.put(key, result)
+        return result
+
+    def positive(self, text):
+        return self._compose("positive", text)
+
+    def negative(self, text):
+        return self._compose("negative", text)
+
+    # 各样式之和加上连接的逗号；去重只会让实际值更小
+    @property
+    def prompt_tokens(self):
+        return sum(style.prompt_tokens + 1 for style in self.styles)
+
+    @property
+    def negative_tokens(self):
+        return sum(style.negative_tokens + 1 for style in self.styles)
+
+def compile_style(style):
+    return style_store.compiled(style)
+
+def get_style_stack(style, stacked_styles=None):
+    # 有叠加样式时按叠加顺序使用，否则使用单选的样式
+    names = [name for name in (stacked_styles or []) if name]
+    if not names and style:
+        names = [style]
+    return list(dict.fromkeys(names))[:MAX_STACKED_STYLES]
+
+@metrics.timed("compile_style_stack")
+def compile_style_stack(styles):
+    version, compiled = style_store.compiled_many(styles)
+    compiled = [style for style in compiled if style is not None]
+    if not compiled:
+        return None
+    if len(compiled) == 1:
+        return compiled[0]
+    return StyleStack(compiled, version)
+
+def createPositive(style, positive):
+    compiled = compile_style(style)
+    if compiled is None:
+        return positive
+    return compiled.positive(positive)
+
+def createNegative(style, negative):
+    compiled = compile_style(style)
+    if compiled is None:
+        return negative
+    return compiled.negative(negative)
+
+def createPositiveMulti(styles, positive):
+    stack = compile_style_stack(styles)
+    if stack is None:
+        return positive
+    return stack.positive(positive)
+
+def createNegativeMulti(styles, negative):
+    stack = compile_style_stack(styles)
+    if stack is None:
+        return negative
+    return stack.negative(negative)
+
+def trim_to_token_budget(text, result, budget):
+    # 从末尾开始去掉样式带来的片段，直到不超过预算；用户自己写的片段始终保留
+    keep = {token.lower() for token in split_prompt_tokens(text)}
+    tokens = split_prompt_tokens(result)
+    index = len(tokens)
+    while index > 0 and token_counter.count(", ".join(tokens)) > budget:
+        index -= 1
+        if tokens[index].lower() not in keep:
+            del tokens[index]
+    return ", ".join(tokens)
+
+def fit_token_budget(compiled, kind, prompts, results, trim):
+    # 套用样式前后各自需要的 75 token 分段数不同时，每张图都会多一次 CLIP 编码。
+    # 先用预先算好的模板 token 数估算（上界），只有估算越界的提示词才对套用结果精确计数
+    style_tokens = compiled.prompt_tokens if kind == "positive" else compiled.negative_tokens
+    # 每个 token 至少对应一个字符，足够短的提示词加上样式也不会超过第一个分段，无需计数
+    short = CLIP_CHUNK_TOKENS - style_tokens - 1
+    fitted = {}
+    for text in set(prompts):
+        if len(text) <= short:
+            continue
+        result = getattr(compiled, kind)(text)
+        text_tokens = token_counter.count(text)
+        budget = token_chunks(text_tokens) * CLIP_CHUNK_TOKENS
+        if text_tokens + style_tokens + 1 > budget and token_counter.count(result) > budget:
+            fitted[text] = trim_to_token_budget(text, result, budget) if trim else result
+    if not fitted:
+        return results, 0
+    crossed = sum(1 for text in prompts if text in fitted)
+    if trim:
+        results = [fitted.get(text, result) for text, result in zip(prompts, results)]
+    return results, crossed
+
+def style_choice_items(names):
+    # 样式列表的选项标签附上正向模板的 token 数，收藏的样式带"⭐"；选项值仍是样式名称
+    _, compiled = style_store.compiled_many(names)
+    prefix = "" if token_counter.exact else "≈"
+    favorites = style_usage.favorite_ids()
+    return [(f"{'⭐ ' if style.style_id in favorites else ''}{name} 🔢{prefix}{style.prompt_tokens}", name)
+            if style is not None else name for name, style in zip(names, compiled)]
+
+def record_style_usage(names):
+    style_ids = [style_store.id_of(name) for name in names]
+    style_usage.record([style_id for style_id in style_ids if style_id])
+
+def apply_styles_to_prompts(style, stacked_styles, positive, negative):
+    names = get_style_stack(style, stacked_styles)
+    record_style_usage(names)
+    return createPositiveMulti(names, positive), createNegativeMulti(names, negative), "✅ 提示词已应用!", "success"
+
+def toggle_favorite_style(style_name):
+    style_id = style_store.id_of(style_name) if style_name else None
+    if style_id is None:
+        return "❌ 请先选择样式!", "error"
+    if style_usage.toggle_favorite(style_id):
+        return "✅ 已收藏，按使用情况排序时显示在最前!", "success"
+    return "✅ 已取消收藏!", "success"
+
+@metrics.timed("describe_style_tokens")
+def describe_style_tokens(style, stacked_styles=None):
+    names = get_style_stack(style, stacked_styles)
+    compiled = compile_style_stack(names) if names else None
+    if compiled is None:
+        return ""
+    prefix = "" if token_counter.exact else "≈"
+    parts = compiled.styles if isinstance(compiled, StyleStack) else [compiled]
+    lines = [f"🔢 {part.name}：正向 {prefix}{part.prompt_tokens} · 反向 {prefix}{part.negative_tokens} token" for part in parts]
+    total = compiled.prompt_tokens
+    if len(parts) > 1:
+        lines.append(f"合计：正向 {prefix}{total} · 反向 {prefix}{compiled.negative_tokens} token（去重前）")
+    if total > CLIP_CHUNK_TOKENS:
+        lines.append(f"⚠️ 样式本身已占用 {token_chunks(total)} 个 {CLIP_CHUNK_TOKENS} token 分段，每张图需要多次 CLIP 编码")
+    return "\n\n".join(lines)
+
+# 影响文本编码结果的 WEBUI 设置，作为条件缓存键的一部分
+CONDITIONING_OPTIONS = ("CLIP_stop_at_last_layers", "emphasis", "use_old_emphasis_implementation",
+                        "comma_padding_backtrack", "sdxl_clip_l_skip")
+
+def conditioning_model_key(model):
+    checkpoint = getattr(model, "sd_checkpoint_info", None)
+    key = (getattr(model, "sd_model_hash", None), getattr(checkpoint, "filename", None))
+    return key if any(key) else ("id", id(model))
+
+def active_text_encoder_networks():
+    # LoRA 等额外网络在编码前已经作用到文本编码器上，同一段文本在不同网络组合下结果不同
+    networks = sys.modules.get("networks")
+    return tuple((getattr(network, "name", None), getattr(network, "te_multiplier", None), getattr(network, "dyn_dim", None))
+                 for network in getattr(networks, "loaded_networks", None) or ())
+
+def conditioning_nbytes(value):
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+    if isinstance(value, dict):
+        return sum(conditioning_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(conditioning_nbytes(item) for item in value)
+    return 0
+
+class ConditioningCache:
+    # 包装 prompt_parser.get_learned_conditioning，缓存套用样式后提示词的文本编码结果。
+    # 整条提示词一起编码，无法只缓存样式的片段，因此按完整文本缓存，并只登记会反复出现的文本：
+    # 套用样式后的反向提示词和样式模板本身（用户输入为空时的结果）；每次都不同的正向提示词不登记，
+    # 以免挤掉可以复用的条目。缓存只在生成时按需填充，模型加载时不预热，因为键中的采样步数和
+    # 图像尺寸要到生成任务开始才知道。键包含模型、已启用的额外网络、相关设置、采样步数和图像尺寸；
+    # 按张量占用的字节数做 LRU 淘汰
+    def __init__(self):
+        self.max_bytes = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._tracked = frozenset()
+        self._original = None
+
+    def track(self, prompts):
+        # 每次 process 调用都会重置；额外网络标签在编码前被移除，这里按移除后的文本记录
+        self._tracked = frozenset(_network_tag_pattern.sub("", text) for text in prompts)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+        metrics.cache("conditioning", entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value):
+        size = conditioning_nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def configure(self, max_bytes):
+        self.max_bytes = max_bytes
+        if max_bytes > 0:
+            self.install()
+        else:
+            self.uninstall()
+            self.clear()
+        with self._lock:
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def install(self):
+        if self._original is not None:
+            return
+        try:
+            from modules import prompt_parser
+        except Exception as e:
+            metrics.error("conditioning", f"无法启用条件缓存: {str(e)}")
+            return
+        self._original = prompt_parser.get_learned_conditioning
+        prompt_parser.get_learned_conditioning = self.get_learned_conditioning
+
+    def uninstall(self, *_):
+        if self._original is None:
+            return
+        from modules import prompt_parser
+        # 其他扩展在我们之后又包装过时不能还原，否则会去掉它们的包装；此时只停止缓存
+        if prompt_parser.get_learned_conditioning == self.get_learned_conditioning:
+            prompt_parser.get_learned_conditioning = self._original
+            self._original = None
+
+    def get_learned_conditioning(self, model, prompts, steps, *args, **kwargs):
+        original = self._original
+        tracked = self._tracked
+        if self.max_bytes <= 0 or not any(text in tracked for text in prompts):
+            return original(model, prompts, steps, *args, **kwargs)
+        context = (conditioning_model_key(model), active_text_encoder_networks(),
+                   tuple(getattr(shared.opts, key, None) for key in CONDITIONING_OPTIONS),
+                   getattr(prompts, "is_negative_prompt", None), getattr(prompts, "width", None),
+                   getattr(prompts, "height", None), steps, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(context)
+        except TypeError:
+            return original(model, prompts, steps, *args, **kwargs)
+
+        results = [None] * len(prompts)
+        missing = []
+        for index, text in enumerate(prompts):
+            cached = self.get((context, text)) if text in tracked else None
+            if cached is None:
+                missing.append(index)
+            else:
+                results[index] = cached
+        if missing:
+            # 只编码未命中的提示词；WEBUI 的 SdConditioning 带有尺寸等属性，需要一并带上
+            subset = [prompts[index] for index in missing]
+            if type(prompts) is not list:
+                subset = type(prompts)(subset, copy_from=prompts)
+            for index, value in zip(missing, original(model, subset, steps, *args, **kwargs)):
+                results[index] = value
+                if prompts[index] in tracked:
+                    self.put((context, prompts[index]), value)
+        return results
+
+conditioning_cache = ConditioningCache()
+
+@metrics.timed("add_style")
+def add_style(style_name, positive_prompt, negative_prompt, category, image=None):
+    # 检查名称前记下版本，检查之后有人添加了同名样式时提交会报冲突而不是覆盖
+    version = style_store.current_version()
+    if style_store.get(style_name) is not None:
+        return False, "❌ 样式名称已存在!"
+    if not style_name.strip():
+        return False, "❌ 样式名称不能为空!"
+
+    new_style = {
+        "id": new_style_id(style_store.styles_by_id),
+        "name": style_name,
+        "prompt": positive_prompt,
+        "negative_prompt": negative_prompt,
+        "category": category
+    }
+    if image:
+        new_style["image"] = store_style_image(image)
+
+    try:
+        style_store.put_style(new_style, version)
+    except StyleConflictError:
+        return False, "❌ 样式名称已被其他人使用!"
+    return True, "✅ 样式添加成功!"
+
+@metrics.timed("modify_style")
+def modify_style(style_name, positive_prompt, negative_prompt, category, image=None, expected_version=None):
+    # expected_version 为调用方读取样式时的库版本，之后样式被其他人修改过时不覆盖
+    version = style_store.current_version() if expected_version is None else expected_version
+    template = style_store.get(style_name)
+    if template is None:
+        return False, "❌ 未找到样式!"
+
+    template = dict(template)
+    template['prompt'] = positive_prompt
+    template['negative_prompt'] = negative_prompt
+    template['category'] = category
+    if image:
+        template["image"] = store_style_image(image)
+
+    try:
+        style_store.put_style(template, version)
+    except StyleConflictError as e:
+        return False, str(e)
+    return True, "✅ 样式更新成功!"
+
+@metrics.timed("delete_style")
+def delete_style(style_name, expected_version=None):
+    version = style_store.current_version() if expected_version is None else expected_version
+    if style_store.get(style_name) is None:
+        return False, "❌ 未找到样式!"
+    pack = style_store.pack_of(style_name)
+    if pack is not None:
+        return False, f"❌ 样式来自样式包 {pack}，请在样式包文件中删除!"
+
+    try:
+        style_store.delete_style(style_name, version)
+    except StyleConflictError as e:
+        return False, str(e)
+    # 删除的是修改过的包样式时，恢复为样式包中的版本
+    if style_store.pack_of(style_name) is not None:
+        return True, "✅ 已恢复为样式包中的版本!"
+    return True, "✅ 样式删除成功!"
+
+@metrics.timed("rename_style")
+def rename_style(style_name, new_name, expected_version=None):
+    # 改名只修改名称，ID、预览图和已记录在生成信息中的引用都保持不变
+    version = style_store.current_version() if expected_version is None else expected_version
+    template = style_store.get(style_name)
+    if template is None:
+        return False, "❌ 未找到样式!"
+    if not new_name.strip():
+        return False, "❌ 样式名称不能为空!"
+    if new_name == style_name:
+        return False, "❌ 新名称与原名称相同!"
+    pack = style_store.pack_of(style_name)
+    if pack is not None:
+        return False, f"❌ 样式来自样式包 {pack}，请在样式包文件中修改!"
+    if style_store.get(new_name) is not None:
+        return False, "❌ 样式名称已存在!"
+
+    try:
+        style_store.rename_style(template['id'], new_name, version)
+    except StyleConflictError as e:
+        return False, str(e)
+    return True, "✅ 样式改名成功!"
+
+def template_token_note(positive_prompt, negative_prompt):
+    # 保存样式时顺便计算模板的 token 数，之后显示和套用直接取缓存
+    compiled = CompiledStyle("", positive_prompt, negative_prompt)
+    prefix = "" if token_counter.exact else "≈"
+    return f"（正向 {prefix}{compiled.prompt_tokens} · 反向 {prefix}{compiled.negative_tokens} token）"
+
+def add_style_with_feedback(style_name, positive_prompt, negative_prompt, image, category):
+    ok, message = add_style(style_name, positive_prompt, negative_prompt, category, image)
+    if ok:
+        message += template_token_note(positive_prompt, negative_prompt)
+    return gr.update(choices=style_choices(category)), message, "success" if ok else "error"
+
+# edit_version 是界面上"提取样式提示"时的库版本；修改成功后更新为新版本，冲突时保持不变
+def modify_style_with_feedback(style_name, positive_prompt, negative_prompt, image, category, edit_version=None):
+    ok, message = modify_style(style_name, positive_prompt, negative_prompt, category, image, edit_version)
+    if ok:
+        message += template_token_note(positive_prompt, negative_prompt)
+    edit_version = style_store.version if ok else edit_version
+    return gr.update(choices=style_choices(category)), message, "success" if ok else "error", edit_version
+
+def delete_style_with_feedback(style_name, category, edit_version=None):
+    ok, message = delete_style(style_name, edit_version)
+    return gr.update(choices=style_choices(category)), message, "success" if ok else "error"
+
+def rename_style_with_feedback(style_name, new_name, category, edit_version=None):
+    ok, message = rename_style(style_name, new_name, edit_version)
+    value = new_name if ok else style_name
+    edit_version = style_store.version if ok else edit_version
+    return gr.update(choices=style_choices(category), value=value), message, "success" if ok else "error", edit_version
+
+def resolve_style_names(style_ids):
+    # 生成信息中记录的是样式 ID，改名后仍能找到对应样式的当前名称
+    names = []
+    for style_id in style_ids:
+        template = style_store.get_by_id(style_id)
+        if template is not None:
+            names.append(template['name'])
+    return names
+
+def on_style_infotext_pasted(infotext, params):
+    ids = [style_id for style_id in str(params.get("样式选择器样式ID", "")).split(",") if style_id]
+    names = resolve_style_names(ids)
+    if names:
+        params["样式选择器样式"] = names[0]
+        if len(names) > 1:
+            params["样式选择器叠加样式"] = json.dumps(names, ensure_ascii=False)
+
+def parse_stacked_styles_infotext(params):
+    # 叠加样式在生成信息中是 JSON 数组，WEBUI 默认按组件当前值的类型转换会把字符串拆成单个字符。
+    # 只有单个样式时清空叠加列表，否则残留的叠加样式会覆盖粘贴的样式；没有本插件的参数时不修改
+    value = params.get("样式选择器叠加样式")
+    if value is None:
+        return gr.update(choices=[], value=[]) if "样式选择器样式" in params else None
+    try:
+        names = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        return None
+    if not isinstance(names, list):
+        return None
+    names = [name for name in dict.fromkeys(str(name) for name in names) if style_store.get(name) is not None]
+    names = names[:MAX_STACKED_STYLES]
+    return gr.update(choices=names, value=names)
+
+# 预览图缩略图：按源文件内容哈希和目标尺寸缓存，源文件变化时重新生成
+THUMBNAIL_SIZE = 360  # 预览框高 180px，按 2 倍像素生成以适配高分屏
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def _source_hash(self, image_path):
+        # 源文件签名不变时复用上次计算的哈希，避免每次都读取整张原图
+        signature = get_file_signature(image_path)
+        cached = self._sources.get(image_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+        digest = hashlib.sha1()
+        with open(image_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        source_hash = digest.hexdigest()
+        previous = cached[2] if cached is not None else None
+        self._sources[image_path] = (signature, source_hash, None)
+        return source_hash, previous
+
+    def _render(self, image_path, thumbnail_base):
+        with Image.open(image_path) as image:
+            image.thumbnail((self.size, self.size), Image.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            try:
+                thumbnail_path = thumbnail_base + ".webp"
+                write_file_atomic_bytes(thumbnail_path, lambda file: image.save(file, format="WEBP", quality=85, method=4))
+            except (OSError, KeyError, ValueError):
+                # Pillow 未编译 WebP 支持时退回 JPEG
+                thumbnail_path = thumbnail_base + ".jpg"
+                write_file_atomic_bytes(thumbnail_path, lambda file: image.convert("RGB").save(file, format="JPEG", quality=85))
+        return thumbnail_path
+
+    @metrics.timed("ThumbnailCache.get")
+    def get(self, image_path):
+        if not image_path or not os.path.isfile(image_path):
+            return None
+        try:
+            with self._lock:
+                source_hash, previous = self._source_hash(image_path)
+                thumbnail_base = os.path.join(self.cache_dir, f"{source_hash}_{self.size}")
+                for extension in (".webp", ".jpg"):
+                    if os.path.exists(thumbnail_base + extension):
+                        thumbnail_path = thumbnail_base + extension
+                        metrics.cache("thumbnail", True)
+                        break
+                else:
+                    metrics.cache("thumbnail", False)
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    thumbnail_path = self._render(image_path, thumbnail_base)
+                # 内容相同的源文件共用一个缩略图，只在没有其他源文件仍在使用时删除旧缩略图
+                if previous and previous != thumbnail_path and not any(
+                        entry[2] == previous for entry in self._sources.values()):
+                    remove_file(previous)
+                signature = self._sources[image_path][0]
+                self._sources[image_path] = (signature, source_hash, thumbnail_path)
+                return thumbnail_path
+        except Exception as e:
+            metrics.error("thumbnail", f"生成缩略图错误: {str(e)}")
+            return image_path
 
-/* 小按钮样式 */
-.small-button {
-    font-size: 14px !important;
-    padding: 6px 12px !important;
-    border-radius: 4px !important;
-    background: var(--button-secondary-background-fill) !important;
-    border: 1px solid var(--button-secondary-border-color) !important;
-}
+thumbnail_cache = ThumbnailCache(thumbnail_folder)
 
-.small-button:hover {
-    background: var(--button-secondary-background-fill-hover) !important;
-}
+@metrics.timed("get_style_image")
+def get_style_image(style, show_original=False):
+    template = style_store.get(style)
+    if template is None or not template.get('image'):
+        return None
+    image_path = resolve_image_path(template['image'])
+    if show_original:
+        return image_path
+    return thumbnail_cache.get(image_path)
 
-/* 刷新按钮样式 */
-.refresh-button {
-    font-size: 16px !important;
-    padding: 8px !important;
-    border-radius: 4px !important;
-    background: var(--button-secondary-background-fill) !important;
-    position: absolute !important;
-    top: 10px !important;
-    right: 10px !important;
-    width: 40px !important;
-    height: 40px !important;
-    display: flex !important;
-    align-items: center !important;
-    justify-content: center !important;
-}
+def file_image_hash(path):
+    with Image.open(path) as image:
+        image.load()
+        return image_content_hash(image)
 
-/* 反馈消息样式 */
-.feedback-message {
-    font-size: 14px !important;
-    padding: 8px !important;
-    border-radius: 4px !important;
-    margin-top: 5px !important;
-}
+@metrics.timed("migrate_image_folder")
+def migrate_image_folder():
+    # 一次性迁移：按内容去重 MGTV 文件夹，并把样式中的 image 字段改写为相对引用
+    style_writer.flush()
+    groups = {}
+    for entry in sorted(os.listdir(image_folder)) if os.path.isdir(image_folder) else []:
+        path = os.path.normpath(os.path.join(image_folder, entry))
+        if not os.path.isfile(path) or os.path.splitext(entry)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        try:
+            groups.setdefault(file_image_hash(path), []).append(path)
+        except Exception as e:
+            metrics.error("image", f"无法读取图片 {entry}: {str(e)}")
 
-.feedback-message.success {
-    background: var(--background-flash-success) !important;
-    color: var(--text-color) !important;
-}
+    users = {}
+    for style in style_store.all_styles():
+        if style.get('image'):
+            users.setdefault(resolve_image_path(style['image']), []).append(style)
 
-.feedback-message.error {
-    background: var(--background-flash-error) !important;
-    color: var(--text-color) !important;
-}
+    ops = []
+    copies = []
+    obsolete = []
+    for content_hash, paths in groups.items():
+        referencing = [style for path in paths for style in users.get(path, [])]
+        if not referencing:
+            # 没有样式引用的重复文件只保留一份
+            obsolete.extend(paths[1:])
+            continue
+        extension = os.path.splitext(paths[0])[1].lower()
+        file_name = f"{content_hash}{extension}"
+        target = os.path.join(image_folder, file_name)
+        if not os.path.exists(target):
+            copies.append((paths[0], target))
+        obsolete.extend(path for path in paths if path != os.path.normpath(target))
+        for style in referencing:
+            if style.get('image') != image_ref(file_name):
+                ops.append({"op": "put", "style": dict(style, image=image_ref(file_name))})
 
-/* 主布局样式 */
-#style_selector_main {
-    background: var(--block-background-fill) !important;
-    padding: 15px !important;
-    border-radius: 8px !important;
-    border: 1px solid var(--block-border-color) !important;
-    margin-bottom: 15px !important;
-    position: relative !important;
-}
+    # 先复制出内容寻址文件并提交样式修改，确认落盘后再删除旧文件
+    for source, target in copies:
+        copy_file_atomic(source, target)
+    if ops:
+        style_store.commit(ops)
+    style_writer.flush()
+    for path in obsolete:
+        remove_file(path)
+    return len(ops), len(obsolete)
 
-/* 折叠面板标题样式 */
-.accordion > h3 {
-    font-size: 16px !important;
-    color: var(--block-label-text-color) !important;
-    background: var(--block-background-fill) !important;
-    padding: 10px !important;
-    border-radius: 6px !important;
-    border: 1px solid var(--block-border-color) !important;
-    margin-bottom: 10px !important;
-}
+def migrate_images_with_feedback():
+    try:
+        updated, removed = migrate_image_folder()
+    except Exception as e:
+        return f"❌ 整理预览图失败: {str(e)}", "error"
+    return f"✅ 已更新 {updated} 个样式引用，删除 {removed} 个重复或旧文件", "success"
 
-/* 输入框样式 */
-#style_selector_main textarea, 
-#style_selector_main input[type="text"] {
-    background: var(--input-background-fill) !important;
-    color: var(--input-text-color) !important;
-    border-color: var(--input-border-color) !important;
-}
+# 批量导入导出：JSON 数组（sdxl_styles.json 格式）、JSON Lines（每行一个样式）和 CSV。
+# WebUI 自带的 styles.csv 为 name,prompt,negative_prompt 三列，也可另带 category 列。
+# 输入按块流式解析，导出逐条写出，都不会在内存中保留整份文本
+IMPORT_CHUNK_SIZE = 1 << 16
+# 单条样式解析时最多缓冲的文本长度；超过时按格式错误处理，不把损坏文件的剩余部分全部读入内存
+IMPORT_MAX_ITEM_SIZE = 1 << 20
+EXPORT_FORMATS = {"JSON": "json", "CSV": "csv"}
+# 导出的压缩包统一放在这里，每次导出时清理超过 EXPORT_KEEP_SECONDS 的旧文件；
+# 返回后 Gradio 会立即复制到自己的缓存，保留一段时间只是为了不删掉同时进行的导出
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "style-selector-exports")
+EXPORT_KEEP_SECONDS = 600
+CSV_FIELDS = ["name", "prompt", "negative_prompt", "category"]
+_json_whitespace = re.compile(r"\s*")
+_json_separator = re.compile(r"[\s,]*")
 
-/* 下拉菜单样式 */
-#style_selector_main .gr-dropdown {
-    background: var(--input-background-fill) !important;
-    color: var(--input-text-color) !important;
-    border-color: var(--input-border-color) !important;
-}
+def iter_json_array(file):
+    # 逐个解析顶层数组中的元素，缓冲区只保留尚未解析的一小段文本
+    decoder = json.JSONDecoder()
+    buffer, pos, eof, started = "", 0, False, False
+    while True:
+        pos = (_json_separator if started else _json_whitespace).match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                if started:
+                    raise ValueError("JSON 数组不完整")
+                return
+            chunk = file.read(IMPORT_CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        if not started:
+            if buffer[pos] != "[":
+                raise ValueError("JSON 样式文件应为数组")
+            pos += 1
+            started = True
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except ValueError as error:
+            if eof:
+                raise
+            if len(buffer) - pos > IMPORT_MAX_ITEM_SIZE:
+                raise ValueError(f"JSON 格式错误或单条样式过大: {str(error)}")
+            # 元素跨越了缓冲区末尾，读入更多内容后重试
+            chunk = file.read(IMPORT_CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        yield item
 
-/* 表情选择菜单样式 */
-.emoji-dropdown {
-    min-width: 150px !important;
-    max-height: 200px !important;
-    overflow-y: auto !important;
-}
+def iter_json_lines(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
 
-.emoji-button {
-    font-size: 16px !important;
-    padding: 4px 8px !important;
-    min-width: 30px !important;
-    margin: 2px !important;
-}
+def iter_csv_rows(file):
+    reader = csv.DictReader(file)
+    reader.fieldnames = [(field or "").strip().lower() for field in reader.fieldnames or []]
+    if "name" not in reader.fieldnames:
+        raise ValueError("CSV 文件缺少 name 列")
+    for row in reader:
+        # WebUI 旧版本的 styles.csv 使用 text 列保存正向提示词
+        if "prompt" not in row and "text" in row:
+            row["prompt"] = row["text"]
+        yield row
 
-.emoji-button:hover {
-    background: var(--button-secondary-background-fill-hover) !important;
-}
-"""
+def normalize_imported_style(item, default_category=""):
+    # 校验一条导入记录，无效时返回 None
+    if not isinstance(item, dict):
+        return None
+    name = item.get('name')
+    if not isinstance(name, str) or not name.strip():
+        return None
+    style = {"name": name.strip()}
+    for field in ("prompt", "negative_prompt"):
+        value = item.get(field) or ""
+        if not isinstance(value, str):
+            return None
+        style[field] = value
+    category = item.get('category') or default_category
+    if not isinstance(category, str):
+        return None
+    style['category'] = category
+    if isinstance(item.get('image'), str) and item['image']:
+        style['image'] = item['image']
+    return style
 
-# 表情符号列表
-EMOJI_LIST = [
-    "🧡", "💛", "💚", "💙", "💜", "🤎", "😀", "😁", "😊", "😇", 
-    "🥰", "😍", "🤩", "😘", "😗", "☺️", "😚", "😙", "😋", "😛", 
-    "😜", "🤪", "😝", "🤑", "🤗", "☕", "🍸", "🍹", "🍺", "🥂", 
-    "🥤", "🧃", "🧉", "🧊", "👓", "🕶️", "🎸", "🎹", "📟", "🔋", 
-    "🖥️", "💿", "📀", "🎞️", "📽️", "🎬", "📺", "📸", "🌟", "🌀", 
-    "🌈", "🌂", "☂️", "☔", "⛱️", "⚡", "❄️", "⛄", "🔥", "💧", "🌊"
-]
+def iter_import_styles(file_path, default_category="", progress=None):
+    # 按扩展名选择解析方式；progress(已读取字节比例) 随读取进度调用
+    extension = os.path.splitext(file_path)[1].lower()
+    total = max(os.path.getsize(file_path), 1)
+    with open(file_path, 'rt', encoding="utf-8-sig", newline="") as file:
+        if extension == ".csv":
+            items = iter_csv_rows(file)
+        elif extension == ".jsonl":
+            items = iter_json_lines(file)
+        else:
+            items = iter_json_array(file)
+        for count, item in enumerate(items, 1):
+            if progress is not None and count % 1000 == 0:
+                progress(min(file.buffer.tell() / total, 1.0))
+            yield normalize_imported_style(item, default_category)
 
-# 工具函数
-@lru_cache(maxsize=2)
-def get_json_content(file_path, _mtime=0):
+def import_styles_with_feedback(file, on_duplicate, category, progress=gr.Progress()):
+    if file is None:
+        return gr.update(), "❌ 请先选择要导入的文件!", "error"
+    file_path = getattr(file, "name", file)
+    progress(0, desc="正在读取样式文件")
     try:
-        mtime = os.path.getmtime(file_path)
-        if _mtime != mtime:
-            get_json_content.cache_clear()
-        with open(file_path, 'rt', encoding="utf-8") as file:
-            return json.load(file)
+        styles = iter_import_styles(file_path, category or "", lambda fraction: progress(fraction, desc="正在读取样式文件"))
+        imported, skipped, invalid = style_store.import_styles(styles, overwrite=on_duplicate == "覆盖")
+    except StyleConflictError:
+        return gr.update(), "❌ 导入期间样式库被其他人修改，请重新导入!", "error"
     except Exception as e:
-        print(f"读取JSON文件错误: {str(e)}")
-        return {}
+        return gr.update(), f"❌ 导入失败: {str(e)}", "error"
+    message = f"✅ 已导入 {imported} 个样式，跳过 {skipped} 个同名样式"
+    if invalid:
+        message += f"，忽略 {invalid} 条无效记录"
+    return gr.update(choices=style_choices(category)), message, "success"
 
-def save_json_content(file_path, data):
-    with open(file_path, 'w', encoding="utf-8") as file:
-        json.dump(data, file, ensure_ascii=False, indent=2)
-    get_json_content.cache_clear()
-
-def read_sdxl_styles(json_data, category):
-    if not isinstance(json_data, list):
-        return []
-    names = [item['name'] for item in json_data if isinstance(item, dict) and 'name' in item and item.get('category') == category]
-    names.sort()
-    return names
+def iter_styles_json(styles):
+    # 逐条序列化，攒满一块再输出
+    chunk = ["["]
+    size = 0
+    for index, style in enumerate(styles):
+        text = (",\n  " if index else "\n  ") + json.dumps(style, ensure_ascii=False, default=json_default)
+        chunk.append(text)
+        size += len(text)
+        if size >= IMPORT_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    chunk.append("\n]\n")
+    yield "".join(chunk)
 
-def get_categories():
-    categories_data = get_json_content(categoriespath)
-    return [cat for cat in categories_data.keys() if cat != "全部"]
+def iter_styles_csv(styles):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for style in styles:
+        writer.writerow({field: style.get(field, "") for field in CSV_FIELDS})
+        if buffer.tell() >= IMPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
 
-def getStyles(category):
-    global stylespath
-    json_path = os.path.join(scripts.basedir(), 'sdxl_styles.json')
-    stylespath = json_path
-    json_data = get_json_content(json_path)
-    return read_sdxl_styles(json_data, category)
+def export_file_name(category, extension):
+    name = re.sub(r'[\\/:*?"<>|]+', "_", category or "").strip() or "未分类"
+    return f"{name}.{extension}"
 
-def createPositive(style, positive):
-    json_data = get_json_content(stylespath)
-    for template in json_data:
-        if isinstance(template, dict) and template.get('name') == style:
-            base_prompt = template.get('prompt', '')
-            if positive and base_prompt:
-                return f"{positive}, {base_prompt}"
-            return base_prompt or positive
-    return positive
+def remove_old_exports():
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    deadline = time.time() - EXPORT_KEEP_SECONDS
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.stat().st_mtime < deadline:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
 
-def createNegative(style, negative):
-    json_data = get_json_content(stylespath)
-    for template in json_data:
-        if isinstance(template, dict) and template.get('name') == style:
-            json_negative = template.get('negative_prompt', '')
-            return f"{json_negative}, {negative}" if json_negative and negative else json_negative or negative
-    return negative
+@metrics.timed("export_styles_archive")
+def export_styles_archive(fmt="json", category=None):
+    # 每个分类写成一个文件并打包为 zip，逐条写入压缩包
+    extension = EXPORT_FORMATS.get(fmt, fmt)
+    serialize = iter_styles_csv if extension == "csv" else iter_styles_json
+    remove_old_exports()
+    path = os.path.join(tempfile.mkdtemp(prefix="style-export-", dir=EXPORT_DIR), f"styles-{extension}.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, styles in style_store.export_snapshot(category):
+            if not styles:
+                continue
+            with archive.open(export_file_name(name, extension), "w") as entry:
+                with io.TextIOWrapper(entry, encoding="utf-8", newline="") as file:
+                    for chunk in serialize(styles):
+                        file.write(chunk)
+    return path
 
-def add_style_with_feedback(style_name, positive_prompt, negative_prompt, image, category):
-    json_data = get_json_content(stylespath)
-    existing_names = [item['name'] for item in json_data if isinstance(item, dict) and 'name' in item]
-    if style_name in existing_names:
-        return gr.update(choices=getStyles(category)), "❌ 样式名称已存在!", "error"
-    if not style_name.strip():
-        return gr.update(choices=getStyles(category)), "❌ 样式名称不能为空!", "error"
+def export_styles_with_feedback(fmt):
+    try:
+        path = export_styles_archive(fmt)
+    except Exception as e:
+        return None, f"❌ 导出失败: {str(e)}", "error"
+    return path, "✅ 样式已按分类导出!", "success"
 
-    new_style = {
-        "name": style_name,
-        "prompt": positive_prompt,
-        "negative_prompt": negative_prompt,
-        "category": category
-    }
-    if image:
-        image_path = os.path.join(image_folder, f"{style_name}.png")
-        image.save(image_path)
-        new_style["image"] = image_path
-
-    json_data.append(new_style)
-    save_json_content(stylespath, json_data)
-
-    categories_data = get_json_content(categoriespath)
-    if category not in categories_data:
-        categories_data[category] = []
-    if style_name not in categories_data[category]:
-        categories_data[category].append(style_name)
-    save_json_content(categoriespath, categories_data)
-
-    time.sleep(0.3)
-    return gr.update(choices=getStyles(category)), "✅ 样式添加成功!", "success"
-
-def modify_style_with_feedback(style_name, positive_prompt, negative_prompt, image, category):
-    json_data = get_json_content(stylespath)
-    modified = False
-
-    for template in json_data:
-        if template['name'] == style_name:
-            old_category = template.get('category', '')
-            template['prompt'] = positive_prompt
-            template['negative_prompt'] = negative_prompt
-            template['category'] = category
-            if image:
-                image_path = os.path.join(image_folder, f"{style_name}.png")
-                image.save(image_path)
-                template["image"] = image_path
-            modified = True
-
-            categories_data = get_json_content(categoriespath)
-            if old_category in categories_data and style_name in categories_data[old_category]:
-                categories_data[old_category].remove(style_name)
-            if category not in categories_data:
-                categories_data[category] = []
-            if style_name not in categories_data[category]:
-                categories_data[category].append(style_name)
-            save_json_content(categoriespath, categories_data)
-            break
-
-    if modified:
-        save_json_content(stylespath, json_data)
-        time.sleep(0.3)
-        return gr.update(choices=getStyles(category)), "✅ 样式更新成功!", "success"
-    return gr.update(choices=getStyles(category)), "❌ 未找到样式!", "error"
-
-def delete_style_with_feedback(style_name, category):
-    json_data = get_json_content(stylespath)
-    new_json_data = [t for t in json_data if t['name'] != style_name]
-
-    if len(new_json_data) < len(json_data):
-        image_path = os.path.join(image_folder, f"{style_name}.png")
-        if os.path.exists(image_path):
-            os.remove(image_path)
-
-        save_json_content(stylespath, new_json_data)
-
-        categories_data = get_json_content(categoriespath)
-        if category in categories_data and style_name in categories_data[category]:
-            categories_data[category].remove(style_name)
-        save_json_content(categoriespath, categories_data)
-
-        time.sleep(0.3)
-        return gr.update(choices=getStyles(category)), "✅ 样式删除成功!", "success"
-    return gr.update(choices=getStyles(category)), "❌ 未找到样式!", "error"
-
-def get_style_image(style):
-    json_data = get_json_content(stylespath)
-    for template in json_data:
-        if template['name'] == style and 'image' in template:
-            return template['image']
-    return None
+@metrics.timed("get_style_details_for_edit")
+def get_style_details_for_edit(style):
+    # 同时记下读取时的库版本，之后修改、删除或改名时据此检测并发修改
+    version = style_store.current_version()
+    return (*get_style_details(style), version)
 
+@metrics.timed("get_style_details")
 def get_style_details(style):
-    json_data = get_json_content(stylespath)
-    for template in json_data:
-        if template['name'] == style:
-            return template.get('name', ''), template.get('prompt', ''), template.get('negative_prompt', ''), template.get('category', '')
+    template = style_store.get(style)
+    if template is not None:
+        return template.get('name', ''), template.get('prompt', ''), template.get('negative_prompt', ''), template.get('category', '')
     return "", "", "", ""
 
-def add_category(category_name, emoji):
+# expected_version 为界面上显示分类列表时的库版本，与样式的修改一样，之后分类被其他人改过时不覆盖
+@metrics.timed("add_category")
+def add_category(category_name, emoji, expected_version=None):
     if not category_name.strip():
         return False, "❌ 分类名称不能为空!", "error"
-    categories_data = get_json_content(categoriespath)
     final_name = f"{emoji} {category_name}" if emoji else category_name
-    if final_name not in categories_data:
-        categories_data[final_name] = []
-        save_json_content(categoriespath, categories_data)
+    if final_name not in style_store.category_names():
+        try:
+            style_store.add_category(final_name, expected_version)
+        except StyleConflictError as e:
+            return False, str(e), "error"
         return True, "✅ 分类添加成功!", "success"
     return False, "❌ 分类已存在!", "error"
 
-def rename_category(old_name, new_name):
+@metrics.timed("rename_category")
+def rename_category(old_name, new_name, expected_version=None):
     if not new_name.strip():
         return False, "❌ 新分类名称不能为空!", "error"
     if old_name == new_name:
         return False, "❌ 新分类名称与原名称相同!", "error"
     
-    categories_data = get_json_content(categoriespath)
-    if old_name not in categories_data:
+    categories = style_store.category_names()
+    if old_name not in categories:
         return False, "❌ 原分类不存在!", "error"
-    if new_name in categories_data:
+    if new_name in categories:
         return False, "❌ 新分类名称已存在!", "error"
+    if style_store.is_pack_category(old_name):
+        return False, "❌ 该分类来自样式包，请在样式包文件中修改!", "error"
     
-    # 更新分类数据
-    categories_data[new_name] = categories_data.pop(old_name)
-    save_json_content(categoriespath, categories_data)
-    
-    # 更新样式数据中的分类名称
-    json_data = get_json_content(stylespath)
-    for style in json_data:
-        if style.get('category') == old_name:
-            style['category'] = new_name
-    save_json_content(stylespath, json_data)
+    # 分类和样式中的分类名称在同一条日志记录中更新
+    try:
+        style_store.rename_category(old_name, new_name, expected_version)
+    except StyleConflictError as e:
+        return False, str(e), "error"
     
     return True, "✅ 分类重命名成功!", "success"
 
-def delete_category(category_name):
-    categories_data = get_json_content(categoriespath)
-    if category_name in categories_data:
-        del categories_data[category_name]
-        save_json_content(categoriespath, categories_data)
-
-        json_data = get_json_content(stylespath)
-        for style in json_data:
-            if style.get('category') == category_name:
-                style['category'] = ""
-        save_json_content(stylespath, json_data)
-
+@metrics.timed("delete_category")
+def delete_category(category_name, expected_version=None):
+    if style_store.is_pack_category(category_name):
+        return False, "❌ 该分类来自样式包，请在样式包文件中删除!", "error"
+    if category_name in style_store.category_names():
+        try:
+            style_store.delete_category(category_name, expected_version)
+        except StyleConflictError as e:
+            return False, str(e), "error"
         return True, "✅ 分类删除成功!", "success"
     return False, "❌ 未找到分类!", "error"
 
+def check_categories_with_feedback():
+    issues = style_store.check_categories()
+    if not issues:
+        return "✅ 分类数据一致!", "success"
+    shown = "\n".join(issues[:20])
+    more = f"\n... 另有 {len(issues) - 20} 条" if len(issues) > 20 else ""
+    return f"❌ 发现 {len(issues)} 处不一致:\n{shown}{more}", "error"
+
+def repair_categories_with_feedback(expected_version=None):
+    try:
+        style_store.repair_categories(expected_version)
+    except StyleConflictError as e:
+        return str(e), "error"
+    except StyleLibraryError as e:
+        return f"❌ {str(e)}", "error"
+    return "✅ 已按样式记录重建分类!", "success"
+
+def refresh_category_choices(category):
+    # 样式库首次加载完成或发生变化时刷新分类；原分类已不存在时选中第一个分类。
+    # 同时返回此时的库版本，分类操作以它为准检测并发修改
+    version = style_store.current_version()
+    categories = get_categories()
+    if category not in categories:
+        category = categories[0] if categories else None
+    return gr.update(choices=categories, value=category), gr.update(choices=categories), version
+
+def reload_style_library(category):
+    # 🔄 按钮：在后台写入线程重新检查文件，关闭了自动重新加载时也能生效；
+    # 请求线程只返回当前已加载的内容，重新加载后由 library_version 的轮询刷新界面
+    style_writer.submit(style_store.refresh, True)
+    return refresh_category_choices(category)
+
+def category_choices():
+    version = style_store.current_version()
+    categories = get_categories()
+    return gr.update(choices=categories), gr.update(choices=categories), version
+
+# 启动耗时：导入脚本、构建界面和后台加载样式库分别计时，WebUI 启动完成后输出
+startup_timings = {"import": 0.0, "ui": 0.0}
+
+def report_startup_time(_, app):
+    load = f"{style_store.load_seconds:.3f}s" if style_store.ready.is_set() else "进行中"
+    print(f"样式选择器启动耗时: 导入 {startup_timings['import']:.3f}s, 构建界面 {startup_timings['ui']:.3f}s, 后台加载样式库 {load}")
+
+def apply_metrics_setting(*_):
+    metrics.enabled = bool(getattr(shared.opts, "style_selector_metrics", False))
+
+def apply_conditioning_cache_setting(*_):
+    megabytes = getattr(shared.opts, "style_selector_conditioning_cache_mb", 0) or 0
+    conditioning_cache.configure(int(megabytes) * 1024 * 1024)
+
+def library_gauges():
+    # 诊断面板和 /metrics 接口共用的样式库状态
+    return [
+        ("library_styles", "样式库中的样式数", len(style_store.styles_by_id)),
+        ("library_version", "样式库版本", style_store.version),
+        ("library_load_seconds", "后台加载样式库耗时", style_store.load_seconds or 0),
+        ("metrics_enabled", "是否开启性能统计", int(metrics.enabled)),
+        ("conditioning_cache_entries", "条件缓存条目数", len(conditioning_cache)),
+        ("conditioning_cache_bytes", "条件缓存占用字节数", conditioning_cache.bytes),
+    ]
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GB"
+
+def render_diagnostics():
+    counters, histograms, errors = metrics.snapshot()
+    state = "已开启" if metrics.enabled else "已关闭（在 设置 → 样式选择器 中开启）"
+    load = f"{style_store.load_seconds:.3f}s" if style_store.load_seconds is not None else "进行中"
+    lines = [f"**性能统计：{state}**　样式数 {len(style_store.styles_by_id)}，库版本 {style_store.version}，加载耗时 {load}", ""]
+    if conditioning_cache.max_bytes > 0:
+        lines[-1:] = [f"文本编码缓存：{len(conditioning_cache)} 条，{format_bytes(conditioning_cache.bytes)} / "
+                      f"{format_bytes(conditioning_cache.max_bytes)}", ""]
+    if histograms:
+        lines += ["| 函数 | 调用次数 | 平均 (ms) | p95 (ms) | 合计 (s) |", "|---|---:|---:|---:|---:|"]
+        for (_, labels), (buckets, total, count) in sorted(histograms.items(), key=lambda item: -item[1][1]):
+            p95 = metrics.quantile(buckets, count, 0.95)
+            p95 = f"≤{p95 * 1000:g}" if p95 is not None else f">{metrics.LATENCY_BUCKETS[-1] * 1000:g}"
+            lines.append(f"| {dict(labels)['function']} | {count} | {total / count * 1000:.2f} | {p95} | {total:.3f} |")
+        lines.append("")
+    caches = {}
+    for (name, labels), value in counters.items():
+        if name == "cache_requests_total":
+            labels = dict(labels)
+            caches.setdefault(labels["cache"], {"hit": 0, "miss": 0})[labels["result"]] = value
+    if caches:
+        lines += ["| 缓存 | 命中 | 未命中 | 命中率 |", "|---|---:|---:|---:|"]
+        for cache, counts in sorted(caches.items()):
+            total = counts["hit"] + counts["miss"]
+            lines.append(f"| {cache} | {counts['hit']} | {counts['miss']} | {counts['hit'] / total:.0%} |")
+        lines.append("")
+    others = {"reloads_total": "重新加载", "bytes_read_total": "读取", "bytes_written_total": "写入", "errors_total": "错误"}
+    rows = []
+    for (name, labels), value in sorted(counters.items()):
+        if name in others:
+            detail = ", ".join(str(value) for _, value in labels)
+            rows.append(f"| {others[name]} | {detail} | {format_bytes(value) if name.startswith('bytes') else value} |")
+    if rows:
+        lines += ["| 计数 | 类别 | 值 |", "|---|---|---:|", *rows, ""]
+    if errors:
+        lines += ["最近的错误：", ""] + [f"- {at} [{source}] {message}" for at, source, message in reversed(errors)]
+    return "\n".join(lines)
+
+def reset_diagnostics():
+    metrics.reset()
+    return render_diagnostics()
+
 class StyleSelectorXL(scripts.Script):
     def __init__(self):
         super().__init__()
-        self.styleNames = []
         self.boxx = None
         self.boxxIMG = None
         self.neg_prompt_boxTXT = None
         self.neg_prompt_boxIMG = None
-        self.current_category = ""
 
     def title(self):
         return "🎨 样式选择器"
@@ -382,11 +3653,15 @@ class StyleSelectorXL(scripts.Script):
         return scripts.AlwaysVisible
 
     def ui(self, is_img2img):
+        ui_started = time.perf_counter()
         gr.HTML(f"<style>{custom_css}</style>")
 
-        categories = get_categories()
-        self.current_category = categories[0] if categories else ""
-        self.styleNames = getStyles(self.current_category)
+        # 界面先以空列表构建，样式库在后台加载完成后通过 library_version 填充到两个标签页
+        # 两个标签页不保存各自的列表状态，都从同一个 style_store 读取
+        categories = []
+        current_category = ""
+        style_names = []
+        style_store.warm_up()
         enabled = False  # 默认禁用
 
         with gr.Group(elem_id="style_selector_main"):
@@ -403,31 +3678,75 @@ class StyleSelectorXL(scripts.Script):
                     elem_classes=["refresh-button"],
                     title="刷新"
                 )
+                # 每个打开的页面定期读取样式库版本，版本变化时刷新分类和样式列表。
+                # 初始值固定为 -1 而不是构建界面时的版本：后台加载在界面构建前就完成时，
+                # 页面打开后的第一次读取仍会触发 change，把分类和样式填充进来
+                library_version = gr.Number(
+                    value=-1,
+                    precision=0,
+                    visible=False
+                )
+                library_version.attach_load_event(lambda: style_store.version, STYLE_VERSION_POLL_INTERVAL)
 
                 with gr.Row(variant="panel"):
                     category_radio = gr.Radio(
                         choices=categories,
-                        value=self.current_category,
+                        value=current_category,
                         label="分类",
                         interactive=True,
                         elem_id="style_category_radio",
                         elem_classes=["style-category-buttons"]
                     )
 
+                with gr.Row(variant="compact"):
+                    search_box = gr.Textbox(label="搜索样式", placeholder="输入名称、提示词或分类")
+                    search_mode = gr.Radio(choices=SEARCH_MODES, value=SEARCH_MODES[0], label="匹配方式")
+                    search_in_category = gr.Checkbox(value=True, label="仅当前分类")
+                    style_sort = gr.Radio(choices=STYLE_SORTS, value=STYLE_SORTS[0], label="排序")
+
+                with gr.Row(variant="compact"):
+                    prev_page_btn = gr.Button("◀", variant="secondary", elem_classes=["small-button"])
+                    page_number = gr.Number(value=1, precision=0, label="页码")
+                    next_page_btn = gr.Button("▶", variant="secondary", elem_classes=["small-button"])
+                    page_info = gr.Markdown("")
+                    show_gallery = gr.Checkbox(value=False, label="图库视图")
+
+                with gr.Row(variant="compact"):
+                    token_query = gr.Textbox(label="按提示词查找", placeholder="逗号分隔，例如: cinematic lighting, <lora:film>")
+                    token_mode = gr.Radio(choices=["全部包含", "任一包含"], value="全部包含", label="条件")
+                    token_search_btn = gr.Button("🔎 查找", variant="secondary", elem_classes=["small-button"])
+
+                style_gallery = gr.Gallery(label="样式图库", columns=5, height=240, visible=False)
+                gallery_names = gr.State([])
+
                 with gr.Group():
                     style = gr.Radio(
                         label='选择样式',
-                        choices=self.styleNames,
-                        value=self.styleNames[0] if self.styleNames else None,
+                        choices=style_names,
+                        value=style_names[0] if style_names else None,
                         interactive=True
                     )
 
+                    with gr.Row(variant="compact"):
+                        stacked_styles = gr.Dropdown(
+                            choices=[],
+                            value=[],
+                            multiselect=True,
+                            label=f"叠加样式（按顺序应用，最多{MAX_STACKED_STYLES}个）",
+                            interactive=True
+                        )
+                        stack_add_btn = gr.Button("➕ 叠加", variant="secondary", elem_classes=["small-button"])
+                        stack_clear_btn = gr.Button("清空叠加", variant="secondary", elem_classes=["small-button"])
+                        favorite_btn = gr.Button("⭐ 收藏", variant="secondary", elem_classes=["small-button"])
+
+                    style_token_info = gr.Markdown("")
                     style_image_display = gr.Image(
                         type="filepath",
                         label="样式预览",
                         height=180,
                         interactive=False
                     )
+                    show_original_image = gr.Checkbox(value=False, label="显示原图")
 
                     with gr.Row(variant="compact"):
                         send_to_prompt_btn = gr.Button("应用到提示词", variant="primary")
@@ -446,11 +3765,14 @@ class StyleSelectorXL(scripts.Script):
                         add_category_btn = gr.Button("添加分类", variant="secondary", elem_classes=["small-button"])
                         delete_category_btn = gr.Button("删除分类", variant="secondary", elem_classes=["small-button"])
                         rename_category_btn = gr.Button("分类改名", variant="secondary", elem_classes=["small-button"])
+                        check_categories_btn = gr.Button("🩺 检查一致性", variant="secondary", elem_classes=["small-button"])
+                        repair_categories_btn = gr.Button("修复分类", variant="secondary", elem_classes=["small-button"])
                     category_feedback = gr.Textbox(
                         label="状态",
                         interactive=False,
                         elem_classes=["feedback-message"]
                     )
+                    category_version = gr.State(None)
 
                 with gr.Accordion("🛠️ 样式管理", open=False):
                     with gr.Row():
@@ -468,7 +3790,7 @@ class StyleSelectorXL(scripts.Script):
                             )
                             style_category = gr.Dropdown(
                                 choices=categories,
-                                value=self.current_category,
+                                value=current_category,
                                 label="分类"
                             )
                         with gr.Column(scale=1):
@@ -484,52 +3806,155 @@ class StyleSelectorXL(scripts.Script):
                         modify_btn = gr.Button("更新", variant="primary")
                         add_btn = gr.Button("添加", variant="primary")
                         delete_btn = gr.Button("删除", variant="secondary")
+                        rename_btn = gr.Button("✏️ 改名", variant="secondary")
+                        migrate_images_btn = gr.Button("🧹 整理预览图", variant="secondary")
+
+                    with gr.Row(variant="compact"):
+                        import_file = gr.File(label="批量导入（JSON / JSON Lines / CSV / styles.csv）",
+                                              file_types=[".json", ".jsonl", ".csv"])
+                        with gr.Column():
+                            import_duplicates = gr.Radio(choices=["跳过", "覆盖"], value="跳过", label="同名样式")
+                            import_btn = gr.Button("📥 导入到当前分类", variant="secondary")
+                        with gr.Column():
+                            export_format = gr.Radio(choices=list(EXPORT_FORMATS), value="JSON", label="导出格式")
+                            export_btn = gr.Button("📤 按分类导出", variant="secondary")
+                        export_file = gr.File(label="导出文件", interactive=False)
 
                     feedback_message = gr.Textbox(
                         label="状态",
                         interactive=False,
                         elem_classes=["feedback-message"]
                     )
+                    edit_version = gr.State(None)
+
+                with gr.Accordion("📊 诊断", open=False):
+                    diagnostics = gr.Markdown(render_diagnostics)
+                    with gr.Row():
+                        diagnostics_refresh_btn = gr.Button("🔄 刷新统计", variant="secondary")
+                        diagnostics_reset_btn = gr.Button("🗑️ 清零", variant="secondary")
 
         positive_box = self.boxxIMG if is_img2img else self.boxx
         negative_box = self.neg_prompt_boxIMG if is_img2img else self.neg_prompt_boxTXT
 
-        def update_style_choices(category):
-            return gr.update(choices=getStyles(category))
-
         def extract_generation_prompts(positive, negative):
             return positive, negative, "✅ 生图提示已提取!", "success"
 
+        def add_to_stack(style_name, stacked):
+            stacked = list(stacked or [])
+            if not style_name:
+                return gr.update(), "❌ 请先选择样式!", "error"
+            if style_name in stacked:
+                return gr.update(), "❌ 样式已在叠加列表中!", "error"
+            if len(stacked) >= MAX_STACKED_STYLES:
+                return gr.update(), f"❌ 最多叠加{MAX_STACKED_STYLES}个样式!", "error"
+            stacked.append(style_name)
+            return gr.update(choices=stacked, value=stacked), "✅ 已加入叠加列表!", "success"
+
         style.change(
             fn=get_style_image,
-            inputs=[style],
+            inputs=[style, show_original_image],
             outputs=[style_image_display]
         )
 
-        category_radio.change(
-            fn=update_style_choices,
-            inputs=[category_radio],
+        show_original_image.change(
+            fn=get_style_image,
+            inputs=[style, show_original_image],
+            outputs=[style_image_display]
+        )
+
+        for trigger in (style.change, stacked_styles.change):
+            trigger(fn=describe_style_tokens, inputs=[style, stacked_styles], outputs=[style_token_info])
+
+        browse_inputs = [search_box, search_mode, search_in_category, category_radio, page_number, show_gallery, style_sort]
+        first_page_inputs = [search_box, search_mode, search_in_category, category_radio, gr.State(1), show_gallery, style_sort]
+        browse_outputs = [style, page_number, page_info, style_gallery, gallery_names]
+
+        def browse_page(offset):
+            def browse(query, mode, only_category, category, page, gallery, sort):
+                return browse_styles(query, mode, only_category, category, (page or 1) + offset, gallery, sort)
+            return browse
+
+        def select_gallery_style(names, evt: gr.SelectData):
+            if 0 <= evt.index < len(names):
+                return names[evt.index]
+            return gr.update()
+
+        # 切换分类或修改搜索条件时回到第一页
+        for trigger in (category_radio.change, search_box.change, search_mode.change, search_in_category.change,
+                        style_sort.change):
+            trigger(fn=browse_page(0), inputs=first_page_inputs, outputs=browse_outputs)
+
+        show_gallery.change(fn=browse_page(0), inputs=browse_inputs, outputs=browse_outputs)
+        page_number.submit(fn=browse_page(0), inputs=browse_inputs, outputs=browse_outputs)
+        prev_page_btn.click(fn=browse_page(-1), inputs=browse_inputs, outputs=browse_outputs)
+        next_page_btn.click(fn=browse_page(1), inputs=browse_inputs, outputs=browse_outputs)
+
+        token_search_btn.click(
+            fn=find_styles_with_feedback,
+            inputs=[token_query, token_mode],
+            outputs=[style, page_info]
+        )
+        token_query.submit(
+            fn=find_styles_with_feedback,
+            inputs=[token_query, token_mode],
+            outputs=[style, page_info]
+        )
+
+        style_gallery.select(
+            fn=select_gallery_style,
+            inputs=[gallery_names],
             outputs=[style]
-        ).then(
-            fn=lambda cat: cat,
+        )
+
+        library_version.change(
+            fn=refresh_category_choices,
             inputs=[category_radio],
-            outputs=[category_radio]
+            outputs=[category_radio, style_category, category_version]
+        ).then(
+            fn=browse_page(0),
+            inputs=browse_inputs,
+            outputs=browse_outputs
         )
 
         refresh_btn.click(
-            fn=lambda cat: [gr.update(choices=getStyles(cat)), "🔄 样式已刷新!", "success"],
+            fn=reload_style_library,
             inputs=[category_radio],
-            outputs=[style, feedback_message, feedback_message]
+            outputs=[category_radio, style_category, category_version]
+        ).then(
+            fn=browse_page(0),
+            inputs=browse_inputs,
+            outputs=browse_outputs
+        ).then(
+            fn=lambda: ["🔄 样式已刷新!", "success"],
+            inputs=[],
+            outputs=[feedback_message, feedback_message]
+        )
+
+        stack_add_btn.click(
+            fn=add_to_stack,
+            inputs=[style, stacked_styles],
+            outputs=[stacked_styles, feedback_message, feedback_message]
+        )
+
+        stack_clear_btn.click(
+            fn=lambda: gr.update(choices=[], value=[]),
+            inputs=[],
+            outputs=[stacked_styles]
+        )
+
+        favorite_btn.click(
+            fn=toggle_favorite_style,
+            inputs=[style],
+            outputs=[feedback_message, feedback_message]
+        ).then(
+            fn=browse_page(0),
+            inputs=browse_inputs,
+            outputs=browse_outputs
         )
 
         send_to_prompt_btn.click(
-            fn=lambda s, pp, np: [
-                createPositive(s, pp),
-                createNegative(s, np),
-                "✅ 提示词已应用!",
-                "success"
-            ],
-            inputs=[style, positive_box, negative_box],
+            fn=apply_styles_to_prompts,
+            inputs=[style, stacked_styles, positive_box, negative_box],
             outputs=[positive_box, negative_box, feedback_message, feedback_message]
         )
 
@@ -546,9 +3971,9 @@ class StyleSelectorXL(scripts.Script):
         )
 
         extract_style_btn.click(
-            fn=get_style_details,
+            fn=get_style_details_for_edit,
             inputs=[style],
-            outputs=[new_name, new_positive, new_negative, style_category]
+            outputs=[new_name, new_positive, new_negative, style_category, edit_version]
         )
 
         extract_gen_btn.click(
@@ -565,60 +3990,139 @@ class StyleSelectorXL(scripts.Script):
 
         modify_btn.click(
             fn=modify_style_with_feedback,
-            inputs=[style, new_positive, new_negative, new_image, style_category],
-            outputs=[style, feedback_message, feedback_message]
+            inputs=[style, new_positive, new_negative, new_image, style_category, edit_version],
+            outputs=[style, feedback_message, feedback_message, edit_version]
         )
 
         delete_btn.click(
             fn=delete_style_with_feedback,
-            inputs=[style, category_radio],
+            inputs=[style, category_radio, edit_version],
+            outputs=[style, feedback_message, feedback_message]
+        )
+
+        check_categories_btn.click(
+            fn=check_categories_with_feedback,
+            inputs=[],
+            outputs=[category_feedback, category_feedback]
+        )
+
+        repair_categories_btn.click(
+            fn=repair_categories_with_feedback,
+            inputs=[category_version],
+            outputs=[category_feedback, category_feedback]
+        ).then(
+            fn=category_choices,
+            inputs=[],
+            outputs=[category_radio, style_category, category_version]
+        )
+
+        rename_btn.click(
+            fn=rename_style_with_feedback,
+            inputs=[style, new_name, category_radio, edit_version],
+            outputs=[style, feedback_message, feedback_message, edit_version]
+        )
+
+        migrate_images_btn.click(
+            fn=migrate_images_with_feedback,
+            inputs=[],
+            outputs=[feedback_message, feedback_message]
+        )
+
+        # 没有分类的记录导入到"样式管理"中选择的分类
+        import_btn.click(
+            fn=import_styles_with_feedback,
+            inputs=[import_file, import_duplicates, style_category],
             outputs=[style, feedback_message, feedback_message]
         )
 
+        export_btn.click(
+            fn=export_styles_with_feedback,
+            inputs=[export_format],
+            outputs=[export_file, feedback_message, feedback_message]
+        )
+
+        diagnostics_refresh_btn.click(fn=render_diagnostics, inputs=[], outputs=[diagnostics])
+        diagnostics_reset_btn.click(fn=reset_diagnostics, inputs=[], outputs=[diagnostics])
+
         add_category_btn.click(
             fn=add_category,
-            inputs=[new_category_name, emoji_dropdown],
+            inputs=[new_category_name, emoji_dropdown, category_version],
             outputs=[category_feedback, category_feedback]
         ).then(
-            fn=lambda: [gr.update(choices=get_categories()), gr.update(choices=get_categories())],
+            fn=category_choices,
             inputs=[],
-            outputs=[category_radio, style_category]
+            outputs=[category_radio, style_category, category_version]
         )
 
         delete_category_btn.click(
             fn=delete_category,
-            inputs=[category_radio],
+            inputs=[category_radio, category_version],
             outputs=[category_feedback, category_feedback]
         ).then(
-            fn=lambda: [gr.update(choices=get_categories()), gr.update(choices=get_categories())],
+            fn=category_choices,
             inputs=[],
-            outputs=[category_radio, style_category]
+            outputs=[category_radio, style_category, category_version]
         )
 
         rename_category_btn.click(
-            fn=lambda old_name, new_name: rename_category(old_name, new_name),
-            inputs=[category_radio, new_category_name],
+            fn=rename_category,
+            inputs=[category_radio, new_category_name, category_version],
             outputs=[category_feedback, category_feedback]
         ).then(
-            fn=lambda: [gr.update(choices=get_categories()), gr.update(choices=get_categories())],
+            fn=category_choices,
             inputs=[],
-            outputs=[category_radio, style_category]
+            outputs=[category_radio, style_category, category_version]
         )
 
-        return [is_enabled, style]
+        self.infotext_fields = [
+            (is_enabled, "样式选择器启用"),
+            (style, "样式选择器样式"),
+            (stacked_styles, parse_stacked_styles_infotext),
+        ]
 
-    def process(self, p, is_enabled, style):
-        if not is_enabled or not style:
+        startup_timings["ui"] += time.perf_counter() - ui_started
+        return [is_enabled, style, stacked_styles]
+
+    @metrics.timed("process")
+    def process(self, p, is_enabled, style, stacked_styles=None):
+        conditioning_cache.track(())
+        styles = get_style_stack(style, stacked_styles)
+        if not is_enabled or not styles:
             return
 
-        for i, prompt in enumerate(p.all_prompts):
-            p.all_prompts[i] = createPositive(style, prompt)
+        compiled = compile_style_stack(styles)
+        if compiled is None:
+            return
 
-        for i, prompt in enumerate(p.all_negative_prompts):
-            p.all_negative_prompts[i] = createNegative(style, prompt)
+        positives = compiled.apply_positive(p.all_prompts)
+        negatives = compiled.apply_negative(p.all_negative_prompts)
+        mode = getattr(shared.opts, "style_selector_token_budget", TOKEN_BUDGET_MODES[1])
+        if mode != TOKEN_BUDGET_MODES[0]:
+            trim = mode == TOKEN_BUDGET_MODES[2]
+            positives, crossed_positive = fit_token_budget(compiled, "positive", p.all_prompts, positives, trim)
+            negatives, crossed_negative = fit_token_budget(compiled, "negative", p.all_negative_prompts, negatives, trim)
+            if crossed_positive or crossed_negative:
+                metrics.inc("token_budget_crossed_total", crossed_positive + crossed_negative, action="trim" if trim else "warn")
+                action = "已裁剪样式片段" if trim else "每张图会多一次 CLIP 编码"
+                message = (f"样式「{compiled.name}」使 {crossed_positive} 条正向、{crossed_negative} 条反向提示词"
+                           f"跨过 {CLIP_CHUNK_TOKENS} token 分段边界，{action}")
+                print(f"⚠️ {message}")
+                if hasattr(p, "comment"):
+                    p.comment(message)
+        p.all_prompts[:] = positives
+        p.all_negative_prompts[:] = negatives
+        if conditioning_cache.max_bytes > 0:
+            conditioning_cache.track({*negatives, compiled.positive(""), compiled.negative("")})
 
         p.extra_generation_params["样式选择器启用"] = True
-        p.extra_generation_params["样式选择器样式"] = style
+        p.extra_generation_params["样式选择器样式"] = styles[0]
+        if len(styles) > 1:
+            p.extra_generation_params["样式选择器叠加样式"] = json.dumps(styles, ensure_ascii=False)
+        # ID 取自与套用时同一版本的样式库快照
+        parts = compiled.styles if isinstance(compiled, StyleStack) else [compiled]
+        style_ids = [part.style_id for part in parts if part.style_id]
+        p.extra_generation_params["样式选择器样式ID"] = ",".join(style_ids)
+        style_usage.record(style_ids)
 
     def after_component(self, component, **kwargs):
         if kwargs.get("elem_id") == "txt2img_prompt":
@@ -628,4 +4132,244 @@ class StyleSelectorXL(scripts.Script):
         if kwargs.get("elem_id") == "txt2img_neg_prompt":
             self.neg_prompt_boxTXT = component
         if kwargs.get("elem_id") == "img2img_neg_prompt":
-            self.neg_prompt_boxIMG = component
\ No newline at end of file
+            self.neg_prompt_boxIMG = component
+
+# 无界面 REST 接口：与界面共用同一个内存样式库，供任务调度等 API 客户端直接套用样式
+API_PREFIX = "/style-selector/v1"
+_etag_salt = f"{os.getpid():x}-{int(time.time()):x}"
+
+class StyleModel(BaseModel):
+    name: str
+    prompt: str = ""
+    negative_prompt: str = ""
+    category: str = ""
+
+class StyleUpdateModel(BaseModel):
+    # 未提供的字段保持原值
+    prompt: Optional[str] = None
+    negative_prompt: Optional[str] = None
+    category: Optional[str] = None
+
+class RenameRequest(BaseModel):
+    name: str
+
+class ApplyRequest(BaseModel):
+    styles: List[str]
+    prompt: str = ""
+    negative_prompt: str = ""
+
+class BatchApplyRequest(BaseModel):
+    styles: List[str]
+    prompts: List[str] = []
+    negative_prompts: List[str] = []
+    stack: bool = Field(False, description="为 true 时按顺序叠加全部样式，否则分别套用每个样式")
+
+def library_etag():
+    return f'W/"{_etag_salt}-{style_store.version}"'
+
+def _not_modified(request):
+    # 样式库版本未变化时返回 304，客户端可复用缓存的结果
+    etag = library_etag()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+def _with_etag(response, data):
+    response.headers["ETag"] = library_etag()
+    return data
+
+# 处理函数返回的错误信息对应的状态码，其余错误按请求无效返回 400
+_api_error_status = {
+    STYLE_CONFLICT_MESSAGE: 409,
+    "❌ 样式名称已存在!": 409,
+    "❌ 样式名称已被其他人使用!": 409,
+    "❌ 未找到样式!": 404,
+}
+
+def _raise_for(ok, message, status_code=400):
+    if not ok:
+        raise HTTPException(status_code=_api_error_status.get(message, status_code), detail=message)
+    return {"message": message}
+
+def _check_mode(mode, modes):
+    # 未知的匹配方式返回 400，不悄悄按默认方式搜索
+    if mode not in modes:
+        raise HTTPException(status_code=400, detail=f"❌ 未知的匹配方式: {mode}，可选: {'、'.join(modes)}")
+
+def api_dependencies():
+    # 与 WEBUI 自带的 API 一样，设置了 --api-auth 时所有接口都需要 HTTP Basic 认证
+    credentials = {}
+    for item in (getattr(shared.cmd_opts, "api_auth", None) or "").split(","):
+        if ":" in item:
+            user, password = item.strip().split(":", 1)
+            credentials[user] = password
+    if not credentials:
+        return []
+
+    def check_credentials(auth: HTTPBasicCredentials = Depends(HTTPBasic())):
+        password = credentials.get(auth.username)
+        if password is not None and secrets.compare_digest(auth.password, password):
+            return True
+        raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
+    return [Depends(check_credentials)]
+
+def _expected_version(request):
+    # 请求带 If-Match 时按其中 ETag 的版本做并发检查；其他进程或重启前签发的 ETag 一律视为过期
+    etag = request.headers.get("if-match")
+    if not etag:
+        return None
+    prefix = f'W/"{_etag_salt}-'
+    version = etag[len(prefix):-1] if etag.startswith(prefix) and etag.endswith('"') else ""
+    return int(version) if version.isdigit() else 0
+
+@metrics.timed("apply_batch")
+def _apply_batch(styles, prompts, negative_prompts):
+    compiled = compile_style_stack(styles)
+    if compiled is None:
+        raise HTTPException(status_code=404, detail="❌ 未找到样式!")
+    return {
+        "styles": list(compiled.names) if isinstance(compiled, StyleStack) else [compiled.name],
+        "prompts": compiled.apply_positive(prompts),
+        "negative_prompts": compiled.apply_negative(negative_prompts),
+    }
+
+def register_style_api(_: gr.Blocks, app: FastAPI):
+    # 与 WEBUI 自带的 API 一样只在 --api 启动时注册，可以修改和删除样式的接口不对未开启 API 的实例开放
+    cmd_opts = shared.cmd_opts
+    if not (getattr(cmd_opts, "api", False) or getattr(cmd_opts, "nowebui", False)):
+        return
+    router = APIRouter(prefix=API_PREFIX, dependencies=api_dependencies())
+
+    @router.get("/categories")
+    def api_categories(request: Request, response: Response):
+        return _not_modified(request) or _with_etag(response, {"categories": get_categories()})
+
+    @router.get("/styles")
+    def api_list_styles(request: Request, response: Response, category: Optional[str] = None, page: int = Query(1, ge=1),
+                        page_size: int = Query(STYLE_PAGE_SIZE, ge=1, le=STYLE_PAGE_SIZE_LIMIT), sort: str = STYLE_SORTS[0]):
+        if sort in STYLE_SORTS[1:]:
+            # 使用统计不属于样式库版本，按使用情况排序的结果不带 ETag
+            return search_styles("", category, page_size=page_size, sort=sort)
+        return _not_modified(request) or _with_etag(response, search_styles("", category, page=page, page_size=page_size))
+
+    @router.get("/search")
+    def api_search(request: Request, response: Response, q: str = "", mode: str = "前缀",
+                   category: Optional[str] = None, page: int = Query(1, ge=1),
+                   page_size: int = Query(STYLE_PAGE_SIZE, ge=1, le=STYLE_PAGE_SIZE_LIMIT)):
+        _check_mode(mode, SEARCH_MODES)
+        return _not_modified(request) or _with_etag(response, search_styles(q, category, mode, page, page_size))
+
+    @router.get("/search/prompt")
+    def api_search_prompt(request: Request, response: Response, q: str, mode: str = "and",
+                          limit: int = Query(STYLE_PAGE_SIZE, ge=1, le=STYLE_PAGE_SIZE_LIMIT)):
+        _check_mode(mode, PROMPT_SEARCH_MODES)
+        if not parse_prompt_query(q):
+            raise HTTPException(status_code=400, detail="❌ 请输入要查找的提示词!")
+        return _not_modified(request) or _with_etag(response, {"results": find_styles_by_prompt(q, mode, limit)})
+
+    @router.get("/styles/{name}")
+    def api_get_style(name: str, request: Request, response: Response):
+        template = style_store.get(name)
+        if template is None:
+            raise HTTPException(status_code=404, detail="❌ 未找到样式!")
+        return _not_modified(request) or _with_etag(response, dict(template))
+
+    @router.get("/styles/id/{style_id}")
+    def api_get_style_by_id(style_id: str, request: Request, response: Response):
+        template = style_store.get_by_id(style_id)
+        if template is None:
+            raise HTTPException(status_code=404, detail="❌ 未找到样式!")
+        return _not_modified(request) or _with_etag(response, dict(template))
+
+    @router.post("/styles/{name}/rename")
+    def api_rename_style(name: str, body: RenameRequest, request: Request, response: Response):
+        ok, message = rename_style(name, body.name, _expected_version(request))
+        return _with_etag(response, _raise_for(ok, message))
+
+    @router.post("/styles")
+    def api_add_style(style: StyleModel, response: Response):
+        ok, message = add_style(style.name, style.prompt, style.negative_prompt, style.category)
+        result = _raise_for(ok, message)
+        style_id = style_store.id_of(style.name)
+        result.update({"id": style_id, "revision": style_store.revision_of(style_id)})
+        return _with_etag(response, result)
+
+    @router.put("/styles/{name}")
+    def api_modify_style(name: str, style: StyleUpdateModel, request: Request, response: Response):
+        # 未带 If-Match 时以读取原值时的版本为准，避免部分更新覆盖并发的修改
+        expected_version = _expected_version(request)
+        if expected_version is None:
+            expected_version = style_store.current_version()
+        template = style_store.get(name) or {}
+        ok, message = modify_style(
+            name,
+            template.get('prompt', '') if style.prompt is None else style.prompt,
+            template.get('negative_prompt', '') if style.negative_prompt is None else style.negative_prompt,
+            template.get('category', '') if style.category is None else style.category,
+            expected_version=expected_version,
+        )
+        return _with_etag(response, _raise_for(ok, message))
+
+    @router.delete("/styles/{name}")
+    def api_delete_style(name: str, request: Request, response: Response):
+        ok, message = delete_style(name, _expected_version(request))
+        return _with_etag(response, _raise_for(ok, message))
+
+    @router.get("/export")
+    def api_export(format: str = "json", category: Optional[str] = None):
+        # 流式导出为单个 JSON 数组或 CSV 文件，可直接用于另一节点的批量导入
+        styles = (style for _, group in style_store.export_snapshot(category) for style in group)
+        if format.lower() == "csv":
+            return StreamingResponse(iter_styles_csv(styles), media_type="text/csv", headers={"ETag": library_etag()})
+        return StreamingResponse(iter_styles_json(styles), media_type="application/json", headers={"ETag": library_etag()})
+
+    @router.get("/metrics")
+    def api_metrics(format: str = "prometheus"):
+        # 默认输出 Prometheus 文本格式，format=json 时输出 JSON
+        if format.lower() == "json":
+            return metrics.as_json(library_gauges())
+        return PlainTextResponse(metrics.prometheus(library_gauges()), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @router.post("/apply")
+    def api_apply(body: ApplyRequest, response: Response):
+        result = _apply_batch(body.styles, [body.prompt], [body.negative_prompt])
+        return _with_etag(response, {"styles": result["styles"], "prompt": result["prompts"][0],
+                                     "negative_prompt": result["negative_prompts"][0]})
+
+    @router.post("/apply/batch")
+    def api_apply_batch(body: BatchApplyRequest, response: Response):
+        # 一次调用把 N 个样式套用到 M 条提示词上，避免逐条往返
+        if body.stack:
+            results = [_apply_batch(body.styles, body.prompts, body.negative_prompts)]
+        else:
+            results = [_apply_batch([name], body.prompts, body.negative_prompts) for name in body.styles]
+        return _with_etag(response, {"results": results})
+
+    app.include_router(router)
+
+def on_style_ui_settings():
+    section = ("style_selector", "样式选择器")
+    shared.opts.add_option("style_selector_pack_paths", shared.OptionInfo(
+        "", "额外的样式包路径（JSON 文件或文件夹，多个用逗号分隔）", section=section))
+    shared.opts.add_option("style_selector_watch_library", shared.OptionInfo(
+        True, "样式文件变化时自动重新加载（需重启生效）", section=section))
+    shared.opts.add_option("style_selector_metrics", shared.OptionInfo(
+        False, "记录性能统计（诊断面板和 /metrics 接口）", section=section, onchange=apply_metrics_setting))
+    shared.opts.add_option("style_selector_token_budget", shared.OptionInfo(
+        TOKEN_BUDGET_MODES[1], f"套用样式使提示词跨过 {CLIP_CHUNK_TOKENS} token 分段边界时", gr.Radio,
+        {"choices": TOKEN_BUDGET_MODES}, section=section))
+    shared.opts.add_option("style_selector_conditioning_cache_mb", shared.OptionInfo(
+        0, "样式提示词的文本编码缓存上限（MB，0 为关闭；缓存与模型在同一设备上）", gr.Slider,
+        {"minimum": 0, "maximum": 4096, "step": 64}, section=section, onchange=apply_conditioning_cache_setting))
+
+script_callbacks.on_app_started(register_style_api)
+script_callbacks.on_app_started(start_style_watcher)
+script_callbacks.on_app_started(report_startup_time)
+script_callbacks.on_app_started(apply_metrics_setting)
+script_callbacks.on_app_started(apply_conditioning_cache_setting)
+script_callbacks.on_infotext_pasted(on_style_infotext_pasted)
+script_callbacks.on_model_loaded(token_counter.reset)
+script_callbacks.on_script_unloaded(conditioning_cache.uninstall)
+script_callbacks.on_ui_settings(on_style_ui_settings)
+
+startup_timings["import"] = time.perf_counter() - _import_started
@@ -0,0 +1,77 @@
+# 测试公共工具：复用 benchmarks/stubs 中的 WebUI 替身，每个用例在独立的临时插件目录中重新加载样式选择器脚本
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+BENCHMARKS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCHMARKS_PATH not in sys.path:
+    sys.path.insert(0, BENCHMARKS_PATH)
+
+from common import load_extension, make_library, write_library  # noqa: E402
+
+
+class ExtensionTestCase(unittest.TestCase):
+    # 子类可以覆盖 library_size；为 None 时不写出样式文件
+    library_size = 3
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        if self.library_size is not None:
+            write_library(self.basedir, make_library(self.library_size, categories=2))
+        self.prepare()
+        self.module = load_extension(self.basedir)
+        self.store = self.module.style_store
+
+    def reload_extension(self):
+        # 模拟重启：在同一个插件目录中重新加载脚本，从文件和日志恢复样式库
+        self.module.flush_style_store()
+        self.module = load_extension(self.basedir)
+        self.store = self.module.style_store
+        return self.store
+
+    def prepare(self):
+        # 在加载脚本之前准备插件目录中的文件
+        pass
+
+    def tearDown(self):
+        self.module.flush_style_store()
+        shutil.rmtree(self.basedir, ignore_errors=True)
+
+    def path(self, *parts):
+        return os.path.join(self.basedir, *parts)
+
+    def read_bytes(self, *parts):
+        with open(self.path(*parts), 'rb') as file:
+            return file.read()
+
+    def write_bytes(self, content, *parts):
+        # 写入后调整修改时间，保证文件签名一定变化
+        path = self.path(*parts)
+        stat = os.stat(path) if os.path.exists(path) else None
+        with open(path, 'wb') as file:
+            file.write(content)
+        if stat is not None:
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+class ApiTestCase(ExtensionTestCase):
+    # 通过 TestClient 调用 /style-selector/v1 接口；替身中 --api 默认关闭，这里打开
+    def setUp(self):
+        super().setUp()
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+
+        self.module.shared.cmd_opts.api = True
+        app = FastAPI()
+        self.module.register_style_api(None, app)
+        self.client = TestClient(app)
+        self.prefix = self.module.API_PREFIX
+
+    def tearDown(self):
+        self.module.shared.cmd_opts.api = False
+        super().tearDown()
+
+    def get(self, path, **params):
+        return self.client.get(self.prefix + path, params=params)
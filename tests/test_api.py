@@ -0,0 +1,70 @@
+import unittest
+
+from helpers import ApiTestCase
+
+
+class SearchApiTest(ApiTestCase):
+    def test_search_modes(self):
+        for mode in self.module.SEARCH_MODES:
+            response = self.get("/search", q="style", mode=mode)
+            self.assertEqual(response.status_code, 200, response.text)
+            self.assertEqual(response.json()["total"], 3)
+
+    def test_unknown_search_mode_is_rejected(self):
+        self.assertEqual(self.get("/search", q="style", mode="regex").status_code, 400)
+
+    def test_prompt_search(self):
+        prompt = self.store.get("style-0000000")["prompt"].split(", ")[1]
+        response = self.get("/search/prompt", q=prompt)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn("style-0000000", [item["name"] for item in response.json()["results"]])
+
+    def test_empty_prompt_query_is_rejected(self):
+        self.assertEqual(self.get("/search/prompt", q="").status_code, 400)
+        self.assertEqual(self.get("/search/prompt", q=" , ").status_code, 400)
+
+    def test_unknown_prompt_mode_is_rejected(self):
+        self.assertEqual(self.get("/search/prompt", q="detailed", mode="xor").status_code, 400)
+
+
+class StyleApiTest(ApiTestCase):
+    def test_add_style(self):
+        response = self.client.post(f"{self.prefix}/styles", json={"name": "new", "prompt": "{prompt}, new"})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(self.store.get("new")["prompt"], "{prompt}, new")
+
+    def test_add_errors(self):
+        self.assertEqual(self.client.post(f"{self.prefix}/styles", json={"name": "  "}).status_code, 400)
+        self.assertEqual(self.client.post(f"{self.prefix}/styles", json={"name": "style-0000000"}).status_code, 409)
+
+    def test_missing_style(self):
+        self.assertEqual(self.get("/styles/missing").status_code, 404)
+        self.assertEqual(self.client.delete(f"{self.prefix}/styles/missing").status_code, 404)
+        self.assertEqual(self.client.put(f"{self.prefix}/styles/missing", json={"prompt": "x"}).status_code, 404)
+
+    def test_rename_to_existing_name(self):
+        response = self.client.post(f"{self.prefix}/styles/style-0000000/rename", json={"name": "style-0000001"})
+        self.assertEqual(response.status_code, 409)
+
+    def test_stale_if_match_is_a_conflict(self):
+        etag = self.get("/styles/style-0000000").headers["ETag"]
+        first = self.client.put(f"{self.prefix}/styles/style-0000000", json={"prompt": "first"}, headers={"If-Match": etag})
+        self.assertEqual(first.status_code, 200, first.text)
+        second = self.client.put(f"{self.prefix}/styles/style-0000000", json={"prompt": "second"}, headers={"If-Match": etag})
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "first")
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.get("/categories").headers["ETag"]
+        response = self.client.get(f"{self.prefix}/categories", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.module.add_style("changed", "{prompt}", "", "category-000")
+        response = self.client.get(f"{self.prefix}/categories", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_page_size(self):
+        self.assertEqual(self.get("/styles", page_size=0).status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
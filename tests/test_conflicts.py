@@ -0,0 +1,61 @@
+import unittest
+
+from helpers import ApiTestCase, ExtensionTestCase
+
+
+class ColdStoreEditTest(ExtensionTestCase):
+    # 脚本刚导入、样式库还没有被任何请求加载时（--nowebui 或直接从 Python 调用），
+    # 第一次修改不能因为读到加载前的版本 0 而被判为冲突
+
+    def test_first_modify_on_cold_store(self):
+        ok, message = self.module.modify_style("style-0000000", "{prompt}, changed", "", "category-000")
+        self.assertTrue(ok, message)
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, changed")
+
+    def test_first_delete_on_cold_store(self):
+        ok, message = self.module.delete_style("style-0000001")
+        self.assertTrue(ok, message)
+        self.assertIsNone(self.store.get("style-0000001"))
+
+    def test_first_rename_on_cold_store(self):
+        ok, message = self.module.rename_style("style-0000002", "renamed")
+        self.assertTrue(ok, message)
+        self.assertIsNotNone(self.store.get("renamed"))
+
+    def test_first_add_on_cold_store(self):
+        ok, message = self.module.add_style("fresh", "{prompt}, fresh", "", "category-000")
+        self.assertTrue(ok, message)
+
+
+class ColdStoreApiTest(ApiTestCase):
+    def test_first_put_is_not_a_conflict(self):
+        response = self.client.put(f"{self.prefix}/styles/style-0000000", json={"prompt": "{prompt}, via api"})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, via api")
+
+
+class ConflictDetectionTest(ExtensionTestCase):
+    def test_stale_version_is_rejected(self):
+        version = self.store.current_version()
+        self.assertTrue(self.module.modify_style("style-0000000", "first", "", "category-000", expected_version=version)[0])
+        ok, message = self.module.modify_style("style-0000000", "second", "", "category-000", expected_version=version)
+        self.assertFalse(ok)
+        self.assertEqual(message, self.module.STYLE_CONFLICT_MESSAGE)
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "first")
+
+    def test_unrelated_edit_does_not_conflict(self):
+        version = self.store.current_version()
+        self.assertTrue(self.module.modify_style("style-0000000", "first", "", "category-000", expected_version=version)[0])
+        ok, message = self.module.modify_style("style-0000001", "other", "", "category-001", expected_version=version)
+        self.assertTrue(ok, message)
+
+    def test_stale_category_version_is_rejected(self):
+        version = self.store.current_version()
+        self.assertTrue(self.module.rename_category("category-000", "renamed", version)[0])
+        ok, message, _ = self.module.delete_category("renamed", version)
+        self.assertFalse(ok)
+        self.assertEqual(message, self.module.CATEGORY_CONFLICT_MESSAGE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import io
+import json
+import os
+import time
+import unittest
+import zipfile
+
+from helpers import ExtensionTestCase
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+
+class JsonImportTest(ExtensionTestCase):
+    def test_items_are_parsed_across_chunks(self):
+        styles = [{"name": f"s{i}", "prompt": "x" * 1000} for i in range(200)]
+        items = list(self.module.iter_json_array(io.StringIO(json.dumps(styles))))
+        self.assertEqual(items, styles)
+
+    def test_malformed_upload_fails_without_buffering_it_whole(self):
+        size = self.module.IMPORT_MAX_ITEM_SIZE * 4
+        reader = CountingReader('[{"name": "a"}, {"name": "b", "prompt": "' + "x" * size)
+        items = self.module.iter_json_array(reader)
+        self.assertEqual(next(items), {"name": "a"})
+        with self.assertRaises(ValueError):
+            next(items)
+        self.assertLess(reader.consumed, size // 2)
+
+    def test_truncated_upload_is_reported(self):
+        with self.assertRaises(ValueError):
+            list(self.module.iter_json_array(io.StringIO('[{"name": "a"}, {"name": ')))
+
+
+class ArchiveExportTest(ExtensionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module.EXPORT_DIR = self.path("exports")
+
+    def test_exports_share_one_folder(self):
+        path = self.module.export_styles_archive("json")
+        self.assertEqual(os.path.dirname(os.path.dirname(path)), self.path("exports"))
+        with zipfile.ZipFile(path) as archive:
+            styles = [style for entry in archive.namelist() for style in json.loads(archive.read(entry))]
+        self.assertEqual(len(styles), 3)
+
+    def test_old_archives_are_removed_on_next_export(self):
+        old = self.module.export_styles_archive("json")
+        stale = time.time() - self.module.EXPORT_KEEP_SECONDS - 1
+        os.utime(os.path.dirname(old), (stale, stale))
+        recent = self.module.export_styles_archive("csv")
+        new = self.module.export_styles_archive("json")
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+        self.assertEqual(len(os.listdir(self.path("exports"))), 2)
+        self.assertTrue(os.path.exists(new))
+
+
+if __name__ == "__main__":
+    unittest.main()
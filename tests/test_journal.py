@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+import unittest
+
+from helpers import ExtensionTestCase
+
+
+class JournalSyncTest(ExtensionTestCase):
+    # 提交只追加日志行，fsync 由后台写入线程完成，不在请求线程上执行
+
+    def setUp(self):
+        super().setUp()
+        self.fsync_threads = []
+        os_module = self.module.os
+        real = os_module.fsync
+
+        def fsync(fd):
+            # 只记录日志文件的 fsync，加载时写快照等其他文件的 fsync 不算
+            journal_file = self.store.journal._file
+            if journal_file is not None and fd == journal_file.fileno():
+                self.fsync_threads.append(threading.current_thread().name)
+            return real(fd)
+        os_module.fsync = fsync
+        self.addCleanup(setattr, os_module, "fsync", real)
+
+    def journal_fsyncs(self):
+        self.module.style_writer.flush()
+        return self.fsync_threads
+
+    def test_batch_fsync_runs_on_writer_thread(self):
+        journal = self.store.journal
+        journal.fsync_every = 2
+        journal.fsync_interval = 60
+        self.store.ensure_loaded()
+        # 距上次 fsync 已经很久，提交时也不再同步 fsync
+        time.sleep(0.1)
+        self.assertTrue(self.module.add_style("a", "{prompt}, a", "", "category-000")[0])
+        self.assertEqual(self.fsync_threads, [])
+        self.assertTrue(self.module.add_style("b", "{prompt}, b", "", "category-000")[0])
+        self.assertEqual(self.journal_fsyncs(), ["style-selector-writer"])
+
+    def test_timed_fsync_runs_on_writer_thread(self):
+        journal = self.store.journal
+        journal.fsync_interval = 0.05
+        self.assertTrue(self.module.add_style("a", "{prompt}, a", "", "category-000")[0])
+        self.assertEqual(self.fsync_threads, [])
+        deadline = time.monotonic() + 5
+        while journal._unsynced and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.journal_fsyncs(), ["style-selector-writer"])
+
+
+class JournalReplayTest(ExtensionTestCase):
+    def edit(self):
+        module = self.module
+        self.assertTrue(module.add_style("added", "{prompt}, added", "", "category-000")[0])
+        self.assertTrue(module.modify_style("style-0000000", "{prompt}, modified", "", "category-001")[0])
+        self.assertTrue(module.rename_style("style-0000001", "renamed")[0])
+        self.assertTrue(module.delete_style("style-0000002")[0])
+        self.assertTrue(module.add_category("new-category", "")[0])
+
+    def assert_edited(self, store):
+        self.assertEqual(store.get("added")["prompt"], "{prompt}, added")
+        self.assertEqual(store.get("style-0000000")["prompt"], "{prompt}, modified")
+        self.assertEqual(store.get("style-0000000")["category"], "category-001")
+        self.assertIsNone(store.get("style-0000001"))
+        self.assertIsNotNone(store.get("renamed"))
+        self.assertIsNone(store.get("style-0000002"))
+        self.assertIn("new-category", store.category_names())
+
+    def test_edits_are_journaled_not_written_to_library(self):
+        original = self.read_bytes("sdxl_styles.json")
+        self.edit()
+        self.module.style_writer.flush()
+        self.assertEqual(self.read_bytes("sdxl_styles.json"), original)
+        self.assertEqual(len(self.store.journal.read()), 5)
+
+    def test_edits_are_replayed_after_restart(self):
+        self.edit()
+        self.assert_edited(self.reload_extension())
+
+    def test_torn_last_record_is_ignored(self):
+        self.edit()
+        self.module.flush_style_store()
+        with open(self.store.journal.file_path, "a", encoding="utf-8") as file:
+            file.write('[{"op": "delete", "id": ')
+        self.assert_edited(self.reload_extension())
+
+
+class CompactionTest(ExtensionTestCase):
+    def saved_names(self):
+        return sorted(style["name"] for style in json.loads(self.read_bytes("sdxl_styles.json")))
+
+    def test_compact_writes_library_and_removes_journal(self):
+        self.assertTrue(self.module.add_style("added", "{prompt}, added", "", "category-000")[0])
+        self.assertTrue(self.module.delete_style("style-0000002")[0])
+        self.store.compact()
+        self.assertFalse(os.path.exists(self.store.journal.file_path))
+        self.assertEqual(self.saved_names(), ["added", "style-0000000", "style-0000001"])
+        categories = json.loads(self.read_bytes("categories.json"))
+        self.assertIn("added", categories["category-000"])
+        store = self.reload_extension()
+        self.assertEqual(sorted(style["name"] for style in store.all_styles()), self.saved_names())
+
+    def test_compaction_runs_after_compact_every_commits(self):
+        self.store.COMPACT_EVERY = 2
+        self.assertTrue(self.module.add_style("a", "{prompt}, a", "", "category-000")[0])
+        self.module.style_writer.flush()
+        self.assertTrue(os.path.exists(self.store.journal.file_path))
+        self.assertTrue(self.module.add_style("b", "{prompt}, b", "", "category-000")[0])
+        self.module.style_writer.flush()
+        self.assertFalse(os.path.exists(self.store.journal.file_path))
+        self.assertIn("b", self.saved_names())
+
+    def test_edits_after_compaction_are_kept(self):
+        self.assertTrue(self.module.add_style("a", "{prompt}, a", "", "category-000")[0])
+        self.store.compact()
+        self.assertTrue(self.module.modify_style("a", "{prompt}, changed", "", "category-000")[0])
+        store = self.reload_extension()
+        self.assertEqual(store.get("a")["prompt"], "{prompt}, changed")
+
+
+if __name__ == "__main__":
+    unittest.main()
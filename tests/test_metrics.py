@@ -0,0 +1,21 @@
+import unittest
+
+from helpers import ExtensionTestCase
+
+
+class PrometheusExportTest(ExtensionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module.metrics.enabled = True
+        self.addCleanup(setattr, self.module.metrics, "enabled", False)
+
+    def test_token_budget_counter_is_exported(self):
+        self.module.metrics.inc("token_budget_crossed_total", 2, action="warn")
+        text = self.module.metrics.prometheus()
+        name = f"{self.module.metrics.PREFIX}_token_budget_crossed_total"
+        self.assertIn(f"# TYPE {name} counter", text)
+        self.assertIn(f'{name}{{action="warn"}} 2', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
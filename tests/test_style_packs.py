@@ -0,0 +1,67 @@
+import json
+import os
+import unittest
+
+from helpers import ExtensionTestCase
+
+PACK_STYLES = [
+    {"name": "pack-style", "prompt": "{prompt}, from pack", "negative_prompt": "", "category": "pack-category"},
+    {"name": "style-0000000", "prompt": "{prompt}, shadowed", "negative_prompt": "", "category": "category-000"},
+]
+
+
+class StylePackTest(ExtensionTestCase):
+    def prepare(self):
+        os.makedirs(self.path("style_packs"))
+        with open(self.path("style_packs", "one.json"), "w", encoding="utf-8") as file:
+            json.dump(PACK_STYLES, file)
+
+    def test_pack_styles_are_merged(self):
+        self.assertEqual(self.store.get("pack-style")["prompt"], "{prompt}, from pack")
+        self.assertEqual(self.store.pack_of("pack-style"), "one")
+        # 同名时以默认样式库为准
+        self.assertNotEqual(self.store.get("style-0000000")["prompt"], "{prompt}, shadowed")
+        self.assertIsNone(self.store.pack_of("style-0000000"))
+
+    def test_pack_style_is_read_only(self):
+        ok, _ = self.module.delete_style("pack-style")
+        self.assertFalse(ok)
+        ok, _ = self.module.rename_style("pack-style", "renamed")
+        self.assertFalse(ok)
+        self.assertEqual(self.store.pack_of("pack-style"), "one")
+
+    def test_modified_pack_style_reverts_when_deleted(self):
+        self.assertTrue(self.module.modify_style("pack-style", "{prompt}, modified", "", "pack-category")[0])
+        self.assertEqual(self.store.get("pack-style")["prompt"], "{prompt}, modified")
+        self.assertIsNone(self.store.pack_of("pack-style"))
+        self.assertTrue(self.module.delete_style("pack-style")[0])
+        self.assertEqual(self.store.get("pack-style")["prompt"], "{prompt}, from pack")
+        self.assertEqual(self.store.pack_of("pack-style"), "one")
+
+    def test_revert_survives_restart(self):
+        self.assertTrue(self.module.modify_style("pack-style", "{prompt}, modified", "", "pack-category")[0])
+        self.assertTrue(self.module.delete_style("pack-style")[0])
+        store = self.reload_extension()
+        self.assertEqual(store.get("pack-style")["prompt"], "{prompt}, from pack")
+
+    def test_deleting_shadowing_style_reveals_pack_version(self):
+        self.assertTrue(self.module.delete_style("style-0000000")[0])
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, shadowed")
+        self.assertEqual(self.store.pack_of("style-0000000"), "one")
+
+    def test_compaction_leaves_pack_styles_out_of_library(self):
+        self.assertTrue(self.module.modify_style("pack-style", "{prompt}, modified", "", "pack-category")[0])
+        self.store.compact()
+        saved = {style["name"]: style for style in json.loads(self.read_bytes("sdxl_styles.json"))}
+        # 修改过的包样式保存在默认样式库中，未修改的包样式不写入
+        self.assertEqual(saved["pack-style"]["prompt"], "{prompt}, modified")
+        self.assertEqual(len(saved), 4)
+        self.assertTrue(self.module.delete_style("pack-style")[0])
+        self.store.compact()
+        saved = {style["name"] for style in json.loads(self.read_bytes("sdxl_styles.json"))}
+        self.assertNotIn("pack-style", saved)
+        self.assertEqual(self.store.get("pack-style")["prompt"], "{prompt}, from pack")
+
+
+if __name__ == "__main__":
+    unittest.main()
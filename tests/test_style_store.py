@@ -0,0 +1,173 @@
+import json
+import os
+import time
+import unittest
+
+from helpers import ExtensionTestCase
+
+
+class CorruptLibraryTest(ExtensionTestCase):
+    def break_library(self):
+        content = self.read_bytes("sdxl_styles.json")
+        broken = content[:len(content) // 2]
+        self.write_bytes(broken, "sdxl_styles.json")
+        return broken
+
+    def test_malformed_library_keeps_previous_styles(self):
+        names = [style["name"] for style in self.store.all_styles()]
+        self.assertEqual(len(names), 3)
+        self.break_library()
+        self.store.refresh()
+        self.assertIsNotNone(self.store.load_error)
+        self.assertEqual(sorted(style["name"] for style in self.store.all_styles()), sorted(names))
+
+    def test_malformed_library_survives_repair_and_compaction(self):
+        self.store.refresh()
+        broken = self.break_library()
+        message, kind = self.module.repair_categories_with_feedback()
+        self.assertEqual(kind, "error")
+        with self.assertRaises(self.module.StyleLibraryError):
+            self.store.compact()
+        # 达到压缩阈值时后台压缩同样被拒绝，修改仍保存在日志中
+        self.store.COMPACT_EVERY = 1
+        ok, _ = self.module.add_style("new-style", "{prompt}, new", "", "category-000")
+        self.assertTrue(ok)
+        self.module.style_writer.flush()
+        self.assertEqual(self.read_bytes("sdxl_styles.json"), broken)
+
+    def test_library_recovers_when_file_is_fixed(self):
+        self.store.refresh()
+        original = self.read_bytes("sdxl_styles.json")
+        self.break_library()
+        self.store.refresh()
+        self.module.add_style("added-while-broken", "{prompt}, x", "", "category-000")
+        self.write_bytes(original, "sdxl_styles.json")
+        self.store.refresh()
+        self.assertIsNone(self.store.load_error)
+        self.assertIsNotNone(self.store.get("added-while-broken"))
+        self.store.compact()
+        saved = json.loads(self.read_bytes("sdxl_styles.json"))
+        self.assertEqual(len(saved), 4)
+
+
+class CorruptLibraryColdStartTest(ExtensionTestCase):
+    def prepare(self):
+        self.broken = b'[{"name": "a", "prompt": "{prompt}, a"'
+        self.write_bytes(self.broken, "sdxl_styles.json")
+
+    def test_cold_start_does_not_overwrite_malformed_file(self):
+        self.store.refresh()
+        self.assertIsNotNone(self.store.load_error)
+        self.assertEqual(self.store.all_styles(), [])
+        self.assertEqual(self.module.repair_categories_with_feedback()[1], "error")
+        with self.assertRaises(self.module.StyleLibraryError):
+            self.store.compact()
+        self.assertEqual(self.read_bytes("sdxl_styles.json"), self.broken)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class JournalRebaseTest(ExtensionTestCase):
+    # 日志记录它所基于的样式文件摘要；同步程序推送了新文件后，日志不能直接覆盖新文件中的修改
+
+    def push_library(self, change):
+        styles = json.loads(self.read_bytes("sdxl_styles.json"))
+        change(styles)
+        self.write_bytes(json.dumps(styles).encode("utf-8"), "sdxl_styles.json")
+
+    def saved_styles(self):
+        return {style["name"]: style for style in json.loads(self.read_bytes("sdxl_styles.json"))}
+
+    def test_journal_replays_on_unchanged_base(self):
+        self.assertTrue(self.module.modify_style("style-0000000", "{prompt}, local", "", "category-000")[0])
+        self.module.style_writer.flush()
+        reloaded = self.reload_extension()
+        self.assertEqual(reloaded.get("style-0000000")["prompt"], "{prompt}, local")
+
+    def test_push_is_merged_with_local_edits(self):
+        self.assertTrue(self.module.modify_style("style-0000000", "{prompt}, local", "", "category-000")[0])
+
+        def change(styles):
+            styles[1]["prompt"] = "{prompt}, pushed"
+            styles.append({"name": "pushed-style", "prompt": "{prompt}, new", "negative_prompt": "", "category": "category-001"})
+        self.push_library(change)
+        self.store.refresh()
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, local")
+        self.assertEqual(self.store.get("style-0000001")["prompt"], "{prompt}, pushed")
+        self.assertIsNotNone(self.store.get("pushed-style"))
+        # 合并后立即压缩，日志改为以新文件为基准
+        self.assertFalse(os.path.exists(self.store.journal.file_path))
+        saved = self.saved_styles()
+        self.assertEqual(saved["style-0000000"]["prompt"], "{prompt}, local")
+        self.assertEqual(saved["style-0000001"]["prompt"], "{prompt}, pushed")
+        self.assertFalse(os.path.exists(self.store.rejected_path))
+
+    def test_conflicting_local_edit_is_set_aside(self):
+        self.assertTrue(self.module.modify_style("style-0000000", "{prompt}, local", "", "category-000")[0])
+        self.assertTrue(self.module.delete_style("style-0000001")[0])
+
+        def change(styles):
+            styles[0]["prompt"] = "{prompt}, pushed"
+        self.push_library(change)
+        self.store.refresh()
+        # 推送的内容优先，本地冲突的修改另存；不冲突的删除照常合并
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, pushed")
+        self.assertIsNone(self.store.get("style-0000001"))
+        self.assertEqual(self.saved_styles()["style-0000000"]["prompt"], "{prompt}, pushed")
+        with open(self.store.rejected_path, encoding="utf-8") as file:
+            rejected = [json.loads(line) for line in file]
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual([op["style"]["prompt"] for op in rejected[0]], ["{prompt}, local"])
+
+    def test_push_that_already_contains_the_edit_is_not_a_conflict(self):
+        self.assertTrue(self.module.modify_style("style-0000000", "{prompt}, local", "", "category-000")[0])
+        local = dict(self.store.get("style-0000000"))
+
+        def change(styles):
+            styles[0] = local
+        self.push_library(change)
+        self.store.refresh()
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, local")
+        self.assertFalse(os.path.exists(self.store.rejected_path))
+
+
+
+class BackgroundReloadTest(ExtensionTestCase):
+    # 请求线程只读取已加载的样式库；文件变化后由监视线程在文件稳定后重新加载并整体替换
+
+    def push_prompt(self, prompt):
+        styles = json.loads(self.read_bytes("sdxl_styles.json"))
+        styles[0]["prompt"] = prompt
+        self.write_bytes(json.dumps(styles).encode("utf-8"), "sdxl_styles.json")
+
+    def test_read_paths_do_not_reload(self):
+        version = self.store.current_version()
+        prompt = self.store.get("style-0000000")["prompt"]
+        self.push_prompt("{prompt}, pushed")
+        self.assertEqual(self.store.get("style-0000000")["prompt"], prompt)
+        self.assertEqual(len(self.store.names("category-000")), 2)
+        self.assertEqual(self.store.version, version)
+
+    def test_watcher_reloads_after_change(self):
+        self.store.ensure_loaded()
+        watcher = self.module.style_watcher
+        watcher.POLL_INTERVAL = watcher.DEBOUNCE = 0.05
+        watcher.INOTIFY_TIMEOUT = 0.2
+        watcher.start()
+        self.push_prompt("{prompt}, pushed")
+        deadline = time.monotonic() + 10
+        while self.store.get("style-0000000")["prompt"] != "{prompt}, pushed" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, pushed")
+
+    def test_edit_sees_external_change(self):
+        # 修改在文件锁内重新加载，基于旧版本的修改被判为冲突而不是覆盖外部更新
+        version = self.store.current_version()
+        self.push_prompt("{prompt}, pushed")
+        ok, message = self.module.modify_style("style-0000000", "{prompt}, local", "", "category-000",
+                                               expected_version=version)
+        self.assertFalse(ok)
+        self.assertEqual(message, self.module.STYLE_CONFLICT_MESSAGE)
+        self.assertEqual(self.store.get("style-0000000")["prompt"], "{prompt}, pushed")